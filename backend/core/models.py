@@ -7,9 +7,9 @@ from kalendario.common.model_mixins import CleanSaveMixin
 from core import managers
 from scheduling.models import Customer
 
-PERMISSIONS = ('company', 'historicalappointment', 'appointment', 'employee', 'shift', 'schedule', 'service',
-               'servicecategory', 'customer', 'config', 'schedulingpanel', 'groupprofile', 'user', 'request',
-               'account')
+PERMISSIONS = ('company', 'historicalappointment', 'appointment', 'appointmentseries', 'employee', 'shift',
+               'schedule', 'service', 'servicecategory', 'customer', 'config', 'schedulingpanel', 'groupprofile',
+               'user', 'request', 'account')
 
 
 def permissions():
@@ -0,0 +1,115 @@
+import datetime
+import math
+
+from customers import intervals, availability_cache
+from customers.customException import InvalidActionException
+from scheduling.models import Appointment, AppointmentSeries, Schedule
+
+MINUTES_IN_DAY = 24 * 60
+
+
+class AvailabilityLoader:
+    """
+    Loads the schedules, time frames and appointments of a group of employees for a date range in a constant number
+    of queries, the availability of each employee is then computed in memory.
+    All the intervals returned are in minutes from the origin (the midnight of the start date).
+    """
+
+    def __init__(self, employees, start, end, customer=None):
+        if start < datetime.datetime.now():
+            start = datetime.datetime.now()
+
+        if end.date() <= datetime.date.today():
+            raise InvalidActionException("Date can't be in the past")
+
+        self.start, self.end = start, end
+        self.origin = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        self.days = max(0, math.ceil((end - self.origin) / datetime.timedelta(days=1)))
+        self.employees = list(employees)
+
+        self._customer_busy = self._load_customer_busy(customer)
+        self._free = self._load_free()
+
+    def day(self, index):
+        """Returns the midnight of the day index days after the origin"""
+        return self.origin + datetime.timedelta(days=index)
+
+    @property
+    def range_end(self):
+        return self.day(self.days)
+
+    def _to_interval(self, start, end):
+        return intervals.to_minutes(self.origin, start), intervals.to_minutes(self.origin, end)
+
+    def _load_customer_busy(self, customer):
+        if not customer:
+            return []
+        appointments = Appointment.objects.overlapping(self.origin, self.range_end, customer_id=customer.id)
+        periods = list(appointments.values_list('start', 'end'))
+        periods += [(occurrence.start, occurrence.end) for occurrence in
+                    AppointmentSeries.objects.filter(customer_id=customer.id).occurrences(self.origin, self.range_end)]
+        return intervals.normalize(self._to_interval(start, end) for start, end in periods)
+
+    def _load_free(self):
+        """
+        Looks up the free intervals of every employee for every day in the availability cache,
+        the days missing from the cache are computed from the schedules and appointments of the employees they belong to
+        :return: a dict with the employee id as key and the free intervals of the whole range as value
+        """
+        days = [self.day(index).date() for index in range(self.days)]
+        keys = availability_cache.get_keys(self.employees, days)
+        per_day = availability_cache.get_many(keys)
+
+        missing = [employee for employee in self.employees
+                   if any((employee.id, day) not in per_day for day in days)]
+        if missing:
+            computed = self._compute_free(missing)
+            computed = {key: value for key, value in computed.items() if key not in per_day}
+            availability_cache.set_many(keys, computed)
+            per_day.update(computed)
+
+        free = {}
+        for employee in self.employees:
+            free[employee.id] = [(index * MINUTES_IN_DAY + start, index * MINUTES_IN_DAY + end)
+                                 for index, day in enumerate(days) for start, end in per_day[(employee.id, day)]]
+        return free
+
+    def _compute_free(self, employees):
+        """
+        Computes the free intervals of the employees from their schedule's week templates and appointments
+        :return: a dict with (employee id, date) as key and a tuple of free intervals in minutes of the day as value
+        """
+        weeks = Schedule.objects.week_templates({e.schedule for e in employees if e.schedule is not None})
+
+        busy = {employee.id: [] for employee in employees}
+        appointments = Appointment.objects.overlapping(self.origin, self.range_end, employee_id__in=[*busy])
+        for employee_id, start, end in appointments.values_list('employee_id', 'start', 'end'):
+            busy[employee_id].append(self._to_interval(start, end))
+        # the occurrences of the series aren't stored, they are expanded for the range
+        series = AppointmentSeries.objects.filter(employee_id__in=[*busy])
+        for occurrence in series.occurrences(self.origin, self.range_end):
+            busy[occurrence.employee_id].append(self._to_interval(occurrence.start, occurrence.end))
+
+        computed = {}
+        for employee in employees:
+            week = weeks.get(employee.schedule_id)
+            frames = [] if week is None else [
+                (index * MINUTES_IN_DAY + start, index * MINUTES_IN_DAY + end)
+                for index in range(self.days) for start, end in week[self.day(index).weekday()]
+            ]
+            free_by_day = {index: [] for index in range(self.days)}
+            for start, end in intervals.subtract(intervals.normalize(frames), intervals.normalize(busy[employee.id])):
+                # frames never cross midnight so each free interval belongs to a single day
+                index = start // MINUTES_IN_DAY
+                free_by_day[index].append((start - index * MINUTES_IN_DAY, end - index * MINUTES_IN_DAY))
+            computed.update({(employee.id, self.day(index).date()): tuple(day_free)
+                             for index, day_free in free_by_day.items()})
+        return computed
+
+    def free_intervals(self, employee):
+        """
+        Returns the free intervals of the employee, intervals that start before the start of the range are dropped
+        """
+        threshold = self.start - self.origin
+        free = intervals.subtract(self._free[employee.id], self._customer_busy)
+        return [(start, end) for start, end in free if datetime.timedelta(minutes=start) > threshold]
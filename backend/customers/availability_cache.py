@@ -0,0 +1,75 @@
+"""
+Cache of the free intervals of an employee per day.
+Entries are keyed by the employee and schedule versions, so any change to the employee's appointments or schedule makes
+the previous entries unreachable instead of having to find and delete them.
+The cached intervals don't include the customer appointments nor the start of the search, those are applied on top.
+"""
+from django.core.cache import cache
+from django.db import transaction
+
+from kalendario.common import cache as versioned_cache
+from scheduling.managers import week_template_version_key
+
+AVAILABILITY_CACHE_TIMEOUT = 60 * 60
+HITS_KEY, MISSES_KEY = 'availability:hits', 'availability:misses'
+
+
+def employee_version_key(employee_id):
+    return f'employee:{employee_id}:availability:version'
+
+
+def get_keys(employees, days):
+    """
+    :return: a dict with (employee id, date) as key and the cache key of the free intervals of that day as value
+    """
+    version_keys = {e.id: (employee_version_key(e.id), week_template_version_key(e.schedule_id)) for e in employees}
+    versions = versioned_cache.get_versions([key for keys in version_keys.values() for key in keys])
+    return {(e.id, day): 'availability:{}:{}:{}:{}'.format(e.id, versions[version_keys[e.id][0]],
+                                                           versions[version_keys[e.id][1]], day.isoformat())
+            for e in employees for day in days}
+
+
+def get_many(keys):
+    """
+    :param keys: the dict returned by get_keys
+    :return: a dict with (employee id, date) as key and a tuple of free intervals in minutes of the day as value
+    """
+    cached = cache.get_many(keys.values())
+    found = {key: cached[cache_key] for key, cache_key in keys.items() if cache_key in cached}
+    _count(HITS_KEY, len(found))
+    _count(MISSES_KEY, len(keys) - len(found))
+    return found
+
+
+def set_many(keys, values):
+    cache.set_many({keys[key]: value for key, value in values.items()}, AVAILABILITY_CACHE_TIMEOUT)
+
+
+def invalidate(employee_ids):
+    """
+    Makes the cached availability of the employees unreachable once the current transaction commits, otherwise the
+    availability read by another process before the commit could be cached with the new version
+    """
+    keys = [employee_version_key(pk) for pk in employee_ids if pk is not None]
+    transaction.on_commit(lambda: versioned_cache.bump_versions(keys))
+
+
+def _count(key, amount):
+    if amount == 0:
+        return
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        pass
+
+
+def stats():
+    """Returns the amount of cache hits and misses of free intervals per employee per day"""
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    hits, misses = counters.get(HITS_KEY, 0), counters.get(MISSES_KEY, 0)
+    return {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses) if hits + misses else 0}
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
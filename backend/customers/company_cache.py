@@ -0,0 +1,74 @@
+"""
+Cache of the rendered public pages of the companies.
+The page of a company is keyed by its public version, see Company.public_version, and the listings by a version shared
+by all the companies as any change can move a company in or out of a listing, so a change makes the previous entries
+unreachable instead of having to find and delete them.
+The public version of each company and the id of each slug are cached too, so a page found in the cache doesn't cost
+any query. Those entries are deleted once the changes are committed, see customers.signals.
+"""
+import hashlib
+
+from django.core.cache import cache
+from django.db import transaction
+
+from kalendario.common import cache as versioned_cache
+from scheduling.models import Company
+
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# bounds how long a version read while a change was being committed is served
+VERSION_CACHE_TIMEOUT = 60 * 5
+LISTING_VERSION_KEY = 'companies:public:listing:version'
+
+
+def slug_key(slug):
+    # the names of the companies can have characters that aren't allowed in the keys of some cache backends
+    return 'company:slug:{}'.format(hashlib.md5(slug.encode()).hexdigest())
+
+
+def version_key(company_id):
+    return f'company:{company_id}:public:version'
+
+
+def page_key(company_id, version):
+    return f'company:{company_id}:public:{version}'
+
+
+def listing_key(url):
+    """:param url: the absolute url of the listing, the links to the other pages are built from it"""
+    version = versioned_cache.get_version(LISTING_VERSION_KEY)
+    return 'companies:public:{}:{}'.format(version, hashlib.md5(url.encode()).hexdigest())
+
+
+def get_public_company(lookup):
+    """
+    Returns the id and the public version of the company looked up by its id or slug, or None when it isn't public.
+    The names of the companies are accepted as slugs too
+    """
+    slug = None
+    if lookup.isnumeric():
+        company_id = int(lookup)
+    else:
+        slug = Company.slugify(lookup)
+        company_id = cache.get(slug_key(slug))
+    version = cache.get(version_key(company_id)) if company_id is not None else None
+    if version is None:
+        queryset = Company.objects.get_public()
+        queryset = queryset.filter(pk=company_id) if company_id is not None else queryset.filter(slug=slug)
+        company = queryset.values_list('id', 'public_version').first()
+        if company is None:
+            return None
+        company_id, version = company
+        cache.set(version_key(company_id), version, VERSION_CACHE_TIMEOUT)
+        if slug is not None:
+            cache.set(slug_key(slug), company_id, PAGE_CACHE_TIMEOUT)
+    return company_id, version
+
+
+def invalidate(company_ids, slugs=()):
+    """Makes the cached pages of the companies and the listings unreachable once the current transaction commits"""
+    keys = [version_key(pk) for pk in company_ids if pk is not None] + [slug_key(slug) for slug in slugs if slug]
+
+    def delete():
+        cache.delete_many(keys)
+        versioned_cache.bump_version(LISTING_VERSION_KEY)
+    transaction.on_commit(delete)
@@ -0,0 +1,116 @@
+"""
+Interval arithmetic used by the availability engine.
+
+An interval is a (start, end) tuple of integer minutes counted from an origin datetime, usually the midnight of the
+first day being searched. Working with integers keeps the subtraction of appointments from time frames a single
+linear pass over two sorted lists instead of repeatedly rebuilding lists of datetime objects.
+"""
+import bisect
+import datetime
+
+
+def to_minutes(origin, value):
+    """Returns the amount of whole minutes between origin and value"""
+    return int((value - origin).total_seconds()) // 60
+
+
+def duration_minutes(duration):
+    """Returns the amount of whole minutes in the timedelta"""
+    return int(duration.total_seconds()) // 60
+
+
+def from_minutes(origin, minutes):
+    """Returns the datetime that is the amount of minutes after origin"""
+    return origin + datetime.timedelta(minutes=minutes)
+
+
+def normalize(intervals):
+    """
+    Sorts the intervals and merges the ones that overlap each other, intervals that only touch are kept apart
+    :return: a list of disjoint intervals sorted by start, empty intervals are dropped
+    """
+    merged = []
+    for start, end in sorted(intervals):
+        if end <= start:
+            continue
+        if merged and start < merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def subtract(free, busy):
+    """
+    Removes the busy intervals from the free intervals in one pass over both lists
+    :param free: disjoint intervals sorted by start
+    :param busy: disjoint intervals sorted by start
+    :return: a list of disjoint, non empty intervals sorted by start
+    """
+    result = []
+    i, busy_len = 0, len(busy)
+    for start, end in free:
+        # busy intervals that finished before this free interval can't affect it or any interval after it
+        while i < busy_len and busy[i][1] <= start:
+            i += 1
+        j = i
+        while j < busy_len and busy[j][0] < end:
+            busy_start, busy_end = busy[j]
+            if busy_start > start:
+                result.append((start, busy_start))
+            start = max(start, busy_end)
+            if start >= end:
+                break
+            j += 1
+        if start < end:
+            result.append((start, end))
+    return result
+
+
+def slot_starts(free, duration, step=None):
+    """
+    Yields the start of every slot of duration minutes that fits in the free intervals
+    :param step: minutes between the start of two consecutive slots, defaults to the duration
+    """
+    if duration <= 0:
+        return
+    step = step or duration
+    for start, end in free:
+        yield from range(start, end - duration + 1, step)
+
+
+def fit_windows(free, duration):
+    """
+    Returns the windows of possible starts for a slot of duration minutes in the free intervals,
+    a window (start, end) means the slot can start at any minute from start up to but excluding end
+    """
+    return [(start, end - duration + 1) for start, end in free if end - start >= duration]
+
+
+def intersect(a, b):
+    """
+    Returns the intervals covered by both lists in one pass over them
+    :param a: disjoint intervals sorted by start
+    :param b: disjoint intervals sorted by start
+    """
+    result = []
+    i = j = 0
+    while i < len(a) and j < len(b):
+        start, end = max(a[i][0], b[j][0]), min(a[i][1], b[j][1])
+        if start < end:
+            result.append((start, end))
+        if a[i][1] < b[j][1]:
+            i += 1
+        else:
+            j += 1
+    return result
+
+
+def contains(intervals, value):
+    """
+    Returns true if value is inside one of the intervals
+    :param intervals: disjoint intervals sorted by start
+    """
+    index = bisect.bisect_right(intervals, (value, float('inf'))) - 1
+    return index >= 0 and intervals[index][0] <= value < intervals[index][1]
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from customers import availability_cache
+
+
+class Command(BaseCommand):
+    help = 'Shows the hits and misses of the availability cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Resets the counters after showing them')
+
+    def handle(self, *args, **options):
+        stats = availability_cache.stats()
+        self.stdout.write(f"hits: {stats['hits']}, misses: {stats['misses']}, hit rate: {stats['hit_rate']:.2%}")
+        if options['reset']:
+            availability_cache.reset_stats()
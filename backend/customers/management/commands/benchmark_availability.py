@@ -0,0 +1,206 @@
+"""
+Benchmarks the availability engine against synthetic companies built with the test factories.
+Every combination of the options provided is measured on its own company, the data is created inside a transaction
+that is rolled back at the end so the command doesn't leave anything behind.
+e.g: python manage.py benchmark_availability --employees 5 50 --days 7 30 --output benchmarks.jsonl
+"""
+import datetime
+import itertools
+import json
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from customers import availability_cache
+from customers.models import get_availability, get_availability_for_service
+from scheduling import models
+from scheduling.tests import factories
+
+# the frames of each working day as (start, end) hours and the amount of working days from monday
+SCHEDULE_SHAPES = {
+    'day': (((9, 17),), 5),
+    'split': (((9, 13), (14, 18)), 6),
+    'long': (((7, 22),), 7),
+}
+SERVICE_DURATIONS = (30, 45, 60)
+
+
+class Tenant:
+    def __init__(self, company, employees, services, start, end):
+        self.company = company
+        self.employees = employees
+        self.services = services
+        self.start = start
+        self.end = end
+
+
+def build_schedule(company, shape):
+    frames, working_days = SCHEDULE_SHAPES[shape]
+    shift = factories.ShiftFactory.create()
+    for start, end in frames:
+        factories.TimeFrameFactory.create(shift=shift, start=datetime.time(start), end=datetime.time(end))
+    week = {day: shift for day in ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')[:working_days]}
+    return factories.ScheduleFactory.create(owner=company, **week)
+
+
+def build_appointments(tenant, schedule, density, rng):
+    """Books density non overlapping appointments per employee on every working day of the tenant's range"""
+    customer = factories.CustomerFactory.create(owner=tenant.company)
+    appointments = []
+    day = tenant.start
+    while day < tenant.end:
+        frames = schedule.get_week_template()[day.weekday()]
+        for employee, service in zip(tenant.employees, itertools.cycle(tenant.services)):
+            duration = int(service.duration.total_seconds()) // 60
+            starts = [minute for frame_start, frame_end in frames
+                      for minute in range(frame_start, frame_end - duration + 1, duration)]
+            for minute in rng.sample(starts, min(density, len(starts))):
+                start = day + datetime.timedelta(minutes=minute)
+                appointments.append(models.Appointment(owner=tenant.company, employee=employee, customer=customer,
+                                                       service=service, start=start, end=start + service.duration,
+                                                       status=models.Appointment.ACCEPTED))
+        day += datetime.timedelta(days=1)
+    models.Appointment.objects.bulk_create(appointments)
+
+
+def build_tenant(employees, services, days, density, shape, rng):
+    company = factories.CompanyFactory.create(name=f'benchmark {time.time_ns()}')
+    schedule = build_schedule(company, shape)
+    service_list = [factories.ServiceFactory.create(owner=company, duration=datetime.timedelta(
+        minutes=SERVICE_DURATIONS[i % len(SERVICE_DURATIONS)])) for i in range(services)]
+    employee_list = []
+    for _ in range(employees):
+        employee = factories.EmployeeFactory.create(owner=company, schedule=schedule)
+        employee.services.set(service_list)
+        employee_list.append(employee)
+
+    start = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+    tenant = Tenant(company, employee_list, service_list, start, start + datetime.timedelta(days=days))
+    build_appointments(tenant, schedule, density, rng)
+    return tenant
+
+
+class QueryCounter:
+    """Counts the queries executed while installed with connection.execute_wrapper"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def measure(func, repeat, before=None):
+    """
+    Runs func repeat times and once more while tracing the memory allocations
+    :param before: called before every run, outside of the measurements
+    :return: the wall times in milliseconds, the amount of queries of a run and the peak memory in KiB
+    """
+    times = []
+    for _ in range(repeat):
+        if before:
+            before()
+        queries = QueryCounter()
+        with connection.execute_wrapper(queries):
+            start = time.perf_counter()
+            func()
+            times.append((time.perf_counter() - start) * 1000)
+
+    if before:
+        before()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall_time_ms': {'min': min(times), 'median': statistics.median(times), 'max': max(times)},
+        'queries': queries.count,
+        'peak_memory_kib': peak / 1024,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Measures the wall time, queries and peak memory of the availability engine on synthetic companies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--employees', type=int, nargs='+', default=[5], help='Employees per company')
+        parser.add_argument('--services', type=int, nargs='+', default=[5], help='Services per company')
+        parser.add_argument('--days', type=int, nargs='+', default=[7], help='Days searched')
+        parser.add_argument('--density', type=int, nargs='+', default=[4],
+                            help='Appointments per employee per working day')
+        parser.add_argument('--schedule', nargs='+', default=['day'], choices=sorted(SCHEDULE_SHAPES))
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of each measurement')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='File the results are appended to, one json object per line')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        run = {'timestamp': datetime.datetime.now().isoformat(), 'revision': git_revision()}
+        combinations = itertools.product(options['employees'], options['services'], options['days'],
+                                         options['density'], options['schedule'])
+        results = []
+        for employees, services, days, density, shape in combinations:
+            params = {'employees': employees, 'services': services, 'days': days, 'density': density,
+                      'schedule': shape}
+            with transaction.atomic():
+                tenant = build_tenant(employees, services, days, density, shape, rng)
+                for name, cache, measurement in self.run_benchmarks(tenant, options['repeat']):
+                    results.append({**run, 'benchmark': name, 'cache': cache, 'params': params, **measurement})
+                    self.write_result(results[-1])
+                transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'a') as output:
+                for result in results:
+                    output.write(json.dumps(result) + '\n')
+
+    @staticmethod
+    def run_benchmarks(tenant, repeat):
+        """Yields the name, the state of the availability cache and the measurements of each benchmark"""
+        employee, service = tenant.employees[0], tenant.services[0]
+        client = APIClient()
+        url = reverse('customer-company-slots')
+        params = {'service': service.id, 'start': tenant.start.isoformat(), 'end': tenant.end.isoformat()}
+
+        def get_slots():
+            response = client.get(url, params)
+            if response.status_code != 200:
+                raise CommandError(f'The slots endpoint answered {response.status_code}: {response.content}')
+            return response.content
+
+        benchmarks = {
+            'get_availability': lambda: get_availability(employee, None, tenant.start, tenant.end),
+            'get_availability_for_service': lambda: get_availability_for_service(service, tenant.start, tenant.end),
+            'slots_endpoint': get_slots,
+        }
+
+        def clear_cache():
+            availability_cache.invalidate([e.id for e in tenant.employees])
+
+        for name, func in benchmarks.items():
+            yield name, 'cold', measure(func, repeat, clear_cache)
+            yield name, 'warm', measure(func, repeat)
+
+    def write_result(self, result):
+        params = ' '.join(f'{key}={value}' for key, value in result['params'].items())
+        self.stdout.write(f"{result['benchmark']} ({result['cache']}) {params}: "
+                          f"{result['wall_time_ms']['median']:.2f}ms median, {result['queries']} queries, "
+                          f"{result['peak_memory_kib']:.1f}KiB peak")
@@ -0,0 +1,141 @@
+"""
+Benchmarks concurrent bookings on a synthetic company built with the test factories.
+Every amount of workers books on its own day, picking at random from a pool of slots so bookings of the same slot
+and employee race each other, the smaller the pool the more conflicts.
+The company has to be committed for the workers to see it, it is deleted at the end.
+e.g: python manage.py benchmark_booking --workers 1 8 32 --mode thread process --output benchmarks.jsonl
+"""
+import datetime
+import itertools
+import json
+import multiprocessing
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+
+from customers.management.commands.benchmark_availability import build_tenant, git_revision
+from scheduling import models
+from scheduling.tests import factories
+
+BOOKED, CONFLICT, ERROR = 'booked', 'conflict', 'error'
+
+
+def percentile(values, fraction):
+    """Nearest rank percentile of the values, fraction between 0 and 1"""
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, int(round(fraction * len(ordered))) - 1))]
+
+
+def book(attempts):
+    """
+    Books every attempt in order with the connection of the current thread or process
+    :param attempts: a list of (owner id, employee id, service id, customer id, start)
+    :return: a list of (outcome, latency in milliseconds)
+    """
+    results = []
+    try:
+        for owner_id, employee_id, service_id, customer_id, start in attempts:
+            begin = time.perf_counter()
+            try:
+                models.Appointment.objects.create(owner_id=owner_id, employee_id=employee_id, service_id=service_id,
+                                                  customer_id=customer_id, start=start)
+                outcome = BOOKED
+            except ValidationError:
+                outcome = CONFLICT
+            except Exception:
+                outcome = ERROR
+            results.append((outcome, (time.perf_counter() - begin) * 1000))
+    finally:
+        connection.close()
+    return results
+
+
+def run_workers(mode, batches):
+    """Books every batch of attempts on its own worker, all the workers run at the same time"""
+    if mode == 'thread':
+        with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+            return list(executor.map(book, batches))
+    # the forked processes can't share the connections of the parent
+    connections.close_all()
+    with multiprocessing.get_context('fork').Pool(len(batches)) as pool:
+        return pool.map(book, batches)
+
+
+def double_bookings(company, day):
+    """Returns the amount of active appointments of the company's day that overlap another one of the same employee"""
+    appointments = models.Appointment.objects.active().filter(owner=company, start__date=day.date())
+    return sum(models.Appointment.objects.overlapping(a.start, a.end, exclude_id=a.id, employee_id=a.employee_id)
+               .exists() for a in appointments)
+
+
+class Command(BaseCommand):
+    help = 'Measures the throughput, conflict rate and latency of concurrent bookings on a synthetic company'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16], help='Bookings running at once')
+        parser.add_argument('--mode', nargs='+', default=['thread'], choices=['thread', 'process'])
+        parser.add_argument('--employees', type=int, default=5, help='Employees of the company')
+        parser.add_argument('--bookings', type=int, default=20, help='Bookings attempted by each worker')
+        parser.add_argument('--slots', type=int, default=20,
+                            help='Distinct employee and time pairs the bookings are picked from')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='File the results are appended to, one json object per line')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        run = {'timestamp': datetime.datetime.now().isoformat(), 'revision': git_revision()}
+        combinations = list(itertools.product(options['mode'], options['workers']))
+        tenant = build_tenant(options['employees'], 1, len(combinations), 0, 'long', rng)
+        customer = factories.CustomerFactory.create(owner=tenant.company)
+        service = tenant.services[0]
+
+        results = []
+        try:
+            for index, (mode, workers) in enumerate(combinations):
+                day = tenant.start + datetime.timedelta(days=index)
+                # the employees work from 7 to 22 every day with the long schedule
+                starts = [day + datetime.timedelta(hours=7) + service.duration * i
+                          for i in range(int(datetime.timedelta(hours=15) / service.duration))]
+                slots = [(employee.id, start) for employee in tenant.employees for start in starts]
+                slots = rng.sample(slots, min(options['slots'], len(slots)))
+                batches = [[(tenant.company.id, employee_id, service.id, customer.id, start)
+                            for employee_id, start in (rng.choice(slots) for _ in range(options['bookings']))]
+                           for _ in range(workers)]
+
+                start = time.perf_counter()
+                outcomes = [result for batch in run_workers(mode, batches) for result in batch]
+                elapsed = time.perf_counter() - start
+
+                latencies = [latency for _, latency in outcomes]
+                counts = {outcome: sum(1 for o, _ in outcomes if o == outcome) for outcome in (BOOKED, CONFLICT, ERROR)}
+                results.append({
+                    **run, 'benchmark': 'booking', 'mode': mode, 'workers': workers,
+                    'params': {'employees': options['employees'], 'bookings': options['bookings'],
+                               'slots': options['slots']},
+                    'attempts': len(outcomes), **counts,
+                    'conflict_rate': counts[CONFLICT] / len(outcomes),
+                    'throughput_per_s': len(outcomes) / elapsed,
+                    'latency_ms': {'median': percentile(latencies, 0.5), 'p99': percentile(latencies, 0.99),
+                                   'max': max(latencies)},
+                    'double_bookings': double_bookings(tenant.company, day),
+                })
+                self.write_result(results[-1])
+        finally:
+            company_id = tenant.company.id
+            tenant.company.delete()
+            # deleting the appointments records their deletion in the history too
+            models.Appointment.history.filter(owner_id=company_id).delete()
+
+        if options['output']:
+            with open(options['output'], 'a') as output:
+                for result in results:
+                    output.write(json.dumps(result) + '\n')
+
+    def write_result(self, result):
+        self.stdout.write(f"{result['mode']} x{result['workers']}: {result['throughput_per_s']:.1f} bookings/s, "
+                          f"{result['conflict_rate']:.0%} conflicts, {result[ERROR]} errors, "
+                          f"{result['latency_ms']['p99']:.2f}ms p99, {result['double_bookings']} double bookings")
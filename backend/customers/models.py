@@ -1,10 +1,15 @@
 import datetime
 
 from customers.customException import InvalidActionException
+from customers import intervals
+from customers.availability import AvailabilityLoader, MINUTES_IN_DAY
 from scheduling.models import Employee
 
+MAX_SEARCH_CHUNK_DAYS = 7
+
 
 class Slot:
+    __slots__ = ('start', 'end')
 
     def __init__(self, start: datetime.datetime, end):
         self.start = start
@@ -17,16 +22,19 @@ class Slot:
     def id(self):
         return self.start.isoformat()
 
+    def iter_slots(self, duration, step=None):
+        """
+        Yields the slots of the same duration that fit in this slot,
+        a new slot starts every step (defaults to the duration) from the start of this slot
+        """
+        step = step or duration
+        start = self.start
+        while start + duration <= self.end:
+            yield Slot(start, start + duration)
+            start += step
+
     def breakdown_slot(self, duration):
-        if self.duration() > duration:
-            break_point = self.start + duration
-            a = {self.id: Slot(self.start, break_point)}
-            b = Slot(break_point, self.end).breakdown_slot(duration)
-            a.update(b)
-            return a
-        if self.duration() == duration:
-            return {self.id: self}
-        return {}
+        return {slot.id: slot for slot in self.iter_slots(duration)}
 
     @staticmethod
     def create_slot(date, start, end):
@@ -40,47 +48,209 @@ class Slot:
 
 
 def get_availability(employee: Employee, customer, start, end):
-    if start < datetime.datetime.now():
-        start = datetime.datetime.now()
+    """Returns the free slots of the employee between start and end"""
+    loader = AvailabilityLoader([employee], start, end, customer)
+    return _to_slots(loader, loader.free_intervals(employee))
 
-    if end.date() <= datetime.date.today():
-        raise InvalidActionException("Date can't be in the past")
 
-    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
-    slots = []
-    while day < end:
-        frame_slots = [Slot.create_slot(day, frame.start, frame.end) for frame in employee.get_availability(day)]
-        slots.extend([slot for slot in frame_slots if slot.start > start])
-        day = day + datetime.timedelta(days=1)
+def _to_slots(loader, free):
+    return [Slot(intervals.from_minutes(loader.origin, s), intervals.from_minutes(loader.origin, e)) for s, e in free]
 
-    appointments = employee.confirmed_appointments(start, end)
-    if customer:
-        appointments.extend(customer.confirmed_appointments(start, end))
-
-    # goes through appointments removing the time of an appointment from the slot belongs to
-    for appointment in appointments:
-        for i, slot in enumerate(slots):
-            if appointment.start <= slot.start and appointment.end >= slot.end:
-                slots = [x for x in slots if x != slot]
-            if appointment.start >= slot.start and appointment.end <= slot.end:
-                slots = slots[:i] + [Slot(slot.start, appointment.start),
-                                     Slot(appointment.end, slot.end)] + slots[i + 1:]
-    return slots
+
+class ComboAppointment(Slot):
+    """The part of a combo slot in which a service is done by an employee"""
+    __slots__ = ('service_id', 'employee_id')
+
+    def __init__(self, start, end, service_id, employee_id):
+        super().__init__(start, end)
+        self.service_id = service_id
+        self.employee_id = employee_id
+
+
+class ComboSlot(Slot):
+    """A slot where a sequence of services fits back to back"""
+    __slots__ = ('appointments',)
+
+    def __init__(self, start, end, appointments):
+        super().__init__(start, end)
+        self.appointments = appointments
 
 
-def get_availability_for_service(service, start, end, employee=None, customer=None):
+class DayAvailability:
+    __slots__ = ('date', 'first_slot', 'free_slots')
 
+    def __init__(self, date: datetime.date, first_slot, free_slots):
+        self.date = date
+        self.first_slot = first_slot
+        self.free_slots = free_slots
+
+    @property
+    def available(self):
+        return self.free_slots > 0
+
+
+def _service_employees(service, employee):
     if employee is not None and not employee.provides_service(service):
         raise InvalidActionException("Employee doesn't provide the service specified")
 
-    slots = {}
+    return [employee] if employee is not None else list(service.employee_set.select_related('schedule'))
+
+
+def _load_availability(service, start, end, employee, customer):
+    return AvailabilityLoader(_service_employees(service, employee), start, end, customer)
+
+
+def _slot_starts(loader, service, step):
+    """
+    :return: the sorted start of the slots for the service in minutes from the loader's origin,
+    slots are deduplicated across employees by their start
+    """
+    duration = intervals.duration_minutes(service.duration)
+    step = intervals.duration_minutes(step) if step else None
+
+    starts = set()
+    for emp in loader.employees:
+        starts.update(intervals.slot_starts(loader.free_intervals(emp), duration, step))
+    return sorted(starts)
+
+
+def _find_slot_starts(service, start, end, employee, customer, step):
+    """
+    :return: the loader used and the sorted start of the slots for the service in minutes from the loader's origin
+    """
+    loader = _load_availability(service, start, end, employee, customer)
+    return loader, _slot_starts(loader, service, step)
+
+
+def get_availability_for_service(service, start, end, employee=None, customer=None, step=None):
+    """
+    Returns the slots available for the service between start and end,
+    when no employee is provided the slots of every employee that provides the service are combined.
+    The schedules and appointments of all the employees are loaded in a constant number of queries.
+    :param step: the time between the start of two consecutive slots, defaults to the duration of the service
+    """
+    loader, starts = _find_slot_starts(service, start, end, employee, customer, step)
+    duration = intervals.duration_minutes(service.duration)
+    return [Slot(intervals.from_minutes(loader.origin, s), intervals.from_minutes(loader.origin, s + duration))
+            for s in starts]
+
+
+def find_next_available(service, start, horizon, employee=None, customer=None, step=None):
+    """
+    Returns the first slot available for the service after start or None if there's none before start + horizon.
+    The search walks forward in chunks of days that double in size up to a week and stops at the first chunk with a
+    slot, so the work done is proportional to the distance to the first slot instead of the size of the horizon.
+    """
+    employees = _service_employees(service, employee)
+    duration = service.duration
+    start = max(start, datetime.datetime.now())
+    horizon_end = start + horizon
+    chunk_start, chunk_days = start, 1
+    while chunk_start < horizon_end:
+        chunk_end = min(chunk_start.replace(hour=0, minute=0, second=0, microsecond=0)
+                        + datetime.timedelta(days=chunk_days), horizon_end)
+        loader = AvailabilityLoader(employees, chunk_start, chunk_end, customer)
+        starts = _slot_starts(loader, service, step)
+        if starts and intervals.from_minutes(loader.origin, starts[0]) < horizon_end:
+            first = intervals.from_minutes(loader.origin, starts[0])
+            return Slot(first, first + duration)
+        chunk_start, chunk_days = chunk_end, min(chunk_days * 2, MAX_SEARCH_CHUNK_DAYS)
+    return None
+
+
+def iter_availability_by_day(service, start, end, employee=None, customer=None, step=None):
+    """
+    Returns an iterator of the date and the slots of that date for every day between start and end.
+    The availability is loaded and validated by the call, the slots of a day are only built when that day is reached.
+    """
+    loader = _load_availability(service, start, end, employee, customer)
+    per_day = {}
+    for emp in loader.employees:
+        for interval in loader.free_intervals(emp):
+            per_day.setdefault(interval[0] // MINUTES_IN_DAY, []).append(interval)
+    return _iter_slots_by_day(loader, per_day, intervals.duration_minutes(service.duration),
+                              intervals.duration_minutes(step) if step else None)
+
+
+def _iter_slots_by_day(loader, per_day, duration, step):
+    for index in range(loader.days):
+        starts = sorted(set(intervals.slot_starts(per_day.get(index, ()), duration, step)))
+        yield loader.day(index).date(), [Slot(intervals.from_minutes(loader.origin, s),
+                                              intervals.from_minutes(loader.origin, s + duration)) for s in starts]
+
+
+def get_days_availability(service, start, end, employee=None, customer=None, step=None):
+    """
+    Returns a summary of the availability of the service for every day between start and end
+    with the first slot and the amount of free slots of each day, computed in the same pass as the slots.
+    """
+    loader, starts = _find_slot_starts(service, start, end, employee, customer, step)
+
+    per_day = {}
+    for s in starts:
+        first_slot, free_slots = per_day.get(s // MINUTES_IN_DAY, (s, 0))
+        per_day[s // MINUTES_IN_DAY] = first_slot, free_slots + 1
+
+    days = []
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    while day < end:
+        first_slot, free_slots = per_day.get((day - loader.origin).days, (None, 0))
+        first_slot = intervals.from_minutes(loader.origin, first_slot) if first_slot is not None else None
+        days.append(DayAvailability(day.date(), first_slot, free_slots))
+        day = day + datetime.timedelta(days=1)
+    return days
+
+
+def _combo_providers(services, employee):
+    """
+    :return: the employees to load and a dict with the service id as key and the employees that provide it as value
+    """
     if employee is not None:
-        for slot in get_availability(employee, customer, start, end):
-            slots.update(slot.breakdown_slot(service.duration))
-    else:
-        for employee in service.employee_set.all():
-            for slot in get_availability(employee, customer, start, end):
-                a = slot.breakdown_slot(service.duration)
-                slots.update(a)
-    return sorted(slots.values(), key=lambda x: x.start)
+        provided = set(employee.services.values_list('id', flat=True))
+        if any(service.id not in provided for service in services):
+            raise InvalidActionException("Employee doesn't provide the services specified")
+        return [employee], {service.id: [employee] for service in services}
+
+    employees = {e.id: e for e in Employee.objects.filter(services__in=services).select_related('schedule').distinct()}
+    providers = {service.id: [] for service in services}
+    links = Employee.services.through.objects.filter(service__in=services).order_by('employee_id')
+    for service_id, employee_id in links.values_list('service_id', 'employee_id'):
+        if employee_id in employees:
+            providers[service_id].append(employees[employee_id])
+    return list(employees.values()), providers
 
+
+def get_combo_availability(services, start, end, employee=None, customer=None, step=None):
+    """
+    Returns the slots where the services fit back to back in the order provided,
+    each service can be done by a different employee unless an employee is provided.
+    The availability of every employee is loaded once and the services are matched against it in a single pass
+    by intersecting the windows where each service can start, shifted by the duration of the services before it.
+    :param step: the time between the start of two consecutive slots, defaults to the duration of all the services
+    """
+    employees, providers = _combo_providers(services, employee)
+    loader = AvailabilityLoader(employees, start, end, customer)
+    free = {emp.id: loader.free_intervals(emp) for emp in loader.employees}
+
+    windows, segments, offset = None, [], 0
+    for service in services:
+        duration = intervals.duration_minutes(service.duration)
+        employee_windows = [(emp.id, intervals.fit_windows(free[emp.id], duration)) for emp in providers[service.id]]
+        service_windows = [(s - offset, e - offset)
+                           for s, e in intervals.normalize(w for _, ws in employee_windows for w in ws)]
+        windows = service_windows if windows is None else intervals.intersect(windows, service_windows)
+        segments.append((service.id, offset, duration, employee_windows))
+        offset += duration
+
+    step = intervals.duration_minutes(step) if step else offset
+    slots = []
+    for s in intervals.slot_starts(windows or [], 1, step):
+        appointments = []
+        for service_id, segment_offset, duration, employee_windows in segments:
+            segment_start = s + segment_offset
+            employee_id = next(emp_id for emp_id, ws in employee_windows if intervals.contains(ws, segment_start))
+            appointments.append(ComboAppointment(intervals.from_minutes(loader.origin, segment_start),
+                                                 intervals.from_minutes(loader.origin, segment_start + duration),
+                                                 service_id, employee_id))
+        slots.append(ComboSlot(appointments[0].start, appointments[-1].end, appointments))
+    return slots
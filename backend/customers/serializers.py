@@ -1,4 +1,7 @@
+import datetime
+
 from rest_framework import serializers
+from customers.models import MAX_SEARCH_CHUNK_DAYS
 from scheduling import models
 
 
@@ -6,6 +9,8 @@ class ServiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Service
         fields = ('id', 'name', 'duration', 'description', 'price', 'category', 'cost')
+        # the columns read by the properties, for kalendario.common.compiled
+        compiled_properties = {'price': ('cost', 'is_from')}
 
 
 class ServiceCategorySerializer(serializers.ModelSerializer):
@@ -26,12 +31,11 @@ class EmployeeSerializer(PersonSerializer):
         fields = PersonSerializer.Meta.fields + ('profile_img', 'bio', 'services')
 
 
-class SlotQuerySerializer(serializers.Serializer):
-    start = serializers.DateTimeField()
-    end = serializers.DateTimeField()
+class AvailabilityQuerySerializer(serializers.Serializer):
     service = serializers.IntegerField()
     employee = serializers.IntegerField(required=False)
     customer = serializers.IntegerField(required=False)
+    step = serializers.IntegerField(required=False, min_value=1)
 
     def validate_service(self, service):
         try:
@@ -52,12 +56,97 @@ class SlotQuerySerializer(serializers.Serializer):
         except models.Person.DoesNotExist:
             raise serializers.ValidationError('Invalid customer id')
 
+    def validate_step(self, step):
+        return datetime.timedelta(minutes=step) if step is not None else None
+
+
+MAX_RANGE_DAYS = 366
+
+
+def validate_range(attrs):
+    if attrs['end'] - attrs['start'] > datetime.timedelta(days=MAX_RANGE_DAYS):
+        raise serializers.ValidationError(f'The date range can not be longer than {MAX_RANGE_DAYS} days')
+    return attrs
+
+
+class SlotQuerySerializer(AvailabilityQuerySerializer):
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+    # When days is provided only that amount of days is returned along with the url for the following days
+    days = serializers.IntegerField(required=False, min_value=1, max_value=31)
+    stream = serializers.BooleanField(required=False)
+
+    def validate(self, attrs):
+        return validate_range(attrs)
+
+
+class ComboQuerySerializer(AvailabilityQuerySerializer):
+    service = None
+    services = serializers.ListField(child=serializers.IntegerField(), min_length=1, max_length=10)
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField()
+
+    def validate_services(self, services):
+        found = models.Service.objects.in_bulk(services)
+        if len(found) != len(set(services)):
+            raise serializers.ValidationError('Invalid service id')
+        return [found[pk] for pk in services]
+
+    def validate(self, attrs):
+        return validate_range(attrs)
+
+
+class NextSlotQuerySerializer(AvailabilityQuerySerializer):
+    start = serializers.DateTimeField(required=False)
+    # days after start to look for a slot
+    horizon = serializers.IntegerField(required=False, min_value=1, max_value=MAX_RANGE_DAYS, default=90)
+
+    def validate(self, attrs):
+        attrs['start'] = attrs.get('start') or datetime.datetime.now()
+        attrs['horizon'] = datetime.timedelta(days=attrs['horizon'])
+        # the search reads up to a chunk of days past the end of the horizon
+        if datetime.datetime.max - attrs['start'] <= attrs['horizon'] + datetime.timedelta(days=MAX_SEARCH_CHUNK_DAYS):
+            raise serializers.ValidationError({'start': 'The search can not go past the last representable date'})
+        return attrs
+
+
+class DaysQuerySerializer(AvailabilityQuerySerializer):
+    month = serializers.DateField(input_formats=['%Y-%m', 'iso-8601'])
+
+    def validate_month(self, month):
+        # the range ends on the first day of the next month
+        if (month.year, month.month) == (datetime.MAXYEAR, 12):
+            raise serializers.ValidationError('Invalid month')
+        return month
+
+    def validate(self, attrs):
+        month = attrs.pop('month')
+        attrs['start'] = datetime.datetime(month.year, month.month, 1)
+        attrs['end'] = datetime.datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+        return attrs
+
 
 class SlotSerializer(serializers.Serializer):
     start = serializers.DateTimeField()
     end = serializers.DateTimeField()
 
 
+class ComboAppointmentSerializer(SlotSerializer):
+    service = serializers.IntegerField(source='service_id')
+    employee = serializers.IntegerField(source='employee_id')
+
+
+class ComboSlotSerializer(SlotSerializer):
+    appointments = ComboAppointmentSerializer(many=True)
+
+
+class DayAvailabilitySerializer(serializers.Serializer):
+    date = serializers.DateField()
+    available = serializers.BooleanField()
+    first_slot = serializers.DateTimeField()
+    free_slots = serializers.IntegerField()
+
+
 class ConfigSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Config
@@ -73,6 +162,8 @@ class CompanySerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Company
         fields = ('id', 'name', 'avatar', 'address', 'config')
+        # read by can_receive_card_payments of the config
+        select_related = ('account',)
 
 
 class CompanyDetailsSerializer(serializers.ModelSerializer):
@@ -85,6 +176,7 @@ class CompanyDetailsSerializer(serializers.ModelSerializer):
         model = models.Company
         fields = ('id', 'name', 'address', 'about', 'avatar', 'employees', 'services', 'config',
                   'service_categories')
+        select_related = ('account',)
 
 
 class AppointmentReadSerializer(serializers.ModelSerializer):
@@ -154,11 +246,14 @@ class RequestQuerySerializer(RequestQueryBaseSerializer):
 class RequestReadSerializer(serializers.ModelSerializer):
     appointments = AppointmentReadSerializer(read_only=True, many=True, source='appointment_set')
     owner = CompanySerializer(read_only=True)
+    # rendered as a number as it was when the total was computed by a property
+    total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True, coerce_to_string=False)
 
     class Meta:
         model = models.Request
         fields = (
-            'id', 'owner', 'appointments', 'total', 'fee', 'complete', 'status', 'customer_notes', 'scheduled_date')
+            'id', 'owner', 'appointments', 'total', 'fee', 'complete', 'status', 'customer_notes', 'scheduled_date',
+            'appointment_count', 'first_start', 'last_end')
 
 
 class RequestWriteSerializer(serializers.ModelSerializer):
@@ -0,0 +1,63 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+
+from billing.models import Account
+from customers import availability_cache, company_cache
+from scheduling import models as m
+from scheduling.managers import appointments_bulk_changed
+
+
+def appointment_changed(sender, instance, **kwargs):
+    """
+    Makes the cached availability of the employee of the appointment or series unreachable, when the appointment
+    or series moved to another employee the availability of the previous employee is invalidated as well
+    """
+    availability_cache.invalidate({instance.employee_id, getattr(instance, 'loaded_employee_id', None)})
+
+
+def appointments_changed_in_bulk(sender, employee_ids, **kwargs):
+    availability_cache.invalidate(employee_ids)
+
+
+def employee_changed(sender, instance, **kwargs):
+    """The employee's schedule might have changed"""
+    availability_cache.invalidate([instance.id])
+
+
+def public_pages_changed(company_ids, slugs=()):
+    m.Company.objects.bump_public_version(*company_ids)
+    company_cache.invalidate(company_ids, slugs)
+
+
+def company_changed(sender, instance, **kwargs):
+    """
+    The public pages of the company changed, the version is bumped after the company is saved so a save of an
+    instance loaded before the last bump doesn't restore a previous version.
+    The id of the previous slug is invalidated too when the company was renamed
+    """
+    public_pages_changed([instance.id], {instance.slug, getattr(instance, 'loaded_slug', None)})
+
+
+def company_data_changed(sender, instance, **kwargs):
+    """An object shown in the public pages of its company changed"""
+    public_pages_changed([instance.owner_id])
+
+
+def employee_services_changed(sender, instance, action, **kwargs):
+    """The instance is the employee or the service depending on the side of the relation changed"""
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        public_pages_changed([instance.owner_id])
+
+
+post_save.connect(appointment_changed, sender=m.Appointment)
+post_delete.connect(appointment_changed, sender=m.Appointment)
+post_save.connect(appointment_changed, sender=m.AppointmentSeries)
+post_delete.connect(appointment_changed, sender=m.AppointmentSeries)
+appointments_bulk_changed.connect(appointments_changed_in_bulk, sender=m.Appointment)
+post_save.connect(employee_changed, sender=m.Employee)
+post_save.connect(company_changed, sender=m.Company)
+post_delete.connect(company_changed, sender=m.Company)
+m2m_changed.connect(employee_services_changed, sender=m.Employee.services.through)
+# the account tells if the company receives card payments, shown in its config
+for model in (m.Config, m.Service, m.ServiceCategory, m.Employee, Account):
+    post_save.connect(company_data_changed, sender=model)
+    post_delete.connect(company_data_changed, sender=model)
@@ -1,9 +1,42 @@
-from customers.models import get_availability_for_service
+import datetime
+
+from customers.customException import InvalidActionException
+from customers.models import get_availability_for_service, get_days_availability, get_combo_availability, \
+    get_availability, find_next_available, Slot
 from customers.tests.generics import TestCaseWF
 from scheduling import models
 from util import test_util as util
 
 
+def legacy_get_availability(employee, start, end):
+    """The list splicing implementation the interval engine replaced, kept to check both give the same results"""
+    if start < datetime.datetime.now():
+        start = datetime.datetime.now()
+
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    slots = []
+    while day < end:
+        frame_slots = [Slot.create_slot(day, frame.start, frame.end) for frame in employee.get_availability(day)]
+        slots.extend([slot for slot in frame_slots if slot.start > start])
+        day = day + datetime.timedelta(days=1)
+
+    for appointment in employee.confirmed_appointments(start, end):
+        for i, slot in enumerate(slots):
+            if appointment.start <= slot.start and appointment.end >= slot.end:
+                slots = [x for x in slots if x != slot]
+            if appointment.start >= slot.start and appointment.end <= slot.end:
+                slots = slots[:i] + [Slot(slot.start, appointment.start),
+                                     Slot(appointment.end, slot.end)] + slots[i + 1:]
+    return slots
+
+
+def legacy_get_slots(employee, service, start, end):
+    slots = {}
+    for slot in legacy_get_availability(employee, start, end):
+        slots.update(slot.breakdown_slot(service.duration))
+    return [(slot.start, slot.end) for slot in sorted(slots.values(), key=lambda x: x.start)]
+
+
 class SlotTest(TestCaseWF):
 
     def setUp(self):
@@ -101,10 +134,41 @@ class SlotTest(TestCaseWF):
         slots = self.get_slots_for_emp(appointment_1_date)
         self.assertEqual(len(slots), 14)
 
+    def test_series_occurrence(self):
+        """The second occurrence of the series keeps its time busy like a booked appointment would"""
+        date = util.next_tuesday(7).replace(hour=9, minute=30, second=0, microsecond=0)
+        models.AppointmentSeries(owner=self.emp.owner, employee=self.emp, customer=self.customer, service=self.service,
+                                 start=date - datetime.timedelta(weeks=1), rrule='FREQ=WEEKLY;COUNT=2').save()
+        slots = self.get_slots_for_emp(date)
+        self.assertEqual(len(slots), 13)
+        self.assertNotIn(date, [slot.start for slot in slots])
+        self.assertEqual(len(self.get_slots_for_emp(util.next_tuesday(14))), 14)
+
     def test_get_without_employee(self):
         slots = self.get_slots(util.next_tuesday())
         self.assertEqual(len(slots), 14)
 
+    def test_slots_with_step(self):
+        """30 minutes service starting every 15 minutes: 9:00 to 12:30 and 14:00 to 16:30"""
+        slots = get_availability_for_service(self.service,
+                                             util.next_tuesday().replace(hour=0, minute=0),
+                                             util.next_tuesday().replace(hour=23, minute=59),
+                                             self.emp, step=datetime.timedelta(minutes=15))
+        self.assertEqual(len(slots), 15 + 11)
+        self.assertEqual(slots[1].start - slots[0].start, datetime.timedelta(minutes=15))
+        for slot in slots:
+            self.assertEqual(slot.duration(), self.service.duration)
+
+    def test_customer_appointment_with_other_employee(self):
+        """The customer can't be booked twice at the same time even if the appointments are with different employees"""
+        other = models.Employee.objects.get(pk=2)
+        util.book_appointment(other, self.customer, util.next_tuesday().replace(hour=9, minute=0), self.service)
+        slots = get_availability_for_service(self.service,
+                                             util.next_tuesday().replace(hour=0, minute=0),
+                                             util.next_tuesday().replace(hour=23, minute=59),
+                                             self.emp, self.customer)
+        self.assertEqual(len(slots), 13)
+
     def test_get_inside_locked_period(self):
         """
         When an employee has a locked period that ranges for days, no slots should be retrieved for the full range.
@@ -114,3 +178,263 @@ class SlotTest(TestCaseWF):
                                      end=util.next_tuesday(7).replace(hour=9, minute=15))
         slots = self.get_slots_for_emp(util.next_wednesday())
         self.assertEqual(len(slots), 0)
+
+
+class LegacyEquivalenceTest(TestCaseWF):
+    """
+    The interval engine must return the same slots as the list splicing implementation for every case the old
+    implementation handled correctly
+    """
+
+    def setUp(self):
+        self.emp = models.Employee.objects.get(pk=1)
+        self.customer = models.Customer.objects.get(pk=2001)
+        self.service = self.emp.services.first()
+
+    def assert_same_slots(self, date_to_check):
+        start, end = date_to_check.replace(hour=0, minute=0), date_to_check.replace(hour=23, minute=59)
+        slots = [(slot.start, slot.end) for slot in get_availability_for_service(self.service, start, end, self.emp)]
+        self.assertEqual(slots, legacy_get_slots(self.emp, self.service, start, end))
+
+    def test_day_without_appointments(self):
+        self.assert_same_slots(util.next_tuesday())
+        self.assert_same_slots(util.next_wednesday())
+        self.assert_same_slots(util.next_monday())
+
+    def test_appointments_inside_frames(self):
+        for hour, minute in ((9, 0), (10, 15), (11, 0), (12, 30), (14, 0), (15, 45), (16, 30)):
+            with self.subTest(hour=hour, minute=minute):
+                util.book_appointment(self.emp, self.customer, util.next_tuesday().replace(hour=hour, minute=minute),
+                                      self.service)
+                self.assert_same_slots(util.next_tuesday())
+
+    def test_appointment_covering_frame(self):
+        util.book_appointment(self.emp, start=util.next_tuesday().replace(hour=14, minute=0),
+                              end=util.next_tuesday().replace(hour=17, minute=0), ignore_availability=True)
+        self.assert_same_slots(util.next_tuesday())
+
+    def test_locked_period(self):
+        util.book_appointment(self.emp, start=util.next_tuesday(-1), end=util.next_tuesday(2),
+                              ignore_availability=True)
+        self.assert_same_slots(util.next_tuesday())
+
+    def test_rejected_appointment(self):
+        appointment = util.book_appointment(self.emp, self.customer, util.next_tuesday().replace(hour=9, minute=15),
+                                            self.service)
+        util.reject_appointment(appointment)
+        self.assert_same_slots(util.next_tuesday())
+
+    def test_partial_overlap_removes_overlapped_time(self):
+        """The old implementation ignored appointments that only partially overlapped a frame"""
+        lock_start = util.next_tuesday().replace(hour=12, minute=45, second=0, microsecond=0)
+        lock_end = util.next_tuesday().replace(hour=14, minute=15, second=0, microsecond=0)
+        util.book_appointment(self.emp, start=lock_start, end=lock_end, ignore_availability=True)
+        slots = self.get_slots(util.next_tuesday())
+        self.assertEqual(len(slots), 7 + 5)
+        for slot in slots:
+            self.assertFalse(slot.start < lock_end and slot.end > lock_start)
+
+    def get_slots(self, date_to_check):
+        return get_availability_for_service(self.service, date_to_check.replace(hour=0, minute=0),
+                                            date_to_check.replace(hour=23, minute=59), self.emp)
+
+
+class AvailabilityQueryCountTest(TestCaseWF):
+    """The amount of queries to find the slots of a service must not grow with the amount of employees or days"""
+
+    def setUp(self):
+        self.service = models.Service.objects.get(pk=1)
+        self.customer = models.Customer.objects.get(pk=2001)
+
+    def get_slots(self, days, customer=None):
+        start = util.next_tuesday().replace(hour=0, minute=0)
+        return get_availability_for_service(self.service, start, start + datetime.timedelta(days=days),
+                                            customer=customer)
+
+    def add_employees(self, amount):
+        for i in range(amount):
+            employee = models.Employee.objects.create(owner_id=1, schedule_id=1, first_name=f'E{i}', last_name='E',
+                                                      email=f'e{i}@email.com', phone='0')
+            employee.services.add(self.service)
+            util.book_appointment(employee, self.customer, util.next_tuesday().replace(hour=9 + i % 4, minute=0),
+                                  self.service, ignore_availability=True)
+
+    def test_query_count_is_flat(self):
+        with self.assertNumQueries(4):
+            self.get_slots(1)
+
+        self.add_employees(10)
+        with self.assertNumQueries(4):
+            slots = self.get_slots(30)
+        self.assertTrue(len(slots) > 0)
+
+        # the appointments and series of the customer
+        with self.assertNumQueries(6):
+            self.get_slots(30, self.customer)
+
+    def test_same_slots_as_per_employee_availability(self):
+        self.add_employees(3)
+        start = util.next_tuesday().replace(hour=0, minute=0)
+        end = start + datetime.timedelta(days=8)
+        expected = {}
+        for employee in self.service.employee_set.all():
+            for slot in get_availability_for_service(self.service, start, end, employee):
+                expected[slot.start] = slot.end
+        slots = get_availability_for_service(self.service, start, end)
+        self.assertEqual([(slot.start, slot.end) for slot in slots], sorted(expected.items()))
+
+
+class DaysAvailabilityTest(TestCaseWF):
+
+    def setUp(self):
+        self.emp = models.Employee.objects.get(pk=1)
+        self.service = models.Service.objects.get(pk=1)
+
+    def get_days(self, employee=None):
+        start = util.next_monday().replace(hour=0, minute=0, second=0, microsecond=0)
+        return get_days_availability(self.service, start, start + datetime.timedelta(days=14), employee)
+
+    def test_summary_per_day(self):
+        util.book_appointment(self.emp, models.Customer.objects.get(pk=2001),
+                              util.next_tuesday().replace(hour=9, minute=0), self.service)
+        days = self.get_days(self.emp)
+        self.assertEqual(len(days), 14)
+
+        monday, tuesday, wednesday = days[:3]
+        self.assertFalse(monday.available)
+        self.assertIsNone(monday.first_slot)
+        self.assertEqual(tuesday.date, util.next_tuesday().date())
+        self.assertEqual(tuesday.free_slots, 13)
+        self.assertEqual(tuesday.first_slot, util.next_tuesday().replace(hour=9, minute=30, second=0, microsecond=0))
+        # wednesday 9:00 to 17:30
+        self.assertEqual(wednesday.free_slots, 17)
+        self.assertEqual([day.free_slots for day in days[3:7]], [0] * 4)
+        self.assertEqual(days[8].free_slots, 14)
+
+    def test_summary_matches_slots(self):
+        start = util.next_monday().replace(hour=0, minute=0, second=0, microsecond=0)
+        slots = get_availability_for_service(self.service, start, start + datetime.timedelta(days=14))
+        days = self.get_days()
+        self.assertEqual(sum(day.free_slots for day in days), len(slots))
+        self.assertEqual([day.first_slot for day in days if day.available][0], slots[0].start)
+
+    def test_constant_queries(self):
+        with self.assertNumQueries(4):
+            self.get_days()
+
+
+class ComboAvailabilityTest(TestCaseWF):
+
+    def setUp(self):
+        self.emp = models.Employee.objects.get(pk=1)
+        self.customer = models.Customer.objects.get(pk=2001)
+        # service 1 (30 minutes) is done by employees 1 and 2, service 2 (45 minutes) only by employee 1
+        self.services = [models.Service.objects.get(pk=1), models.Service.objects.get(pk=2)]
+        self.start = util.next_tuesday().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.end = self.start + datetime.timedelta(days=1)
+
+    def get_combos(self, employee=None, step=None):
+        return get_combo_availability(self.services, self.start, self.end, employee, step=step)
+
+    def brute_force_starts(self, employee=None):
+        """Every minute of the day where each service fits in the free time of one of its employees"""
+        free = {}
+        for service in self.services:
+            employees = [employee] if employee else service.employee_set.all()
+            free[service.id] = [slot for e in employees for slot in get_availability(e, None, self.start, self.end)]
+        starts = []
+        for minute in range(24 * 60):
+            start = self.start + datetime.timedelta(minutes=minute)
+            fits = True
+            for service in self.services:
+                end = start + service.duration
+                fits = fits and any(slot.start <= start and end <= slot.end for slot in free[service.id])
+                start = end
+            if fits:
+                starts.append(self.start + datetime.timedelta(minutes=minute))
+        return starts
+
+    def assert_valid(self, combos):
+        free = {e.id: get_availability(e, None, self.start, self.end) for e in models.Employee.objects.filter(owner=1)}
+        for combo in combos:
+            self.assertEqual([apt.service_id for apt in combo.appointments], [s.id for s in self.services])
+            self.assertEqual(combo.start, combo.appointments[0].start)
+            self.assertEqual(combo.end, combo.appointments[-1].end)
+            for previous, apt in zip(combo.appointments, combo.appointments[1:]):
+                self.assertEqual(previous.end, apt.start)
+            for apt in combo.appointments:
+                service = next(s for s in self.services if s.id == apt.service_id)
+                self.assertIn(apt.employee_id, service.employee_set.values_list('id', flat=True))
+                self.assertTrue(any(slot.start <= apt.start and apt.end <= slot.end for slot in free[apt.employee_id]))
+
+    def test_same_starts_as_brute_force(self):
+        util.book_appointment(self.emp, self.customer, self.start.replace(hour=11), self.services[0])
+        combos = self.get_combos(step=datetime.timedelta(minutes=1))
+        self.assertEqual([combo.start for combo in combos], self.brute_force_starts())
+        self.assert_valid(combos)
+
+        combos = self.get_combos(self.emp, step=datetime.timedelta(minutes=1))
+        self.assertEqual([combo.start for combo in combos], self.brute_force_starts(self.emp))
+        self.assert_valid(combos)
+
+    def test_services_across_employees(self):
+        nine = self.start.replace(hour=9)
+        util.book_appointment(self.emp, self.customer, nine, self.services[0])
+
+        combo = self.get_combos()[0]
+        self.assertEqual(combo.start, nine)
+        self.assertEqual(combo.end, nine + datetime.timedelta(minutes=75))
+        self.assertEqual([apt.employee_id for apt in combo.appointments], [2, 1])
+
+        self.assertNotEqual(self.get_combos(self.emp)[0].start, nine)
+
+    def test_default_step_is_combo_duration(self):
+        combos = self.get_combos(self.emp)
+        self.assertTrue(len(combos) > 0)
+        self.assertEqual(combos[1].start - combos[0].start, datetime.timedelta(minutes=75))
+        for previous, combo in zip(combos, combos[1:]):
+            self.assertGreaterEqual(combo.start - previous.start, datetime.timedelta(minutes=75))
+
+    def test_employee_without_service(self):
+        with self.assertRaises(InvalidActionException):
+            self.get_combos(models.Employee.objects.get(pk=2))
+
+    def test_constant_queries(self):
+        with self.assertNumQueries(5):
+            self.get_combos()
+        self.services = self.services * 3
+        with self.assertNumQueries(5):
+            self.get_combos()
+
+
+class NextAvailableTest(TestCaseWF):
+
+    def setUp(self):
+        self.emp = models.Employee.objects.get(pk=1)
+        # only provided by employee 1 who works on tuesdays and wednesdays
+        self.service = models.Service.objects.get(pk=2)
+        self.thursday = util.next_tuesday(2).replace(hour=0, minute=0, second=0, microsecond=0)
+
+    def test_same_as_first_slot(self):
+        start = datetime.datetime.now()
+        expected = get_availability_for_service(self.service, start, start + datetime.timedelta(days=30))[0]
+        slot = find_next_available(self.service, start, datetime.timedelta(days=30))
+        self.assertEqual((slot.start, slot.end), (expected.start, expected.end))
+
+    def test_horizon(self):
+        self.assertIsNone(find_next_available(self.service, self.thursday, datetime.timedelta(days=4)))
+        slot = find_next_available(self.service, self.thursday, datetime.timedelta(days=6))
+        self.assertEqual(slot.start, self.thursday + datetime.timedelta(days=5, hours=9))
+
+    def test_stops_at_first_slot(self):
+        horizon = datetime.timedelta(days=365)
+        # the employee's services and schedule, then the week templates, appointments and series of each chunk
+        # searched: thursday, friday to saturday, sunday to wednesday
+        with self.assertNumQueries(11):
+            slot = find_next_available(self.service, self.thursday, horizon, self.emp)
+        self.assertEqual(slot.start.weekday(), 1)
+
+    def test_no_slot(self):
+        self.emp.schedule = None
+        self.emp.save()
+        self.assertIsNone(find_next_available(self.service, self.thursday, datetime.timedelta(days=30)))
@@ -0,0 +1,130 @@
+import datetime
+from io import StringIO
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import override_settings
+
+from customers import availability_cache
+from customers.models import get_availability_for_service
+from customers.tests.generics import TestCaseWF
+from scheduling import models
+from scheduling.tests.generics import run_on_commit
+from util import test_util as util
+
+LOCAL_MEMORY_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHE)
+class AvailabilityCacheTest(TestCaseWF):
+
+    def setUp(self):
+        cache.clear()
+        models.Schedule.objects.local_week_templates.clear()
+        self.emp = models.Employee.objects.get(pk=1)
+        self.customer = models.Customer.objects.get(pk=2001)
+        self.service = models.Service.objects.get(pk=1)
+
+    def get_slots(self, days=1):
+        # the availability is invalidated once the changes made by the test are committed
+        run_on_commit()
+        start = util.next_tuesday().replace(hour=0, minute=0)
+        return get_availability_for_service(self.service, start, start + datetime.timedelta(days=days) -
+                                            datetime.timedelta(minutes=1))
+
+    def get_employee_slots(self):
+        run_on_commit()
+        return get_availability_for_service(self.service, util.next_tuesday().replace(hour=0, minute=0),
+                                            util.next_tuesday().replace(hour=23, minute=59), self.emp)
+
+    def test_cached_availability_does_not_query_appointments(self):
+        slots = self.get_slots(7)
+        # only the employees of the service are loaded
+        with self.assertNumQueries(1):
+            self.assertEqual(len(self.get_slots(7)), len(slots))
+
+    def test_booking_invalidates_employee(self):
+        self.assertEqual(len(self.get_slots()), 14)
+        for employee_id in (1, 2):
+            util.book_appointment(models.Employee.objects.get(pk=employee_id), self.customer,
+                                  util.next_tuesday().replace(hour=9, minute=0), self.service,
+                                  ignore_availability=True)
+        self.assertEqual(len(self.get_slots()), 13)
+
+    def test_invalidated_on_commit(self):
+        """the version is bumped once the booking commits, a read before is cached with the previous version"""
+        self.assertEqual(len(self.get_employee_slots()), 14)
+        util.book_appointment(self.emp, self.customer, util.next_tuesday().replace(hour=9, minute=0), self.service)
+        version = cache.get(availability_cache.employee_version_key(self.emp.id))
+        self.assertEqual(len(get_availability_for_service(self.service, util.next_tuesday().replace(hour=0, minute=0),
+                                                          util.next_tuesday().replace(hour=23, minute=59),
+                                                          self.emp)), 14)
+        run_on_commit()
+        self.assertNotEqual(cache.get(availability_cache.employee_version_key(self.emp.id)), version)
+        self.assertEqual(len(self.get_employee_slots()), 13)
+
+    def test_bulk_booking_invalidates_employee(self):
+        self.assertEqual(len(self.get_slots()), 14)
+        models.Appointment.bulk_book([models.Appointment(owner_id=1, employee_id=employee_id, customer=self.customer,
+                                                         service=self.service,
+                                                         start=util.next_tuesday().replace(hour=9, minute=0))
+                                      for employee_id in (1, 2)])
+        self.assertEqual(len(self.get_slots()), 13)
+
+    def test_rejecting_invalidates_employee(self):
+        appointments = [util.book_appointment(models.Employee.objects.get(pk=employee_id), self.customer,
+                                              util.next_tuesday().replace(hour=9, minute=0), self.service,
+                                              ignore_availability=True)
+                        for employee_id in (1, 2)]
+        self.assertEqual(len(self.get_slots()), 13)
+        util.reject_appointment(appointments[0])
+        self.assertEqual(len(self.get_slots()), 14)
+
+    def test_request_status_invalidates_employee(self):
+        request = models.Request.objects.get_current(owner_id=1, user_id=2)
+        request.add_appointment(start=util.next_tuesday().replace(hour=9, minute=0), service=self.service,
+                                customer=self.customer, employee=self.emp, owner_id=1)
+        self.assertEqual(len(self.get_employee_slots()), 13)
+        request.status = models.Appointment.REJECTED
+        self.assertEqual(len(self.get_employee_slots()), 14)
+        request.accept()
+        self.assertEqual(len(self.get_employee_slots()), 13)
+
+    def test_moving_appointment_invalidates_previous_employee(self):
+        appointment = util.book_appointment(self.emp, self.customer, util.next_tuesday().replace(hour=9, minute=0),
+                                            self.service)
+        slots = get_availability_for_service(self.service, util.next_tuesday().replace(hour=0, minute=0),
+                                             util.next_tuesday().replace(hour=23, minute=59), self.emp)
+        self.assertEqual(len(slots), 13)
+
+        appointment = models.Appointment.objects.get(pk=appointment.id)
+        appointment.employee = models.Employee.objects.get(pk=2)
+        appointment.save()
+        run_on_commit()
+        slots = get_availability_for_service(self.service, util.next_tuesday().replace(hour=0, minute=0),
+                                             util.next_tuesday().replace(hour=23, minute=59), self.emp)
+        self.assertEqual(len(slots), 14)
+
+    def test_schedule_change_invalidates_employee(self):
+        self.assertEqual(len(self.get_slots()), 14)
+        frame = models.TimeFrame.objects.get(pk=3)
+        frame.end = datetime.time(18)
+        frame.save()
+        self.assertEqual(len(self.get_slots()), 16)
+
+    def test_stats(self):
+        availability_cache.reset_stats()
+        self.get_slots(3)
+        self.get_slots(3)
+        stats = availability_cache.stats()
+        # 2 employees for 3 days
+        self.assertEqual(stats['misses'], 6)
+        self.assertEqual(stats['hits'], 6)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_stats_command(self):
+        self.get_slots()
+        out = StringIO()
+        call_command('availability_cache_stats', '--reset', stdout=out)
+        self.assertIn('misses: 2', out.getvalue())
+        self.assertEqual(availability_cache.stats()['misses'], 0)
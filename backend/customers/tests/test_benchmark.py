@@ -0,0 +1,21 @@
+from django.test import TestCase
+
+from scheduling.tests.generics import BenchmarkTestMixin
+
+
+class BenchmarkAvailabilityTest(BenchmarkTestMixin, TestCase):
+
+    def test_results_written(self):
+        results = self.run_benchmark('benchmark_availability', '--employees', '1', '2', '--days', '3',
+                                     '--repeat', '1', '--schedule', 'split')
+
+        # 3 benchmarks with a cold and warm cache for each amount of employees
+        self.assertEqual(len(results), 12)
+        self.assertEqual({r['benchmark'] for r in results},
+                         {'get_availability', 'get_availability_for_service', 'slots_endpoint'})
+        for result in results:
+            self.assertEqual(set(result['wall_time_ms']), {'min', 'median', 'max'})
+            self.assertGreater(result['queries'], 0)
+            self.assertGreater(result['peak_memory_kib'], 0)
+        self.assertEqual(results[-1]['params'], {'employees': 2, 'services': 5, 'days': 3, 'density': 4,
+                                                 'schedule': 'split'})
@@ -0,0 +1,23 @@
+from django.test import TransactionTestCase
+
+from scheduling import models
+from scheduling.tests.generics import BenchmarkTestMixin
+
+
+class BenchmarkBookingTest(BenchmarkTestMixin, TransactionTestCase):
+    """The workers book with their own connections so the company has to be committed"""
+
+    def test_results_written(self):
+        results = self.run_benchmark('benchmark_booking', '--workers', '1', '3', '--mode', 'thread', 'process',
+                                     '--bookings', '4', '--slots', '2')
+
+        self.assertEqual([(r['mode'], r['workers']) for r in results],
+                         [('thread', 1), ('thread', 3), ('process', 1), ('process', 3)])
+        for result in results:
+            self.assertEqual(result['attempts'], 4 * result['workers'])
+            self.assertEqual(result['booked'] + result['conflict'], result['attempts'])
+            # only the 2 slots of the pool can be booked
+            self.assertLessEqual(result['booked'], 2)
+            self.assertEqual(result['double_bookings'], 0)
+            self.assertEqual(set(result['latency_ms']), {'median', 'p99', 'max'})
+        self.assertFalse(models.Appointment.history.exists())
@@ -0,0 +1,77 @@
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework import status
+
+from scheduling.models import Company, Config, Service
+from scheduling.tests.generics import ViewTestCase, run_on_commit
+
+LOCAL_MEMORY_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+@override_settings(CACHES=LOCAL_MEMORY_CACHE)
+class CompanyCacheTest(ViewTestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.list_url = reverse('customer-company-list')
+        Config.objects.filter(owner=1).update(private=False, allow_unpaid_request=True)
+        Company.objects.get(pk=1).save()
+        run_on_commit()
+
+    def get_company(self, lookup=1, **kwargs):
+        return self.client.get(reverse('customer-company-detail', kwargs={'pk': lookup}), **kwargs)
+
+    def test_cached_page_does_not_query(self):
+        response = self.get_company()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # resolves the slug
+        self.get_company('Company-A')
+        for lookup in (1, 'Company-A'):
+            with self.assertNumQueries(0):
+                cached = self.get_company(lookup)
+            self.assertEqual(cached.status_code, status.HTTP_200_OK)
+            self.assertEqual(cached.content, response.content)
+            self.assertEqual(cached['Content-Type'], response['Content-Type'])
+            self.assertEqual(cached['ETag'], response['ETag'])
+
+    def test_change_invalidates_page(self):
+        self.get_company()
+        Service.objects.filter(owner=1).update(name='unchanged')
+        service = Service.objects.filter(owner=1).first()
+        service.name = 'renamed service'
+        service.save()
+        run_on_commit()
+        self.assertIn(b'renamed service', self.get_company().content)
+
+    def test_rename_invalidates_slug(self):
+        self.assertEqual(self.get_company('Company-A').status_code, status.HTTP_200_OK)
+        company = Company.objects.get(pk=1)
+        company.name = 'Company C'
+        company.save()
+        run_on_commit()
+        self.assertEqual(self.get_company('Company-A').status_code, status.HTTP_404_NOT_FOUND)
+        for lookup in ('Company_C', 'Company C'):
+            self.assertEqual(self.get_company(lookup).status_code, status.HTTP_200_OK)
+
+    def test_private_company_not_found(self):
+        self.assertEqual(self.get_company(2).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.get_company('Company-B').status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cached_listing(self):
+        response = self.client.get(self.list_url, {'search': 'company'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.list_url, {'search': 'company'}).content, response.content)
+        self.assertNotEqual(self.client.get(self.list_url, {'search': 'B'}).content, response.content)
+
+        Config.objects.filter(owner=2).update(private=False, allow_unpaid_request=True)
+        Company.objects.get(pk=2).save()
+        run_on_commit()
+        self.assertIn(b'Company-B', self.client.get(self.list_url, {'search': 'company'}).content)
+
+    def test_browsable_api_not_cached(self):
+        self.get_company()
+        response = self.get_company(HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
@@ -0,0 +1,63 @@
+import datetime
+
+from django.test import SimpleTestCase
+
+from customers import intervals
+
+
+class IntervalsTest(SimpleTestCase):
+
+    def test_to_and_from_minutes(self):
+        origin = datetime.datetime(2021, 6, 1)
+        value = datetime.datetime(2021, 6, 2, 9, 30)
+        self.assertEqual(intervals.to_minutes(origin, value), 1440 + 570)
+        self.assertEqual(intervals.from_minutes(origin, 1440 + 570), value)
+
+    def test_normalize_merges_overlapping(self):
+        self.assertEqual(intervals.normalize([(60, 120), (0, 30), (100, 200), (20, 40)]),
+                         [(0, 40), (60, 200)])
+
+    def test_normalize_keeps_touching_apart_and_drops_empty(self):
+        self.assertEqual(intervals.normalize([(30, 60), (0, 30), (70, 70)]), [(0, 30), (30, 60)])
+
+    def test_subtract_nothing_busy(self):
+        self.assertEqual(intervals.subtract([(0, 60), (90, 120)], []), [(0, 60), (90, 120)])
+
+    def test_subtract_inside(self):
+        self.assertEqual(intervals.subtract([(0, 60)], [(10, 20), (30, 40)]), [(0, 10), (20, 30), (40, 60)])
+
+    def test_subtract_covering(self):
+        self.assertEqual(intervals.subtract([(0, 60), (90, 120)], [(0, 60)]), [(90, 120)])
+        self.assertEqual(intervals.subtract([(0, 60), (90, 120)], [(-10, 200)]), [])
+
+    def test_subtract_partial_overlaps(self):
+        self.assertEqual(intervals.subtract([(0, 60), (90, 120)], [(-10, 10), (50, 100)]), [(10, 50), (100, 120)])
+
+    def test_subtract_touching(self):
+        self.assertEqual(intervals.subtract([(0, 60)], [(-30, 0), (60, 90)]), [(0, 60)])
+
+    def test_slot_starts(self):
+        self.assertEqual([*intervals.slot_starts([(0, 60), (90, 150)], 30)], [0, 30, 90, 120])
+
+    def test_slot_starts_with_step(self):
+        self.assertEqual([*intervals.slot_starts([(0, 60), (90, 125)], 30, 15)], [0, 15, 30, 90])
+
+    def test_slot_starts_long_frame_short_duration(self):
+        """a 24 hour frame broken in 1 minute slots used to exceed the recursion limit"""
+        self.assertEqual(len([*intervals.slot_starts([(0, 24 * 60)], 1)]), 24 * 60)
+
+    def test_fit_windows(self):
+        self.assertEqual(intervals.fit_windows([(0, 60), (100, 120), (200, 230)], 30), [(0, 31), (200, 201)])
+
+    def test_intersect(self):
+        self.assertEqual(intervals.intersect([(0, 10), (20, 30)], [(5, 25), (28, 40)]), [(5, 10), (20, 25), (28, 30)])
+        self.assertEqual(intervals.intersect([(0, 10)], [(10, 20)]), [])
+        self.assertEqual(intervals.intersect([], [(10, 20)]), [])
+
+    def test_contains(self):
+        windows = [(0, 10), (20, 30)]
+        self.assertTrue(intervals.contains(windows, 0))
+        self.assertTrue(intervals.contains(windows, 25))
+        self.assertFalse(intervals.contains(windows, 10))
+        self.assertFalse(intervals.contains(windows, -1))
+        self.assertFalse(intervals.contains(windows, 30))
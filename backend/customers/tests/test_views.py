@@ -1,10 +1,19 @@
+import json
+from datetime import date, timedelta
+from unittest import mock
+
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.http import http_date
 from django.core import mail
 from rest_framework import status
 
 import util.test_util as util
 from core.models import User
-from scheduling.models import Person, Company
+from scheduling.models import Person, Company, Request, Appointment, Service, ServiceCategory, Employee, \
+    Config
 from scheduling.tests.generics import ViewTestCase
 
 
@@ -51,9 +60,182 @@ class CompanyViewSetTest(ViewTestCase):
         response = self.client.get(self.list_url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
+    @staticmethod
+    def make_public():
+        Config.objects.filter(owner=1).update(private=False, allow_unpaid_request=True)
+        Company.objects.get(pk=1).save()
+
+    def get_company(self, lookup=1, **headers):
+        return self.client.get(reverse('customer-company-detail', kwargs={'pk': lookup}), **headers)
+
+    def test_retrieve_not_modified(self):
+        self.make_public()
+        # the last change was made ten seconds ago
+        Company.objects.filter(pk=1).update(public_version=F('public_version') - 10 ** 10)
+        response = self.get_company()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        for lookup in (1, 'Company-A'):
+            with self.assertNumQueries(1):
+                response = self.get_company(lookup, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['ETag'], etag)
+        response = self.get_company(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_retrieve_changed_within_the_second(self):
+        self.make_public()
+        second = -(-Company.objects.get(pk=1).public_version // 10 ** 9)
+        with mock.patch('customers.views.time') as clock:
+            clock.time.return_value = second - 0.5
+            self.assertNotIn('Last-Modified', self.get_company())
+            # the page can change again within the second, a client that only sends If-Modified-Since gets it
+            response = self.get_company(HTTP_IF_MODIFIED_SINCE=http_date(second))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            clock.time.return_value = second
+            response = self.get_company()
+            self.assertEqual(response['Last-Modified'], http_date(second))
+            response = self.get_company(HTTP_IF_MODIFIED_SINCE=http_date(second))
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_retrieve_modified(self):
+        changes = [
+            lambda: Company.objects.get(pk=1).save(),
+            lambda: Company.objects.get(pk=1).config.save(),
+            lambda: Service.objects.filter(owner=1).first().save(),
+            lambda: ServiceCategory.objects.create(owner_id=1, name='category'),
+            lambda: Employee.objects.filter(owner=1).first().save(),
+            lambda: Employee.objects.filter(owner=1).first().services.clear(),
+            lambda: Service.objects.filter(owner=1).first().employee_set.add(Employee.objects.filter(owner=1).first()),
+            lambda: Service.objects.filter(owner=1).first().delete(),
+        ]
+        self.make_public()
+        etag = self.get_company()['ETag']
+        for change in changes:
+            change()
+            response = self.get_company(HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+    def test_retrieve_not_public(self):
+        response = self.client.get(reverse('customer-company-detail', kwargs={'pk': 2}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_get_slots(self):
         pass
 
+    def test_get_days(self):
+        month = util.next_tuesday() + timedelta(days=35)
+        response = self.client.get(self.list_url + 'days/', {'month': month.strftime('%Y-%m'), 'service': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['date'], month.replace(day=1).date().isoformat())
+        tuesdays = [day for day in response.data if date.fromisoformat(day['date']).weekday() == 1]
+        for day in tuesdays:
+            self.assertTrue(day['available'])
+            self.assertEqual(day['free_slots'], 14)
+
+    def test_get_days_invalid_month(self):
+        response = self.client.get(self.list_url + 'days/', {'month': 'July', 'service': 1})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_get_days_last_month(self):
+        response = self.client.get(self.list_url + 'days/', {'month': '9999-12', 'service': 1})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertIn('month', response.data['detail'])
+
+    def test_get_slots_with_step(self):
+        day = util.next_tuesday()
+        params = {'start': str(day.replace(hour=0, minute=0)), 'end': str(day.replace(hour=23, minute=59)),
+                  'service': 1, 'employee': 1}
+        response = self.client.get(self.slot_url(), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 14)
+
+        response = self.client.get(self.slot_url(), {**params, 'step': 15})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 26)
+
+    def slot_params(self, days):
+        day = util.next_tuesday().replace(hour=0, minute=0, second=0)
+        return {'start': day.isoformat(), 'end': (day + timedelta(days=days)).isoformat(), 'service': 1}
+
+    def test_get_slots_stream(self):
+        params = self.slot_params(7)
+        expected = self.client.get(self.slot_url(), params)
+        response = self.client.get(self.slot_url(), {**params, 'stream': 'true'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        body = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(body, json.loads(expected.content))
+
+    def test_get_slots_invalid_before_stream(self):
+        """the requests the availability can't be computed for fail before the response is started"""
+        past = util.next_tuesday().replace(hour=0, minute=0, second=0) - timedelta(days=14)
+        past_params = {'start': past.isoformat(), 'end': (past + timedelta(days=1)).isoformat(), 'service': 1}
+        # employee 2 doesn't provide service 3
+        for params in (past_params, {**past_params, 'stream': 'true'},
+                       {**self.slot_params(1), 'service': 3, 'employee': 2, 'stream': 'true'}):
+            response = self.client.get(self.slot_url(), params)
+            self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+            self.assertFalse(response.streaming)
+
+    def test_get_slots_by_days(self):
+        params = self.slot_params(7)
+        expected = self.client.get(self.slot_url(), params).json()
+
+        results, url, pages = [], self.slot_url(), 0
+        response = self.client.get(url, {**params, 'days': 3})
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            results += response.data['results']
+            pages += 1
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+        self.assertEqual(pages, 3)
+        self.assertEqual(json.loads(json.dumps(results)), expected)
+
+    def test_get_combo(self):
+        params = {**self.slot_params(1), 'services': [1, 2]}
+        response = self.client.get(self.list_url + 'combo/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(len(response.data) > 0)
+        combo = response.data[0]
+        self.assertEqual([apt['service'] for apt in combo['appointments']], [1, 2])
+        self.assertEqual(combo['start'], combo['appointments'][0]['start'])
+        self.assertEqual(combo['appointments'][0]['end'], combo['appointments'][1]['start'])
+
+    def test_get_combo_invalid_service(self):
+        response = self.client.get(self.list_url + 'combo/', {**self.slot_params(1), 'services': [1, 999]})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_get_next_slot(self):
+        response = self.client.get(self.list_url + 'next_slot/', {'service': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data), {'start', 'end'})
+
+    def test_get_next_slot_not_found(self):
+        thursday = util.next_tuesday(2).replace(hour=0, minute=0, second=0)
+        params = {'service': 2, 'start': thursday.isoformat(), 'horizon': 3}
+        response = self.client.get(self.list_url + 'next_slot/', params)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_next_slot_past_last_date(self):
+        for params in ({'start': '9999-12-20T10:00'}, {'start': '9999-09-01T10:00', 'horizon': 120}):
+            response = self.client.get(self.list_url + 'next_slot/', {'service': 1, **params})
+            self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+            self.assertIn('start', response.data['detail'])
+        params = {'service': 1, 'start': '9999-12-20T10:00', 'horizon': 1}
+        response = self.client.get(self.list_url + 'next_slot/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_slots_range_too_long(self):
+        response = self.client.get(self.slot_url(), self.slot_params(400))
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
 
 class RequestViewSetTest(ViewTestCase):
 
@@ -80,6 +262,43 @@ class RequestViewSetTest(ViewTestCase):
             self.assertEqual(customer['last_name'], user.last_name)
             self.assertEqual(customer['email'], user.email)
 
+    def test_list_constant_queries(self):
+        """The company, the appointments and their relations are loaded along with the page, whatever its size"""
+        user = User.objects.get(pk=2)
+        monday = util.next_monday().replace(hour=9, minute=0, second=0, microsecond=0)
+        for day in range(10):
+            request = Request.objects.create(owner_id=1, user=user,
+                                             scheduled_date=(monday + timedelta(days=day)).date())
+            Appointment.objects.bulk_create([
+                Appointment(owner_id=1, employee_id=1, customer_id=2001, service_id=1, request=request,
+                            start=monday + timedelta(days=day, hours=hour),
+                            end=monday + timedelta(days=day, hours=hour, minutes=30)) for hour in range(2)])
+        self.client.force_authenticate(user=user)
+
+        counts = []
+        for page_size in (1, 10):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.list_url, {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), page_size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_total_rendered_as_number(self):
+        user = User.objects.get(pk=2)
+        start = util.next_monday().replace(hour=9, minute=0, second=0, microsecond=0)
+        request = Request.objects.create(owner_id=1, user=user, scheduled_date=start.date())
+        Appointment.objects.bulk_create([
+            Appointment(owner_id=1, employee_id=1, customer_id=2001, service_id=1, request=request, cost=cost,
+                        start=start + timedelta(hours=hour), end=start + timedelta(hours=hour, minutes=30))
+            for hour, cost in enumerate(('20.50', '17.50'))])
+        Request.objects.update_aggregates(request.id)
+        self.client.force_authenticate(user=user)
+
+        response = self.client.get(self.list_url)
+        totals = {r['id']: r['total'] for r in json.loads(response.content)['results']}
+        self.assertEqual(totals[request.id], 38.0)
+        self.assertIsInstance(totals[request.id], float)
+
     def test_get_current_no_owner_id(self):
         self.client.force_authenticate(user=test_user())
         response = self.client.get(self.current_url(), format='json')
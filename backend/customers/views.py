@@ -1,10 +1,23 @@
+import datetime
+import json
+import time
+
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 from kalendario.common import mixins, mail, viewsets
-from customers.models import get_availability_for_service
-from customers import serializers
+from kalendario.common.util import NON_FIELD_ERRORS
+from customers.customException import InvalidActionException
+from customers.models import get_availability_for_service, get_days_availability, iter_availability_by_day, \
+    get_combo_availability, find_next_available
+from customers import company_cache, serializers
 from scheduling import models
 
 import logging
@@ -55,6 +68,7 @@ class RequestViewSet(mixins.QuerysetSerializerMixin,
         appointment_id = self.get_queryset_params().get('appointment')
         appointment = get_object_or_404(instance.appointment_set.all(), pk=appointment_id)
         appointment.delete()
+        instance.refresh_aggregates()
         serializer = self.get_read_serializer(instance)
         return Response(serializer.data)
 
@@ -100,18 +114,74 @@ class CompanyViewSet(viewsets.ReadOnlyModelViewSet):
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return serializers.CompanyDetailsSerializer
-        if self.action == 'slots':
+        if self.action in ('slots', 'days', 'combo', 'next_slot'):
             return serializers.EmployeeSerializer
         return serializers.CompanySerializer
 
+    def handle_exception(self, exc):
+        # the availability can't be computed for the dates or the employee requested
+        if isinstance(exc, InvalidActionException):
+            exc = ValidationError({NON_FIELD_ERRORS: [str(exc)]})
+        return super().handle_exception(exc)
+
     def retrieve(self, request, pk=None, *args, **kwargs):
-        if not pk.isnumeric():
-            self.lookup_field = 'name'
-            self.kwargs.update({'name': pk})
-        return viewsets.ReadOnlyModelViewSet.retrieve(self, request, *args, **kwargs)
+        # the companies are looked up by id or by slug, the slugs are resolved from the cache
+        company = company_cache.get_public_company(pk)
+        if company is None:
+            raise NotFound()
+        company_id, version = company
+        self.kwargs['pk'] = company_id
+
+        # the version changes with any of the data rendered, see customers.signals, the clients that have the
+        # current version get a 304 without the company being serialized
+        etag = f'"{company_id}-{version}-{request.accepted_renderer.format}"'
+        # the version is the time of the change in nanoseconds, Last-Modified only has seconds so it's the end of the
+        # second of the change, and it's only used once that second is over: a page changed again within the second
+        # can't be reported as not modified
+        last_modified = -(-version // 10 ** 9)
+        if not version or last_modified > time.time():
+            last_modified = None
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.cached_response(company_cache.page_key(company_id, version),
+                                            lambda: viewsets.ReadOnlyModelViewSet.retrieve(self, request, *args,
+                                                                                           **kwargs))
+
+        response['ETag'] = etag
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        # shared caches can keep the page but have to revalidate it, the json and the browsable api share the url
+        patch_cache_control(response, public=True, no_cache=True)
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(company_cache.listing_key(request.build_absolute_uri()),
+                                    lambda: viewsets.ReadOnlyModelViewSet.list(self, request, *args, **kwargs))
+
+    def cached_response(self, key, get_response):
+        """
+        Returns the json rendered from the response of get_response through the cache,
+        the other formats such as the browsable api or indented json aren't cached
+        """
+        renderer = self.request.accepted_renderer
+        if renderer.format != 'json' or self.request.accepted_media_type != renderer.media_type:
+            return get_response()
+
+        content = cache.get(key)
+        if content is None:
+            response = get_response()
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            response.accepted_renderer = renderer
+            response.accepted_media_type = self.request.accepted_media_type
+            response.renderer_context = self.get_renderer_context()
+            content = response.rendered_content
+            cache.set(key, content, company_cache.PAGE_CACHE_TIMEOUT)
+        return HttpResponse(content, content_type=renderer.media_type)
 
     def get_queryset(self):
-        if self.action == 'slots':
+        if self.action in ('slots', 'days', 'combo', 'next_slot'):
             return models.Employee.objects.all()
 
         queryset = models.Company.objects.get_public()
@@ -126,17 +196,86 @@ class CompanyViewSet(viewsets.ReadOnlyModelViewSet):
 
         return queryset
 
-    @action(detail=False, methods=['get'])
-    def slots(self, request):
-        data = request.query_params.copy()
+    def get_availability_params(self, query_serializer_class):
+        data = self.request.query_params.copy()
         if hasattr(self.request.user, 'person_id'):
             data['customer'] = self.request.user.person_id
-        query_serializer = serializers.SlotQuerySerializer(data=data)
+        query_serializer = query_serializer_class(data=data)
         query_serializer.is_valid(raise_exception=True)
-        slots = get_availability_for_service(**query_serializer.validated_data)
+        return query_serializer.validated_data
+
+    @action(detail=False, methods=['get'])
+    def slots(self, request):
+        """
+        Returns the slots available for a service (params: start, end, service, employee, step)
+        - stream=true streams the slots as they are computed day by day
+        - days=N returns the slots of the first N days and the url of the next N days in next
+        """
+        params = self.get_availability_params(serializers.SlotQuerySerializer)
+        stream, days = params.pop('stream', False), params.pop('days', None)
+        if stream:
+            # the availability is loaded and validated before the response is started
+            return StreamingHttpResponse(self.stream_slots(iter_availability_by_day(**params)),
+                                         content_type='application/json')
+        if days is not None:
+            return self.slots_page(params, days)
+        slots = get_availability_for_service(**params)
         slot_serializer = serializers.SlotSerializer(slots, many=True)
         return Response(slot_serializer.data)
 
+    def slots_page(self, params, days):
+        start = max(params['start'], datetime.datetime.now())
+        page_end = start.replace(hour=0, minute=0, second=0, microsecond=0) + datetime.timedelta(days=days)
+        slots = get_availability_for_service(**{**params, 'start': start, 'end': min(params['end'], page_end)})
+        next_url = None
+        if page_end < params['end']:
+            next_url = replace_query_param(self.request.build_absolute_uri(), 'start', page_end.isoformat())
+        return Response({'next': next_url, 'results': serializers.SlotSerializer(slots, many=True).data})
+
+    @staticmethod
+    def stream_slots(days):
+        """
+        Yields the json array of slots in chunks, one chunk per day
+        :param days: the iterator returned by iter_availability_by_day
+        """
+        yield '['
+        separator = ''
+        for _, slots in days:
+            for slot in serializers.SlotSerializer(slots, many=True).data:
+                yield separator + json.dumps(slot, separators=(',', ':'))
+                separator = ','
+        yield ']'
+
+    @action(detail=False, methods=['get'])
+    def days(self, request):
+        """
+        Returns a summary of the availability of each day of a month (params: month=YYYY-MM, service, employee)
+        so the booking calendar can show the days without availability without loading every slot
+        """
+        days = get_days_availability(**self.get_availability_params(serializers.DaysQuerySerializer))
+        day_serializer = serializers.DayAvailabilitySerializer(days, many=True)
+        return Response(day_serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def next_slot(self, request):
+        """
+        Returns the first slot available for a service (params: service, employee, start, horizon in days),
+        responds with not found when there's no slot inside the horizon
+        """
+        slot = find_next_available(**self.get_availability_params(serializers.NextSlotQuerySerializer))
+        if slot is None:
+            raise NotFound('No slot available')
+        return Response(serializers.SlotSerializer(slot).data)
+
+    @action(detail=False, methods=['get'])
+    def combo(self, request):
+        """
+        Returns the slots where several services can be booked back to back in the order provided
+        (params: services (repeated), start, end, employee, step), with the employee assigned to each service
+        """
+        slots = get_combo_availability(**self.get_availability_params(serializers.ComboQuerySerializer))
+        return Response(serializers.ComboSlotSerializer(slots, many=True).data)
+
 
 class AppointmentViewSet(mixins.QuerysetSerializerMixin,
                          mixins.RequireAuthMixin,
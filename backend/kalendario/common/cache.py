@@ -0,0 +1,70 @@
+"""
+Helpers for versioned cache keys.
+Instead of deleting cached entries when the data they were built from changes, the version of the namespace the
+entries belong to is bumped. The entries built with the previous version can't be reached anymore and are left to
+expire or be evicted by the cache backend.
+"""
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+
+
+def _initial_version():
+    # A version that has not been used before, so entries built before the version key was evicted or the cache
+    # was cleared are never reached again
+    return time.time_ns()
+
+
+def get_versions(keys):
+    """
+    :param keys: the version keys
+    :return: a dict with the version of each key, keys without a version are initialized
+    """
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            version = _initial_version()
+            cache.add(key, version, None)
+            versions[key] = cache.get(key, version)
+    return versions
+
+
+def get_version(key):
+    return get_versions([key])[key]
+
+
+def bump_version(key):
+    """Makes the entries built with the current version of the key unreachable"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return get_version(key)
+
+
+def bump_versions(keys):
+    for key in keys:
+        bump_version(key)
+
+
+class LocalCache:
+    """
+    A bounded in process cache used in front of the shared cache for small immutable values,
+    the keys should be versioned so entries never need to be invalidated.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+
+    def get_many(self, keys):
+        entries = ((key, self._entries.get(key)) for key in keys)
+        return {key: value for key, value in entries if value is not None}
+
+    def set_many(self, values):
+        self._entries.update(values)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
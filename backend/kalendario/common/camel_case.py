@@ -0,0 +1,135 @@
+"""
+The camelCase renderer and parser of the API, they render and parse the same as the ones of
+djangorestframework_camel_case but translate each key once and encode with orjson when it's installed.
+The data is only encoded by orjson when its output is the same the json module renders, otherwise the
+renderer falls back to the json module.
+"""
+import decimal
+import json
+import math
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.files import File
+from django.http import QueryDict
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+from djangorestframework_camel_case.settings import api_settings as camel_case_settings
+from djangorestframework_camel_case.util import camelize_re, underscore_to_camel, camel_to_underscore, is_iterable
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the keys translated are mostly the field names of the serializers, the keys of the dicts sent by the users are
+# translated too so the cache is bounded
+KEYS_CACHE_SIZE = 4096
+SCALARS = (str, int, type(None))
+
+
+@lru_cache(maxsize=KEYS_CACHE_SIZE)
+def camelize_key(key):
+    return camelize_re.sub(underscore_to_camel, key) if '_' in key else key
+
+
+underscore_key = lru_cache(maxsize=KEYS_CACHE_SIZE)(camel_to_underscore)
+
+
+def camelize(data, unsafe=None):
+    """
+    Returns the data with the keys of its dicts in camelCase, the iterables are returned as lists
+    :param unsafe: a list the numbers orjson may format differently from the json module are appended to
+    """
+    if isinstance(data, SCALARS):
+        return data
+    if isinstance(data, float):
+        # orjson writes the exponents without sign and padding, e.g: 1e-05 is written 1e-5
+        if unsafe is not None and (not math.isfinite(data) or 'e' in repr(data)):
+            unsafe.append(data)
+        return data
+    if isinstance(data, decimal.Decimal):
+        # the decimals are encoded as floats
+        if unsafe is not None:
+            unsafe.append(data)
+        return data
+    if isinstance(data, Promise):
+        data = force_str(data)
+    if isinstance(data, dict):
+        new_dict = {}
+        for key, value in data.items():
+            if isinstance(key, Promise):
+                key = force_str(key)
+            new_dict[camelize_key(key) if isinstance(key, str) else key] = camelize(value, unsafe)
+        return new_dict
+    if isinstance(data, str) or not is_iterable(data):
+        return data
+    return [camelize(item, unsafe) for item in data]
+
+
+def underscoreize(data, **options):
+    """Returns the data with the keys of its dicts in snake_case, a QueryDict is returned as a QueryDict"""
+    if isinstance(data, SCALARS) or isinstance(data, float):
+        return data
+    if isinstance(data, dict):
+        items = data.lists() if isinstance(data, QueryDict) else data.items()
+        new_dict = {}
+        for key, value in items:
+            new_key = underscore_key(key, **options) if isinstance(key, str) else key
+            new_dict[new_key] = underscoreize(value, **options)
+        if isinstance(data, QueryDict):
+            new_query = QueryDict(mutable=True)
+            for key, value in new_dict.items():
+                new_query.setlist(key, value)
+            return new_query
+        return new_dict
+    if is_iterable(data) and not isinstance(data, (str, File)):
+        return [underscoreize(item, **options) for item in data]
+    return data
+
+
+class CamelCaseJSONRenderer(JSONRenderer):
+    # the dates are left to the encoder of the json module, orjson formats them differently
+    orjson_options = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS if orjson else None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        unsafe = []
+        data = camelize(data, unsafe)
+        if (data is None or orjson is None or unsafe or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=self.orjson_options)
+        except orjson.JSONEncodeError:
+            # e.g: integers longer than 64 bits or keys that aren't strings
+            return super().render(data, accepted_media_type, renderer_context)
+        # the same escapes JSONRenderer adds so the output is a strict javascript subset
+        return ret.replace('\u2028'.encode(), b'\\u2028').replace('\u2029'.encode(), b'\\u2029')
+
+
+class CamelCaseJSONParser(JSONParser):
+    json_underscoreize = camel_case_settings.JSON_UNDERSCOREIZE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        try:
+            data = stream.read().decode(encoding)
+            return underscoreize(self.loads(data), **self.json_underscoreize)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+    @staticmethod
+    def loads(data):
+        if orjson is not None:
+            try:
+                return orjson.loads(data)
+            except orjson.JSONDecodeError:
+                # the json module accepts more than orjson, e.g: NaN or integers longer than 64 bits
+                pass
+        return json.loads(data)
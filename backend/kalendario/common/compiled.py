@@ -0,0 +1,170 @@
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.db.models import F, ForeignObjectRel
+from rest_framework import serializers
+from rest_framework.relations import PKOnlyObject
+
+from kalendario.common.optimizer import get_relation
+
+# the column holding the id of the object a related row belongs to
+OWNER_COLUMN = 'compiled_owner_id'
+
+
+class NotCompilable(Exception):
+    pass
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class):
+    """
+    Compiles a model serializer into the columns it reads and a function building the representation of a row,
+    a list is then rendered from a values() query without creating the model instances nor walking the fields of
+    the serializer for every object, the output is the same the serializer renders.
+    The properties of the model are compiled when the serializer lists the columns they read in
+    Meta.compiled_properties, e.g: compiled_properties = {'price': ('cost', 'is_from')}
+    :return: the CompiledSerializer or None when a field can't be read from the columns: method fields,
+    sources that aren't model fields, relations rendered other than by id and custom representations
+    """
+    try:
+        return CompiledSerializer(serializer_class())
+    except NotCompilable:
+        return None
+
+
+class CompiledSerializer:
+    def __init__(self, serializer):
+        self.model = getattr(getattr(serializer, 'Meta', None), 'model', None)
+        if self.model is None:
+            raise NotCompilable()
+        self.relations = []
+        self.root = CompiledLevel(serializer, self.model, '', self.relations)
+
+    def values(self, queryset, **expressions):
+        """The rows of the queryset read by the serializer, the prefetched relations are loaded by render instead"""
+        return queryset.prefetch_related(None).values(*self.root.columns, **expressions)
+
+    def render(self, rows):
+        """Returns the representation of every row returned by values"""
+        rows = list(rows)
+        loaded = {relation: relation.load(rows) for relation in self.relations}
+        return [self.root.render(row, loaded) for row in rows]
+
+
+class CompiledLevel:
+    """The fields of a serializer of the model reached through prefix, the lookup of its relation in the row"""
+
+    def __init__(self, serializer, model, prefix, relations):
+        if type(serializer).to_representation is not serializers.Serializer.to_representation:
+            raise NotCompilable()
+        self.model = model
+        self.prefix = prefix
+        self.pk = prefix + 'pk'
+        self.columns = [self.pk]
+        self.relations = relations
+        self.properties = getattr(getattr(serializer, 'Meta', None), 'compiled_properties', {})
+        self.fields = [(field.field_name, self.compile_field(field))
+                       for field in serializer.fields.values() if not field.write_only]
+
+    def add_column(self, name):
+        column = self.prefix + name
+        if column not in self.columns:
+            self.columns.append(column)
+        return column
+
+    def compile_field(self, field):
+        if field.source == '*' or len(field.source_attrs) != 1:
+            raise NotCompilable()
+        name = field.source_attrs[0]
+        relation = get_relation(self.model, name)
+        to_many = relation is not None and (relation.many_to_many or relation.one_to_many)
+
+        if isinstance(field, serializers.ListSerializer) and to_many:
+            return self.read_many(ManyRelation(relation, self.pk, child=CompiledSerializer(field.child)))
+        if isinstance(field, serializers.ManyRelatedField) and to_many:
+            if type(field.child_relation) is not serializers.PrimaryKeyRelatedField:
+                raise NotCompilable()
+            return self.read_many(ManyRelation(relation, self.pk, child_relation=field.child_relation))
+        if relation is not None and to_many:
+            raise NotCompilable()
+
+        if isinstance(field, serializers.BaseSerializer) and relation is not None:
+            nested = CompiledLevel(field, relation.related_model, self.prefix + name + '__', self.relations)
+            self.columns += [column for column in nested.columns if column not in self.columns]
+            return self.read_nested(nested)
+        if type(field) is serializers.PrimaryKeyRelatedField and relation is not None and relation.concrete:
+            return self.read_pk(field, self.add_column(relation.attname))
+        if relation is not None:
+            raise NotCompilable()
+
+        if isinstance(field, serializers.ModelField):
+            return self.read_object(field, [field.model_field.attname])
+        if name in self.properties:
+            return self.read_object(field, self.properties[name])
+        if not is_column(self.model, name) or type(field).get_attribute is not serializers.Field.get_attribute:
+            raise NotCompilable()
+        return self.read_column(field, self.add_column(name))
+
+    def read_many(self, related):
+        self.relations.append(related)
+        return lambda row, loaded: loaded[related].get(row[self.pk], [])
+
+    @staticmethod
+    def read_nested(level):
+        return lambda row, loaded: None if row[level.pk] is None else level.render(row, loaded)
+
+    @staticmethod
+    def read_pk(field, column):
+        return lambda row, loaded: None if row[column] is None else field.to_representation(PKOnlyObject(row[column]))
+
+    @staticmethod
+    def read_column(field, column):
+        return lambda row, loaded: None if row[column] is None else field.to_representation(row[column])
+
+    def read_object(self, field, attnames):
+        """Reads the field from a bare instance of the model with only the attributes the field uses"""
+        columns = [(attname, self.add_column(attname)) for attname in attnames]
+
+        def read(row, loaded):
+            instance = self.model.__new__(self.model)
+            instance.__dict__.update((attname, row[column]) for attname, column in columns)
+            attribute = field.get_attribute(instance)
+            return None if attribute is None else field.to_representation(attribute)
+        return read
+
+    def render(self, row, loaded):
+        return OrderedDict((name, read(row, loaded)) for name, read in self.fields)
+
+
+class ManyRelation:
+    """A relation to many objects rendered by a field, loaded with a single query for all the rows of a list"""
+
+    def __init__(self, relation, owner_pk, child=None, child_relation=None):
+        self.owner_pk = owner_pk
+        self.child = child
+        self.child_relation = child_relation
+        self.model = relation.related_model
+        # the name of the relation back to the owners from the related model
+        self.lookup = relation.field.name if isinstance(relation, ForeignObjectRel) else relation.related_query_name()
+
+    def load(self, rows):
+        """:return: the representation of the related objects of every owner by the owner's id"""
+        owners = {row[self.owner_pk] for row in rows} - {None}
+        if not owners:
+            return {}
+        queryset = self.model._default_manager.filter(**{self.lookup + '__in': owners})
+        loaded = {}
+        if self.child_relation is not None:
+            for owner, pk in queryset.values_list(self.lookup, 'pk'):
+                loaded.setdefault(owner, []).append(self.child_relation.to_representation(PKOnlyObject(pk)))
+            return loaded
+
+        related_rows = list(self.child.values(queryset, **{OWNER_COLUMN: F(self.lookup)}))
+        for row, data in zip(related_rows, self.child.render(related_rows)):
+            loaded.setdefault(row[OWNER_COLUMN], []).append(data)
+        return loaded
+
+
+def is_column(model, name):
+    """True when name is a column of the model, the id of a relation is a column too, e.g: owner_id"""
+    return any(field.attname == name for field in model._meta.concrete_fields)
@@ -1,17 +1,63 @@
+from django.db.models import QuerySet
 from drf_rw_serializers import viewsets as drf
+from rest_framework.response import Response
 
+from kalendario.common.compiled import compile_serializer
+from kalendario.common.optimizer import optimize_queryset
 from kalendario.common.pagination import StandardResultsSetPagination
 
 from dj_rest_auth.jwt_auth import JWTCookieAuthentication
 from rest_framework.permissions import IsAuthenticated
 from . import filters, permissions
-from djangorestframework_camel_case.util import underscoreize
+from .camel_case import underscoreize
 
 
 class RenderParserPaginationMixin:
     pagination_class = StandardResultsSetPagination
 
 
+class QuerysetOptimizerMixin:
+    """
+    Loads the relations rendered by the read serializer along with the objects listed or retrieved,
+    it's applied by filter_queryset as the views override get_queryset without calling super
+    """
+    optimized_actions = ('list', 'retrieve')
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action not in self.optimized_actions:
+            return queryset
+        get_serializer_class = getattr(self, 'get_read_serializer_class', self.get_serializer_class)
+        return optimize_queryset(queryset, get_serializer_class())
+
+
+class CompiledListMixin:
+    """
+    Lists the objects with the compiled read serializer when it has one, the rows are read with values() and
+    rendered without creating the model instances, see kalendario.common.compiled
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.list_response(self.filter_queryset(self.get_queryset()))
+
+    def list_response(self, objects):
+        """Paginates and renders the objects, a list of objects or a queryset of the read serializer's model"""
+        compiled = None
+        if isinstance(objects, QuerySet):
+            compiled = compile_serializer(self.get_read_serializer_class())
+        if compiled is not None and compiled.model is objects.model:
+            objects = compiled.values(objects)
+            render = compiled.render
+        else:
+            def render(page):
+                return self.get_read_serializer(page, many=True).data
+
+        page = self.paginate_queryset(objects)
+        if page is not None:
+            return self.get_paginated_response(render(page))
+        return Response(render(objects))
+
+
 class RequireAuthMixin:
     authentication_classes = (JWTCookieAuthentication, )
 
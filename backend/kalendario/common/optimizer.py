@@ -0,0 +1,76 @@
+from django.db.models import Prefetch, ForeignObjectRel
+from rest_framework import serializers
+
+
+def optimize_queryset(queryset, serializer):
+    """
+    Loads along with the queryset the relations the serializer renders, the relations to one object are joined
+    with select_related and the relations to many objects are prefetched, so serializing a list of objects costs
+    the same amount of queries whatever its length.
+    The queryset is returned as it is when the serializer isn't a model serializer of the queryset's model.
+    :param serializer: a serializer class or instance, a list serializer is optimized for its child
+    """
+    if isinstance(serializer, type):
+        serializer = serializer()
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    if getattr(getattr(serializer, 'Meta', None), 'model', None) is not queryset.model:
+        return queryset
+
+    select, prefetch = related_lookups(serializer, queryset.model)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+def related_lookups(serializer, model, prefix=''):
+    """
+    Walks the fields of the serializer, the relations read by properties or methods of the model can't be found
+    this way, the serializer declares them in Meta.select_related and Meta.prefetch_related
+    :return: the lookups to select_related and the lookups or Prefetch objects to prefetch_related
+    """
+    meta = getattr(serializer, 'Meta', None)
+    select = [prefix + lookup for lookup in getattr(meta, 'select_related', ())]
+    prefetch = [prefix + lookup for lookup in getattr(meta, 'prefetch_related', ())]
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        relation = get_relation(model, field.source_attrs[0])
+        if relation is None:
+            continue
+
+        lookup = prefix + field.source_attrs[0]
+        to_many = relation.many_to_many or relation.one_to_many
+        if isinstance(field, serializers.ListSerializer) and to_many:
+            # the nested objects are loaded by a queryset optimized for the nested serializer
+            related = optimize_queryset(relation.related_model._default_manager.all(), field.child)
+            prefetch.append(Prefetch(lookup, queryset=related))
+        elif isinstance(field, serializers.BaseSerializer) and not to_many:
+            select.append(lookup)
+            nested_select, nested_prefetch = related_lookups(field, relation.related_model, lookup + '__')
+            select += nested_select
+            prefetch += nested_prefetch
+        elif isinstance(field, serializers.ManyRelatedField) and to_many:
+            prefetch.append(lookup)
+        elif not to_many and (len(field.source_attrs) > 1 or needs_related_object(field)):
+            select.append(lookup)
+    return select, prefetch
+
+
+def get_relation(model, name):
+    """Returns the relation of the model accessed as name, forward or reverse, or None when it isn't one"""
+    for field in model._meta.get_fields():
+        if field.is_relation:
+            accessor = field.get_accessor_name() if isinstance(field, ForeignObjectRel) else field.name
+            if accessor == name:
+                return field
+    return None
+
+
+def needs_related_object(field):
+    """A related field rendering the primary key only reads the id of the relation, not the related object"""
+    if isinstance(field, serializers.RelatedField):
+        return not field.use_pk_only_optimization()
+    return False
@@ -1,3 +1,7 @@
+import bisect
+import heapq
+from itertools import islice
+
 from rest_framework.pagination import PageNumberPagination
 
 
@@ -5,3 +9,41 @@ class StandardResultsSetPagination(PageNumberPagination):
     page_size = 200
     page_size_query_param = 'page_size'
     max_page_size = 300
+
+
+class MergedList:
+    """
+    The rows of a queryset merged with a sorted list of objects, both ordered by key, paginated without loading
+    the whole queryset: a page only reads its window of the queryset with a LIMIT / OFFSET query.
+    On a tie the rows of the queryset are listed before the objects.
+    """
+
+    def __init__(self, queryset, objects, key):
+        self.queryset = queryset
+        self.objects = objects
+        self.key = key
+        self.keys = [key(obj) for obj in objects]
+
+    def count(self):
+        return self.queryset.count() + len(self.objects)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice) or item.step is not None:
+            raise TypeError('MergedList only supports slices without a step')
+        start, stop = item.start or 0, item.stop
+        # at most all the objects are before the start, so the page starts after the first skipped rows
+        skipped = max(0, start - len(self.objects))
+        rows = list(self.queryset[skipped:stop])
+        if skipped and not rows:
+            return []
+        # the objects before the first row read are before the start too
+        first = bisect.bisect_left(self.keys, self.key(rows[0])) if skipped else 0
+        merged = heapq.merge(rows, self.objects[first:], key=self.key)
+        offset = skipped + first
+        return list(islice(merged, start - offset, None if stop is None else stop - offset))
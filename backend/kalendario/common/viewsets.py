@@ -1,15 +1,16 @@
 from drf_rw_serializers import viewsets as drf
 
-from kalendario.common.mixins import RenderParserPaginationMixin
+from kalendario.common.mixins import RenderParserPaginationMixin, QuerysetOptimizerMixin, CompiledListMixin
 
 
-class GenericViewSet(RenderParserPaginationMixin, drf.GenericViewSet):
+class GenericViewSet(QuerysetOptimizerMixin, RenderParserPaginationMixin, drf.GenericViewSet):
     pass
 
 
-class ModelViewSet(RenderParserPaginationMixin, drf.ModelViewSet):
+class ModelViewSet(CompiledListMixin, QuerysetOptimizerMixin, RenderParserPaginationMixin, drf.ModelViewSet):
     pass
 
 
-class ReadOnlyModelViewSet(RenderParserPaginationMixin, drf.ReadOnlyModelViewSet):
+class ReadOnlyModelViewSet(CompiledListMixin, QuerysetOptimizerMixin, RenderParserPaginationMixin,
+                           drf.ReadOnlyModelViewSet):
     pass
@@ -57,7 +57,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny'
     ],
     'DEFAULT_RENDERER_CLASSES': (
-        'djangorestframework_camel_case.render.CamelCaseJSONRenderer',
+        'kalendario.common.camel_case.CamelCaseJSONRenderer',
         'djangorestframework_camel_case.render.CamelCaseBrowsableAPIRenderer',
         # Any other renders
     ),
@@ -65,7 +65,7 @@ REST_FRAMEWORK = {
         # If you use MultiPartFormParser or FormParser, we also have a camel case version
         'djangorestframework_camel_case.parser.CamelCaseFormParser',
         'djangorestframework_camel_case.parser.CamelCaseMultiPartParser',
-        'djangorestframework_camel_case.parser.CamelCaseJSONParser',
+        'kalendario.common.camel_case.CamelCaseJSONParser',
         # Any other parsers
     ),
     'EXCEPTION_HANDLER': 'kalendario.common.handlers.custom_exception_handler'
@@ -211,6 +211,15 @@ CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# The cache is shared by all the processes, the versions of the cached availability and week templates are bumped by the
+# process that handles a change and read by all the others, so it falls back to the same redis as celery
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get('REDIS_URL', 'redis://localhost:6379'),
+    }
+}
+
 CELERY_BEAT_SCHEDULE = {
     'delete-idle-every-2-minute': {
         'task': 'scheduling.tasks.delete_idle_requests',
@@ -219,3 +228,6 @@ CELERY_BEAT_SCHEDULE = {
 }
 
 SPA_BASE_URL = os.environ.get('SPA_URL', '')
+
+# How an employee is picked for appointments booked without one: first_fit, least_booked or round_robin
+EMPLOYEE_SELECTION_POLICY = os.environ.get('EMPLOYEE_SELECTION_POLICY', 'first_fit')
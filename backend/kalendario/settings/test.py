@@ -8,6 +8,14 @@ ALLOWED_HOSTS = '*'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+# Caching is disabled for tests as the cache is not rolled back with the database between tests,
+# tests that check caching override this setting
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+    }
+}
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -15,3 +15,13 @@ class InvalidCustomer(ValidationError):
     """
     def __init__(self, message, code=None, params=None):
         super().__init__(message, code, params)
+
+
+class BulkValidationError(ValidationError):
+    """
+    This error is to be used when some of the elements of a bulk operation are invalid,
+    errors holds the errors of each element in the same order as the elements
+    """
+    def __init__(self, errors):
+        super().__init__('Some of the elements are invalid')
+        self.errors = errors
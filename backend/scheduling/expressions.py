@@ -0,0 +1,35 @@
+"""
+Database expressions for the periods of time of the appointments.
+The period of an appointment is the half open range [start, end), two appointments that only touch don't overlap.
+"""
+from django.contrib.postgres.fields import DateTimeRangeField, IntegerRangeField
+from django.db import models
+
+
+class TsTzRange(models.Func):
+    """tstzrange(start, end), the range type of the datetime columns"""
+    function = 'TSTZRANGE'
+    output_field = DateTimeRangeField()
+
+
+class Int4Range(models.Func):
+    function = 'INT4RANGE'
+    output_field = IntegerRangeField()
+
+
+def single_value_range(field):
+    """
+    The range [value, value] of an integer column, two of these ranges overlap only when the values are equal
+    which allows comparing integers in gist indexes without the btree_gist extension
+    """
+    return Int4Range(field, field, models.Value('[]'))
+
+
+def appointment_period():
+    return TsTzRange('start', 'end')
+
+
+def period(start, end):
+    """The range [start, end) of the datetimes provided"""
+    return TsTzRange(models.Value(start, output_field=models.DateTimeField()),
+                     models.Value(end, output_field=models.DateTimeField()))
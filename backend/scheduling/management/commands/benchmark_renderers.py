@@ -0,0 +1,87 @@
+"""
+Benchmarks the camelCase renderer and parser of kalendario.common.camel_case against the ones of
+djangorestframework_camel_case on the largest list payloads: full pages of appointments and customers of a synthetic
+company built with the test factories. The rendered pages are parsed back to measure the parsers.
+The data is created inside a transaction that is rolled back at the end so the command doesn't leave anything behind.
+e.g: python manage.py benchmark_renderers --page-size 300 --output benchmarks.jsonl
+"""
+import datetime
+import io
+import json
+import random
+
+from django.db import transaction
+from django.core.management.base import BaseCommand
+from djangorestframework_camel_case import parser, render
+
+from customers.management.commands.benchmark_availability import build_tenant, git_revision, measure
+from kalendario.common import camel_case
+from kalendario.common.optimizer import optimize_queryset
+from scheduling import models, serializers
+from scheduling.tests import factories
+
+IMPLEMENTATIONS = {
+    'package': (render.CamelCaseJSONRenderer, parser.CamelCaseJSONParser),
+    'kalendario': (camel_case.CamelCaseJSONRenderer, camel_case.CamelCaseJSONParser),
+}
+
+
+class Command(BaseCommand):
+    help = 'Measures the wall time and peak memory of rendering and parsing the largest list payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, nargs='+', default=[300], help='Objects of each payload')
+        parser.add_argument('--employees', type=int, default=5, help='Employees of the company')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of each measurement')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='File the results are appended to, one json object per line')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        run = {'timestamp': datetime.datetime.now().isoformat(), 'revision': git_revision()}
+        page_sizes = options['page_size']
+        results = []
+        with transaction.atomic():
+            # 8 appointments per employee on the 5 working days of each week
+            days = 7 * (max(page_sizes) // (options['employees'] * 8 * 5) + 1)
+            tenant = build_tenant(options['employees'], 5, days, 8, 'day', rng)
+            factories.CustomerFactory.create_batch(max(page_sizes), owner=tenant.company)
+            lists = {
+                'appointments': (serializers.AppointmentReadSerializer,
+                                 models.Appointment.objects.filter(owner=tenant.company).order_by('start')),
+                'customers': (serializers.CustomerSerializer,
+                              models.Customer.objects.filter(owner=tenant.company).order_by('id')),
+            }
+            for name, (serializer_class, queryset) in lists.items():
+                for page_size in page_sizes:
+                    page = optimize_queryset(queryset[:page_size], serializer_class)
+                    data = {'count': page_size, 'next': None, 'previous': None,
+                            'results': serializer_class(page, many=True).data}
+                    for result in self.run_benchmarks(data, options['repeat']):
+                        results.append({**run, 'benchmark': name, 'page_size': page_size, **result})
+                        self.write_result(results[-1])
+            transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'a') as output:
+                for result in results:
+                    output.write(json.dumps(result) + '\n')
+
+    @staticmethod
+    def run_benchmarks(data, repeat):
+        """Yields the measurements of rendering the data and parsing it back with every implementation"""
+        content = render.CamelCaseJSONRenderer().render(data)
+        parsed = parser.CamelCaseJSONParser().parse(io.BytesIO(content))
+        for implementation, (renderer_class, parser_class) in IMPLEMENTATIONS.items():
+            renderer, json_parser = renderer_class(), parser_class()
+            identical = (renderer.render(data) == content
+                         and json_parser.parse(io.BytesIO(content)) == parsed)
+            result = {'implementation': implementation, 'identical': identical, 'bytes': len(content)}
+            yield {**result, 'operation': 'render', **measure(lambda: renderer.render(data), repeat)}
+            yield {**result, 'operation': 'parse',
+                   **measure(lambda: json_parser.parse(io.BytesIO(content)), repeat)}
+
+    def write_result(self, result):
+        self.stdout.write(f"{result['benchmark']} x{result['page_size']} {result['operation']} "
+                          f"({result['implementation']}): {result['wall_time_ms']['median']:.2f}ms median, "
+                          f"{result['peak_memory_kib']:.1f}KiB peak, identical: {result['identical']}")
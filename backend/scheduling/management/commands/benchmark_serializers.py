@@ -0,0 +1,81 @@
+"""
+Benchmarks the read serializers against their compiled form, see kalendario.common.compiled, on a synthetic
+company built with the test factories. Each list is rendered to json as the list endpoints do for every page size.
+The data is created inside a transaction that is rolled back at the end so the command doesn't leave anything behind.
+e.g: python manage.py benchmark_serializers --page-size 50 200 300 --output benchmarks.jsonl
+"""
+import datetime
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from customers.management.commands.benchmark_availability import build_tenant, git_revision, measure
+from kalendario.common.camel_case import CamelCaseJSONRenderer
+from kalendario.common.compiled import compile_serializer
+from kalendario.common.optimizer import optimize_queryset
+from scheduling import models, serializers
+from scheduling.tests import factories
+
+
+class Command(BaseCommand):
+    help = 'Measures the wall time, queries and peak memory of rendering lists with the serializers and compiled'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-size', type=int, nargs='+', default=[50, 200, 300], help='Objects rendered')
+        parser.add_argument('--employees', type=int, default=5, help='Employees of the company')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs of each measurement')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='File the results are appended to, one json object per line')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        run = {'timestamp': datetime.datetime.now().isoformat(), 'revision': git_revision()}
+        page_sizes = options['page_size']
+        results = []
+        with transaction.atomic():
+            # 8 appointments per employee on the 5 working days of each week
+            days = 7 * (max(page_sizes) // (options['employees'] * 8 * 5) + 1)
+            tenant = build_tenant(options['employees'], 5, days, 8, 'day', rng)
+            factories.CustomerFactory.create_batch(max(page_sizes), owner=tenant.company)
+            lists = {
+                'appointments': (serializers.AppointmentReadSerializer,
+                                 models.Appointment.objects.filter(owner=tenant.company).order_by('start')),
+                'customers': (serializers.CustomerSerializer,
+                              models.Customer.objects.filter(owner=tenant.company).order_by('id')),
+            }
+            for name, (serializer_class, queryset) in lists.items():
+                for page_size in page_sizes:
+                    for result in self.run_benchmarks(serializer_class, queryset[:page_size], options['repeat']):
+                        results.append({**run, 'benchmark': name, 'page_size': page_size, **result})
+                        self.write_result(results[-1])
+            transaction.set_rollback(True)
+
+        if options['output']:
+            with open(options['output'], 'a') as output:
+                for result in results:
+                    output.write(json.dumps(result) + '\n')
+
+    @staticmethod
+    def run_benchmarks(serializer_class, page, repeat):
+        """Yields the measurements of the serializer and of its compiled form rendering the page"""
+        compiled = compile_serializer(serializer_class)
+        if compiled is None:
+            raise CommandError(f'{serializer_class.__name__} can not be compiled')
+        renderer = CamelCaseJSONRenderer()
+
+        def serialize():
+            return renderer.render(serializer_class(optimize_queryset(page.all(), serializer_class), many=True).data)
+
+        def render_compiled():
+            return renderer.render(compiled.render(compiled.values(page.all())))
+
+        identical = serialize() == render_compiled()
+        yield {'serializer': 'drf', 'identical': identical, **measure(serialize, repeat)}
+        yield {'serializer': 'compiled', 'identical': identical, **measure(render_compiled, repeat)}
+
+    def write_result(self, result):
+        self.stdout.write(f"{result['benchmark']} x{result['page_size']} ({result['serializer']}): "
+                          f"{result['wall_time_ms']['median']:.2f}ms median, {result['queries']} queries, "
+                          f"{result['peak_memory_kib']:.1f}KiB peak, identical: {result['identical']}")
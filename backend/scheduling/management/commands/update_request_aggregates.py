@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from scheduling import models
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the total, appointment count, first start and last end stored on the requests'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', type=int, help='Only the requests of this company')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Requests updated by each query')
+
+    def handle(self, *args, **options):
+        queryset = models.Request.objects.order_by('id')
+        if options['owner'] is not None:
+            queryset = queryset.filter(owner_id=options['owner'])
+
+        request_ids = list(queryset.values_list('id', flat=True))
+        updated = 0
+        for i in range(0, len(request_ids), options['batch_size']):
+            updated += models.Request.objects.update_aggregates(*request_ids[i:i + options['batch_size']])
+        self.stdout.write(f'{updated} requests updated')
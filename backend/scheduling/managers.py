@@ -1,8 +1,28 @@
 import datetime
+import time
+from django.apps import apps
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, connections
 from safedelete.models import SafeDeleteManager
-from django.db.models import Q
+from django.db.models import Q, Exists, OuterRef, Subquery, Count, F, Sum, Min, Max, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.dispatch import Signal
+
+from kalendario.common import cache as versioned_cache
+from scheduling.expressions import appointment_period, period
+
+WEEK_TEMPLATE_TIMEOUT = 60 * 60 * 24
+WEEKDAY_FIELDS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+# sent with the employee_ids of the appointments created or updated in bulk, post_save isn't sent for them
+appointments_bulk_changed = Signal()
+# first key of the advisory locks taken on employees, the second one is the employee id
+EMPLOYEE_LOCK_NAMESPACE = 1
+
+
+def week_template_version_key(schedule_id):
+    return f'schedule:{schedule_id}:week:version'
 
 
 class AppointmentManager(SafeDeleteManager):
@@ -24,23 +44,155 @@ class AppointmentManager(SafeDeleteManager):
         return self.get_queryset().filter(status='P')
 
     def active(self):
-        return self.get_queryset().filter(~Q(status='R'))
+        # the deleted appointments are filtered explicitly, safedelete doesn't filter them out of subqueries
+        return self.get_queryset().filter(~Q(status='R'), deleted__isnull=True)
 
     def overlapping(self, start, end, exclude_id=None, **kwargs):
         """
-        Given a start and end date this method will appointments that overlaps with the date range
-        - appointments that have their start date between this range
-        - appointments that have their end date between this range
-        - Appointments that have their start before this start and end after the end
+        Given a start and end date this method will return the active appointments that overlaps with the date range,
+        the periods are compared with a single range predicate that can use the gist index on the appointments
         """
-        query = self.active().filter(Q(start__gte=start, start__lt=end) |  # starts between
-                                     Q(end__gt=start, end__lte=end) |  # ends between
-                                     Q(start__lte=start, end__gte=end))  # starts before and ends after
+        query = self.active().annotate(period=appointment_period()).filter(period__overlap=period(start, end))
         if exclude_id:
             query = query.filter(~Q(id=exclude_id))
         return query.filter(**kwargs)
 
 
+class AppointmentSeriesQuerySet(models.QuerySet):
+    def overlapping(self, start, end):
+        """Returns the active series with occurrences that can overlap the start / end date range"""
+        return self.filter(~Q(status='R'), start__lt=end).filter(Q(until__isnull=True) | Q(until__gt=start))
+
+    def occurrences(self, start, end, exclude=None):
+        """
+        Expands the occurrences of the series that overlap the start / end date range, the occurrences that were
+        edited or cancelled are left out as they are stored as appointments.
+        :param exclude: an appointment of a series, its own occurrence is left out too
+        :return: a list of unsaved appointments sorted by start
+        """
+        series = list(self.overlapping(start, end).select_related('employee', 'customer', 'service'))
+        if not series:
+            return []
+
+        longest = max(s.duration for s in series)
+        materialized = set(apps.get_model('scheduling', 'Appointment').objects.all_with_deleted().filter(
+            series_id__in=[s.id for s in series], occurrence__gt=start - longest, occurrence__lt=end,
+        ).values_list('series_id', 'occurrence'))
+        if exclude is not None and exclude.series_id is not None:
+            materialized.add((exclude.series_id, exclude.occurrence))
+
+        occurrences = [s.materialize(occurrence) for s in series for occurrence in s.occurrence_starts(start, end)
+                       if (s.id, occurrence) not in materialized]
+        return sorted(occurrences, key=lambda apt: apt.start)
+
+
+class EmployeeManager(models.Manager):
+    def for_booking(self):
+        """
+        Loads the schedule and the ids of the services of the employees along with them,
+        so booking an appointment can check both without querying them separately
+        """
+        return self.get_queryset().select_related('schedule').annotate(
+            service_ids=ArrayAgg('services__id', filter=Q(services__isnull=False)))
+
+    def available_for(self, service, start, end, exclude_id=None):
+        """
+        Returns the employees that provide the service, have a time frame in their schedule covering start / end
+        and no active appointment nor occurrence of a series overlapping it,
+        the check is done by a single query once the occurrences are expanded
+        """
+        frames = apps.get_model('scheduling', 'TimeFrame').objects.filter(
+            shift_id=OuterRef(f'schedule__{WEEKDAY_FIELDS[start.weekday()]}_id'),
+            start__lte=start.time(), end__gte=end.time())
+        overlapping = apps.get_model('scheduling', 'Appointment').objects \
+            .overlapping(start, end, exclude_id=exclude_id).filter(employee_id=OuterRef('pk'))
+        # the occurrences of the series aren't stored, they are expanded to find the employees they keep busy
+        occurrences = apps.get_model('scheduling', 'AppointmentSeries').objects.filter(owner_id=service.owner_id) \
+            .occurrences(start, end)
+        return self.for_booking().filter(services=service).filter(Exists(frames)).exclude(Exists(overlapping)) \
+            .exclude(id__in={occurrence.employee_id for occurrence in occurrences})
+
+    def lock(self, *employee_ids):
+        """
+        Takes a transaction scoped advisory lock on each employee, they are held until the transaction ends
+        so bookings of the same employee wait for each other while bookings of other employees don't.
+        The locks are taken in the order of the ids with a single query, so two transactions locking some of the same
+        employees can't wait for each other. Must be called inside a transaction.
+        """
+        with connections[self.db].cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_xact_lock(%s, id) '
+                           'FROM (SELECT unnest(%s::integer[]) AS id ORDER BY id) AS ids',
+                           [EMPLOYEE_LOCK_NAMESPACE, sorted(set(employee_ids))])
+
+
+def first_fit(queryset, service, start, end):
+    """The available employee with the lowest id"""
+    return queryset.order_by('id')
+
+
+def least_booked(queryset, service, start, end):
+    """The available employee with the least active appointments on the day of the appointment"""
+    day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    booked = apps.get_model('scheduling', 'Appointment').objects.active() \
+        .filter(employee_id=OuterRef('pk'), start__gte=day, start__lt=day + datetime.timedelta(days=1)) \
+        .order_by().values('employee_id').annotate(count=Count('id')).values('count')
+    return queryset.annotate(booked=Coalesce(Subquery(booked), 0)).order_by('booked', 'id')
+
+
+def round_robin(queryset, service, start, end):
+    """The available employee that was booked for the service the longest time ago, or never"""
+    last_booked = apps.get_model('scheduling', 'Appointment').objects \
+        .filter(employee_id=OuterRef('pk'), service_id=service.id).order_by('-id').values('id')[:1]
+    return queryset.annotate(last_booked=Subquery(last_booked)).order_by(F('last_booked').asc(nulls_first=True), 'id')
+
+
+# Orders the employees available for an appointment, the first one is assigned to it
+EMPLOYEE_SELECTION_POLICIES = {
+    'first_fit': first_fit,
+    'least_booked': least_booked,
+    'round_robin': round_robin,
+}
+
+
+class ScheduleManager(models.Manager):
+    local_week_templates = versioned_cache.LocalCache()
+
+    def using_shift(self, shift_id):
+        """Returns the schedules that have the shift in any day of the week"""
+        return self.get_queryset().filter(Q(mon_id=shift_id) | Q(tue_id=shift_id) | Q(wed_id=shift_id) |
+                                          Q(thu_id=shift_id) | Q(fri_id=shift_id) | Q(sat_id=shift_id) |
+                                          Q(sun_id=shift_id))
+
+    def week_templates(self, schedules):
+        """
+        Returns the compiled week templates of the schedules, templates are looked up in the process first, then in
+        the shared cache and the schedules missing from both are compiled together in a single query.
+        :return: a dict with the schedule id as key and the template as value
+        """
+        schedules = {schedule.id: schedule for schedule in schedules}
+        versions = versioned_cache.get_versions([week_template_version_key(pk) for pk in schedules])
+        keys = {pk: f'schedule:{pk}:week:{versions[week_template_version_key(pk)]}' for pk in schedules}
+
+        templates = self.local_week_templates.get_many(keys.values())
+        missing = [key for key in keys.values() if key not in templates]
+        if missing:
+            shared = cache.get_many(missing)
+            self.local_week_templates.set_many(shared)
+            templates.update(shared)
+
+        missing = [schedule for pk, schedule in schedules.items() if keys[pk] not in templates]
+        if missing:
+            compiled = {keys[pk]: template for pk, template in self.model.compile_weeks(missing).items()}
+            cache.set_many(compiled, WEEK_TEMPLATE_TIMEOUT)
+            self.local_week_templates.set_many(compiled)
+            templates.update(compiled)
+
+        return {pk: templates[key] for pk, key in keys.items()}
+
+    def invalidate_week_templates(self, schedule_ids):
+        versioned_cache.bump_versions([week_template_version_key(pk) for pk in schedule_ids])
+
+
 class RequestManager(models.Manager):
     def get_current(self, owner_id, user_id):
         """
@@ -50,6 +202,27 @@ class RequestManager(models.Manager):
         return current if current else self.create(owner_id=owner_id, user_id=user_id,
                                                    scheduled_date=datetime.date.today())
 
+    def update_aggregates(self, *request_ids):
+        """
+        Recomputes the total, count, first start and last end of the appointments of the requests with a single update
+        :return: the amount of requests updated
+        """
+        request_ids = set(request_ids) - {None}
+        if not request_ids:
+            return 0
+
+        # the deleted appointments are filtered explicitly, safedelete doesn't filter them out of subqueries
+        appointments = apps.get_model('scheduling', 'Appointment').objects \
+            .filter(request_id=OuterRef('pk'), deleted__isnull=True).order_by().values('request_id')
+        aggregates = {'total': Sum('cost'), 'appointment_count': Count('id'),
+                      'first_start': Min('start'), 'last_end': Max('end')}
+        values = {name: Subquery(appointments.annotate(value=aggregate).values('value'))
+                  for name, aggregate in aggregates.items()}
+        return self.get_queryset().filter(id__in=request_ids).update(
+            total=Coalesce(values['total'], Value(0), output_field=models.DecimalField()),
+            appointment_count=Coalesce(values['appointment_count'], Value(0)),
+            first_start=values['first_start'], last_end=values['last_end'])
+
     def get_by_payment_intent_id(self, intend_id):
         return self.get_queryset().get(_stripe_payment_intent_id=intend_id)
 
@@ -64,3 +237,12 @@ class CompanyManager(models.Manager):
 
     def get_public(self):
         return self.get_queryset().filter(_is_viewable=True)
+
+    def bump_public_version(self, *company_ids):
+        """
+        Marks the public pages of the companies as changed, the version is the time of the change so it tells when
+        the company was last modified too, it always increases even if the clock goes back
+        """
+        ids = [pk for pk in company_ids if pk is not None]
+        if ids:
+            self.filter(pk__in=ids).update(public_version=Greatest(F('public_version') + 1, Value(time.time_ns())))
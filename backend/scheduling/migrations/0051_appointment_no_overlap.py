@@ -0,0 +1,47 @@
+# Generated by Django 3.1.13 on 2026-10-18 12:02
+
+import django.contrib.postgres.constraints
+from django.db import migrations, models
+import scheduling.expressions
+
+# Appointments that already overlap were booked ignoring the availability, they are kept out of the constraint
+ALLOW_EXISTING_OVERLAPS = '''
+UPDATE scheduling_appointment a SET allow_overlap = true
+WHERE a.deleted IS NULL AND a.status <> 'R' AND EXISTS (
+    SELECT 1 FROM scheduling_appointment b
+    WHERE b.id <> a.id AND b.employee_id = a.employee_id AND b.deleted IS NULL AND b.status <> 'R'
+    AND tstzrange(b.start, b."end") && tstzrange(a.start, a."end")
+)
+'''
+
+# Supports the overlapping queries of the active appointments
+CREATE_PERIOD_INDEX = '''
+CREATE INDEX scheduling_appointment_period_gist ON scheduling_appointment
+USING gist (tstzrange(start, "end")) WHERE deleted IS NULL AND status <> 'R'
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduling', '0050_auto_20210608_2028'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='allow_overlap',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='historicalappointment',
+            name='allow_overlap',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.RunSQL(ALLOW_EXISTING_OVERLAPS, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('deleted__isnull', True), models.Q(_negated=True, status='R'), ('allow_overlap', False)), expressions=[(scheduling.expressions.Int4Range('employee', 'employee', models.Value('[]')), '&&'), (scheduling.expressions.TsTzRange('start', 'end'), '&&')], name='appointment_no_overlap'),
+        ),
+        migrations.RunSQL(CREATE_PERIOD_INDEX, 'DROP INDEX scheduling_appointment_period_gist'),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 3.1.13 on 2026-10-18 12:07
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduling', '0051_appointment_no_overlap'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['owner', 'start'], name='apt_owner_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['employee', 'start', 'end'], name='apt_employee_period_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(deleted__isnull=True), fields=['owner', 'start'], name='apt_live_owner_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(condition=models.Q(('deleted__isnull', True), models.Q(_negated=True, status='R')), fields=['employee', 'start', 'end'], name='apt_active_employee_idx'),
+        ),
+        # the composite indexes lead with these columns, the single column indexes of the foreign keys are redundant
+        migrations.AlterField(
+            model_name='appointment',
+            name='employee',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='service_provided', to='scheduling.employee'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='scheduling.company'),
+        ),
+    ]
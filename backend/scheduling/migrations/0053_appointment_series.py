@@ -0,0 +1,79 @@
+# Generated by Django 3.1.13 on 2026-10-18 12:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduling', '0052_appointment_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppointmentSeries',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('duration', models.DurationField()),
+                ('rrule', models.CharField(max_length=255)),
+                ('until', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=10)),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('A', 'Accepted'), ('R', 'Rejected')], default='P', max_length=1)),
+                ('internal_notes', models.TextField(blank=True, max_length=255, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='occurrence',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='historicalappointment',
+            name='occurrence',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='appointmentseries',
+            name='customer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='series', to='scheduling.customer'),
+        ),
+        migrations.AddField(
+            model_name='appointmentseries',
+            name='employee',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series', to='scheduling.employee'),
+        ),
+        migrations.AddField(
+            model_name='appointmentseries',
+            name='owner',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='scheduling.company'),
+        ),
+        migrations.AddField(
+            model_name='appointmentseries',
+            name='service',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='scheduling.service'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='series',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='appointments', to='scheduling.appointmentseries'),
+        ),
+        migrations.AddField(
+            model_name='historicalappointment',
+            name='series',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='scheduling.appointmentseries'),
+        ),
+        migrations.AddIndex(
+            model_name='appointmentseries',
+            index=models.Index(fields=['owner', 'start'], name='series_owner_start_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointmentseries',
+            index=models.Index(fields=['employee', 'start'], name='series_employee_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='appointment',
+            constraint=models.UniqueConstraint(fields=('series', 'occurrence'), name='appointment_unique_occurrence'),
+        ),
+    ]
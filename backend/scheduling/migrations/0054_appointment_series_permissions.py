@@ -0,0 +1,33 @@
+from django.contrib.auth.management import create_permissions
+from django.db import migrations
+
+ACTIONS = ('add', 'change', 'delete', 'view')
+
+
+def grant_series_permissions(apps, schema_editor):
+    """The groups that can manage appointments can manage the series of appointments too"""
+    # the permissions of a new model are only created after all the migrations ran
+    app_config = apps.get_app_config('scheduling')
+    app_config.models_module = True
+    create_permissions(app_config, apps=apps, verbosity=0)
+    app_config.models_module = None
+
+    Permission = apps.get_model('auth', 'Permission')
+    Group = apps.get_model('auth', 'Group')
+    for action in ACTIONS:
+        permission = Permission.objects.get(codename=f'{action}_appointmentseries')
+        for group in Group.objects.filter(permissions__codename=f'{action}_appointment'):
+            group.permissions.add(permission)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('scheduling', '0053_appointment_series'),
+    ]
+
+    operations = [
+        migrations.RunPython(grant_series_permissions, migrations.RunPython.noop),
+    ]
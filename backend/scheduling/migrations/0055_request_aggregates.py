@@ -0,0 +1,48 @@
+# Generated by Django 3.1.13 on 2026-10-18 12:33
+
+from django.db import migrations, models
+
+# The requests without appointments keep the defaults
+BACKFILL_AGGREGATES = '''
+UPDATE scheduling_request r
+SET total = a.total, appointment_count = a.appointment_count, first_start = a.first_start, last_end = a.last_end
+FROM (
+    SELECT request_id, SUM(cost) AS total, COUNT(*) AS appointment_count, MIN(start) AS first_start,
+           MAX("end") AS last_end
+    FROM scheduling_appointment
+    WHERE deleted IS NULL AND request_id IS NOT NULL
+    GROUP BY request_id
+) a
+WHERE r.id = a.request_id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduling', '0054_appointment_series_permissions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='request',
+            name='appointment_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='request',
+            name='first_start',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='request',
+            name='last_end',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='request',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10),
+        ),
+        migrations.RunSQL(BACKFILL_AGGREGATES, migrations.RunSQL.noop),
+    ]
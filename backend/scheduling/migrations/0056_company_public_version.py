@@ -0,0 +1,24 @@
+# Generated by Django 3.1.13 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+# The public pages of the existing companies are considered modified by the migration
+BACKFILL_VERSIONS = '''
+UPDATE scheduling_company SET public_version = (EXTRACT(EPOCH FROM clock_timestamp()) * 1000000000)::bigint
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduling', '0055_request_aggregates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='public_version',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+        migrations.RunSQL(BACKFILL_VERSIONS, migrations.RunSQL.noop),
+    ]
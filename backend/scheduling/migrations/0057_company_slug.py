@@ -0,0 +1,29 @@
+# Generated by Django 3.1.13 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+# the slug is the name with the spaces replaced by underscores, see Company.slugify
+BACKFILL_SLUGS = '''
+UPDATE scheduling_company SET slug = REPLACE(name, ' ', '_')
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scheduling', '0056_company_public_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='slug',
+            field=models.CharField(editable=False, max_length=255, null=True),
+        ),
+        migrations.RunSQL(BACKFILL_SLUGS, migrations.RunSQL.noop),
+        migrations.AlterField(
+            model_name='company',
+            name='slug',
+            field=models.CharField(editable=False, max_length=255, unique=True),
+        ),
+    ]
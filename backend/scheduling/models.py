@@ -1,13 +1,26 @@
-from django.db import models
+import bisect
+from collections import namedtuple
+from datetime import time, datetime, timedelta, MAXYEAR
+from itertools import islice
+
+from dateutil import rrule
+
+from django.conf import settings
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import RangeOperators
+from django.db import models, transaction, IntegrityError
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
 
 from cloudinary.models import CloudinaryField
 from django.db.models import Q
 from simple_history.models import HistoricalRecords
+from simple_history.utils import bulk_create_with_history
 
 from kalendario.common.model_mixins import CleanSaveMixin
+from kalendario.common.util import NON_FIELD_ERRORS
 from scheduling import managers, exceptions
+from scheduling.expressions import appointment_period, single_value_range
 
 from safedelete.models import SafeDeleteModel
 from safedelete.models import HARD_DELETE
@@ -16,6 +29,39 @@ phone_regex = RegexValidator(regex=r'^\+?1?\d{9,15}$',
                              message="Phone number must be entered in the format: '+999999999'. Up to 15 digits allowed.")
 
 
+Frame = namedtuple('Frame', ('start', 'end'))
+# how far from now the occurrences of a series are checked against the availability of the employee
+SERIES_AVAILABILITY_HORIZON = timedelta(days=366)
+# bounds of the series that end, so they can be expanded on save
+SERIES_MAX_OCCURRENCES = 2000
+SERIES_MAX_LENGTH = timedelta(days=366 * 5)
+# the gregorian calendar repeats itself every 400 years, the weekdays and leap years included
+CALENDAR_CYCLE_YEARS = 400
+
+
+def add_years(value, years):
+    return value.replace(year=value.year + years)
+
+
+def minute_of_day(value):
+    return value.hour * 60 + value.minute
+
+
+def frames_cover(frames, start, end):
+    """Returns true if one of the frames, (start, end) minutes of the day, covers the start / end times"""
+    start_minute, end_minute = minute_of_day(start), minute_of_day(end)
+    return any(start_minute >= frame_start and end_minute <= frame_end for frame_start, frame_end in frames)
+
+
+def overlaps_busy(busy, start, end):
+    """
+    Returns true if the start / end period overlaps one of the busy periods
+    :param busy: a sorted list of (start, end) periods that don't overlap each other
+    """
+    index = bisect.bisect_left(busy, (end,))
+    return index > 0 and busy[index - 1][1] > start
+
+
 class TimeFrame(CleanSaveMixin, models.Model):
     start = models.TimeField()
     end = models.TimeField()
@@ -44,15 +90,51 @@ class Schedule(CleanSaveMixin, models.Model):
     sat = models.OneToOneField(Shift, on_delete=models.SET_NULL, null=True, blank=True, related_name='sat')
     sun = models.OneToOneField(Shift, on_delete=models.SET_NULL, null=True, blank=True, related_name='sun')
 
+    objects = managers.ScheduleManager()
+
     def get_week(self):
         """
         :return: a tuple with the shifts in the order of date.weekday to make it easy to access
         """
         return self.mon, self.tue, self.wed, self.thu, self.fri, self.sat, self.sun
 
+    def get_week_ids(self):
+        """
+        :return: a tuple with the shift ids in the order of date.weekday, this doesn't query the shifts
+        """
+        return self.mon_id, self.tue_id, self.wed_id, self.thu_id, self.fri_id, self.sat_id, self.sun_id
+
+    def get_week_template(self):
+        """
+        :return: the compiled week of the schedule, a tuple with the frames of each day in the order of date.weekday
+        where each day is a sorted tuple of (start, end) minutes of the day
+        """
+        return Schedule.objects.week_templates([self])[self.id]
+
     def get_availability(self, date):
-        shift = self.get_week()[date.weekday()]
-        return [] if shift is None else shift.timeframe_set.all()
+        """Returns the frames (start/end times) of the schedule for the date provided"""
+        return [Frame(time(start // 60, start % 60), time(end // 60, end % 60))
+                for start, end in self.get_week_template()[date.weekday()]]
+
+    @staticmethod
+    def compile_weeks(schedules):
+        """
+        Builds the week template of every schedule provided with a single query for the time frames
+        :return: a dict with the schedule id as key and the template as value
+        """
+        # the same shift can be used by many days and many schedules
+        shifts, weeks = {}, {}
+        for schedule in schedules:
+            weeks[schedule.id] = tuple([] for _ in range(7))
+            for weekday, shift_id in enumerate(schedule.get_week_ids()):
+                if shift_id is not None:
+                    shifts.setdefault(shift_id, []).append((schedule.id, weekday))
+
+        frames = TimeFrame.objects.filter(shift_id__in=[*shifts]).values_list('shift_id', 'start', 'end')
+        for shift_id, start, end in frames:
+            for schedule_id, weekday in shifts[shift_id]:
+                weeks[schedule_id][weekday].append((minute_of_day(start), minute_of_day(end)))
+        return {schedule_id: tuple(tuple(sorted(frames)) for frames in week) for schedule_id, week in weeks.items()}
 
     def __str__(self):
         return self.name
@@ -83,11 +165,15 @@ class Service(CleanSaveMixin, models.Model):
             return f'from €{self.cost}'
         return f'€{self.cost}'
 
-    def find_available_employee(self, apt):
-        for emp in self.employee_set.all():
-            if emp.is_available(apt):
-                return emp
-        return None
+    def find_available_employee(self, apt, policy=None):
+        """
+        Returns the employee available for the appointment picked by the selection policy or None if there's none
+        :param policy: the name of one of managers.EMPLOYEE_SELECTION_POLICIES,
+        defaults to the EMPLOYEE_SELECTION_POLICY setting
+        """
+        select = managers.EMPLOYEE_SELECTION_POLICIES[policy or settings.EMPLOYEE_SELECTION_POLICY]
+        available = Employee.objects.available_for(self, apt.start, apt.end, apt.id)
+        return select(available, self, apt.start, apt.end).first()
 
     def __str__(self):
         return self.name
@@ -117,7 +203,12 @@ class Employee(Person):
     profile_img = CloudinaryField('image', null=True, blank=True)
     bio = models.TextField(max_length=600, null=True, blank=True)
 
+    objects = managers.EmployeeManager()
+
     def provides_service(self, service):
+        # service_ids is loaded by EmployeeManager.for_booking
+        if hasattr(self, 'service_ids'):
+            return service.id in self.service_ids
         return self.services.filter(id=service.id).first() is not None
 
     def get_availability(self, date):
@@ -133,15 +224,22 @@ class Employee(Person):
         Returns true if the employee has availability in the schedule
         and no overlapping appointments for the appointment
         """
-        return self._has_availability(apt.start, apt.end) and not self._is_overlapping(apt.start, apt.end, apt.id)
+        return self._has_availability(apt.start, apt.end) and not self._is_overlapping(apt)
 
     def _has_availability(self, start, end):
         """Returns true if the employee has availability in the schedule for the start / end date provided"""
-        return any(frame.is_beyond(start.time(), end.time()) for frame in self.get_availability(start.date()))
+        if self.schedule is None:
+            return False
+        return frames_cover(self.schedule.get_week_template()[start.weekday()], start, end)
 
-    def _is_overlapping(self, start, end, exclude_id):
-        """Returns true if the appointment overlaps with any other appointment booked for this employee"""
-        return Appointment.objects.overlapping(start, end, employee=self, exclude_id=exclude_id)
+    def _is_overlapping(self, apt):
+        """
+        Returns true if the appointment overlaps with any other appointment booked for this employee
+        or with an occurrence of one of the employee's series
+        """
+        if Appointment.objects.overlapping(apt.start, apt.end, employee=self, exclude_id=apt.id).exists():
+            return True
+        return bool(AppointmentSeries.objects.filter(employee=self).occurrences(apt.start, apt.end, exclude=apt))
 
     def clean(self):
         Person.clean(self)
@@ -190,17 +288,25 @@ class Appointment(SafeDeleteModel):
         (REJECTED, 'Rejected'),
     ]
 
-    owner = models.ForeignKey('Company', on_delete=models.CASCADE)
+    # owner and employee are indexed as the leading columns of the indexes declared in Meta
+    owner = models.ForeignKey('Company', on_delete=models.CASCADE, db_index=False)
     start = models.DateTimeField()
     end = models.DateTimeField()
     cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='service_provided')
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='service_provided', db_index=False)
     lock_employee = models.BooleanField(default=True)
     customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='service_received', null=True)
     request = models.ForeignKey('Request', on_delete=models.CASCADE, null=True)
     service = models.ForeignKey(Service, on_delete=models.CASCADE, null=True)
     status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDING)
     internal_notes = models.TextField(max_length=255, null=True, blank=True)
+    # Set when the appointment was saved ignoring the availability of the employee, it may overlap other appointments
+    allow_overlap = models.BooleanField(default=False)
+    # Set when the appointment is an occurrence of a series that was edited or cancelled,
+    # occurrence is the start of the occurrence it replaces
+    series = models.ForeignKey('AppointmentSeries', on_delete=models.CASCADE, null=True, blank=True,
+                               related_name='appointments')
+    occurrence = models.DateTimeField(null=True, blank=True)
     history = HistoricalRecords()
 
     objects = managers.AppointmentManager()
@@ -209,6 +315,35 @@ class Appointment(SafeDeleteModel):
         permissions = [
             ("overlap_appointment", "Can overlap appointment"),
         ]
+        constraints = [
+            # the database guarantees an employee is never double booked, even by concurrent bookings
+            ExclusionConstraint(
+                name='appointment_no_overlap',
+                expressions=[(single_value_range('employee'), RangeOperators.OVERLAPS),
+                             (appointment_period(), RangeOperators.OVERLAPS)],
+                condition=Q(deleted__isnull=True) & ~Q(status='R') & Q(allow_overlap=False),
+            ),
+            # an occurrence of a series is replaced by a single appointment
+            models.UniqueConstraint(fields=['series', 'occurrence'], name='appointment_unique_occurrence'),
+        ]
+        indexes = [
+            # calendar views of the company and of its employees filtered by a date range
+            models.Index(fields=['owner', 'start'], name='apt_owner_start_idx'),
+            models.Index(fields=['employee', 'start', 'end'], name='apt_employee_period_idx'),
+            # the same lookups restricted to the rows that are not deleted, which is what the views list by default
+            models.Index(fields=['owner', 'start'], name='apt_live_owner_start_idx', condition=Q(deleted__isnull=True)),
+            # availability and overlapping checks only look at the active appointments
+            models.Index(fields=['employee', 'start', 'end'], name='apt_active_employee_idx',
+                         condition=Q(deleted__isnull=True) & ~Q(status='R')),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # keeps the employee the appointment was loaded with, so a change of employee can be detected on save
+        instance.loaded_employee_id = instance.__dict__.get('employee_id')
+        instance.loaded_request_id = instance.__dict__.get('request_id')
+        return instance
 
     def is_active(self):
         return self.status != Appointment.REJECTED
@@ -236,14 +371,22 @@ class Appointment(SafeDeleteModel):
 
         self.end = self.end.replace(second=0, microsecond=0)
 
+        # Checked before any lookup of the employees as their availability is queried with the start / end range
+        if self.end < self.start:
+            raise ValidationError(r"End time can't be before start time")
+
         # When an employee is not provided a service must be provided to allow the appointment to find an employee
         if self.employee_id is None and self.service_id is None:
             raise ValidationError('Either a service or an employee has to be provided')
 
         # If an appointment is being created without an employee this will find an employee available
+        self._employee_found_available = self.employee_id is None
         if self.employee_id is None:
             self.employee = self.service.find_available_employee(self)  #
             self.lock_employee = False
+        # Loads the employee with its schedule and services in a single query for the checks below and the availability
+        elif not Appointment.employee.is_cached(self) or not hasattr(self.employee, 'service_ids'):
+            self.employee = Employee.objects.for_booking().get(pk=self.employee_id)
 
         # If the above didn't find an employee the appointment can't be saved
         if self.employee is None:
@@ -268,20 +411,180 @@ class Appointment(SafeDeleteModel):
         if self.request is not None:
             self.request.scheduled_date = self.start.date()
 
-        if self.end < self.start:
-            raise ValidationError(r"End time can't be before start time")
-
     def save(self, ignore_availability=False, **kwargs):
         self.clean()
 
-        # Employee must be available for a service to be saved
-        if not ignore_availability and not self.employee.is_available(self):
-            raise ValidationError(r'No time available for the date selected')
+        self.allow_overlap = ignore_availability
+        try:
+            with transaction.atomic():
+                # Employee must be available for a service to be saved.
+                # Bookings of the same employee are serialized, so the check sees the appointments other workers
+                # booked before and a concurrent booking of the same time waits and fails the check instead.
+                # An employee found by clean was available when it was picked, only the appointments and series
+                # booked since then are checked again as the series aren't covered by the exclusion constraint
+                if not ignore_availability:
+                    Employee.objects.lock(self.employee_id)
+                    if self._employee_found_available:
+                        available = not self.employee._is_overlapping(self)
+                    else:
+                        available = self.employee.is_available(self)
+                    if not available:
+                        raise ValidationError(r'No time available for the date selected')
+                SafeDeleteModel.save(self, **kwargs)
+                Request.objects.update_aggregates(self.request_id, getattr(self, 'loaded_request_id', None))
+        except IntegrityError as e:
+            # another appointment was booked for the same time without taking the lock of the employee
+            if 'appointment_no_overlap' in str(e):
+                raise ValidationError(r'No time available for the date selected')
+            raise e
+
+    @classmethod
+    def bulk_book(cls, appointments, ignore_availability=False, user=None):
+        """
+        Validates and books a batch of appointments together in a constant number of queries.
+        The employees, services, customers and the appointments already booked in the period of the batch are loaded
+        once, then every appointment is cleaned and checked in memory against them and the appointments before it
+        in the batch. Nothing is booked when any of the appointments is invalid.
+        :param appointments: unsaved appointments, the employee of each one must be provided
+        :param user: the user recorded in the history of the appointments
+        :return: the appointments booked
+        :raises exceptions.BulkValidationError: with the errors of each appointment, in the same order
+        """
+        employee_ids = {apt.employee_id for apt in appointments} - {None}
+        with transaction.atomic():
+            if not ignore_availability:
+                Employee.objects.lock(*employee_ids)
+            errors = cls._bulk_clean(appointments)
+            if not ignore_availability:
+                cls._bulk_check_availability(appointments, errors)
+            if any(errors):
+                raise exceptions.BulkValidationError(errors)
+
+            for apt in appointments:
+                apt.allow_overlap = ignore_availability
+            try:
+                booked = bulk_create_with_history(appointments, cls, default_user=user)
+            except IntegrityError as e:
+                # another appointment was booked for the same time without taking the lock of the employee
+                if 'appointment_no_overlap' in str(e):
+                    raise ValidationError(r'No time available for the date selected')
+                raise e
+            Request.objects.update_aggregates(*{apt.request_id for apt in booked})
+
+        managers.appointments_bulk_changed.send(sender=cls, employee_ids=employee_ids)
+        return booked
+
+    @classmethod
+    def bulk_set_status(cls, appointments, status, user=None):
+        """
+        Changes the status of the appointments with a single update and records it in their history in bulk.
+        A change of status doesn't move an appointment, so only the ones rejected before take back their time
+        and are checked, the others are neither cleaned nor checked again.
+        :param appointments: appointments loaded with their employees and schedules
+        :param user: the user recorded in the history of the appointments
+        :raises ValidationError: when the time of a rejected appointment was taken in the meantime
+        """
+        changed = [apt for apt in appointments if apt.status != status]
+        if not changed:
+            return
+        reactivated = [apt for apt in changed if apt.status == cls.REJECTED and status != cls.REJECTED and
+                       apt.employee_id is not None and not apt.allow_overlap]
+
+        try:
+            with transaction.atomic():
+                if reactivated:
+                    Employee.objects.lock(*{apt.employee_id for apt in reactivated})
+                    errors = [{} for _ in reactivated]
+                    cls._bulk_check_availability(reactivated, errors)
+                    if any(errors):
+                        raise ValidationError(r'No time available for the date selected')
+                for apt in changed:
+                    apt.status = status
+                cls.objects.filter(id__in=[apt.id for apt in changed]).update(status=status)
+                cls.history.bulk_history_create(changed, update=True, default_user=user)
+        except IntegrityError as e:
+            # another appointment was booked for the same time without taking the lock of the employee
+            if 'appointment_no_overlap' in str(e):
+                raise ValidationError(r'No time available for the date selected')
+            raise e
+
+        managers.appointments_bulk_changed.send(sender=cls, employee_ids={apt.employee_id for apt in changed} - {None})
+
+    @staticmethod
+    def _bulk_clean(appointments):
+        """
+        Sets the employee, service and customer of every appointment from a single query each and cleans them
+        :return: a list with the errors of each appointment, an empty dict for the valid ones
+        """
+        employees = Employee.objects.for_booking().in_bulk({apt.employee_id for apt in appointments} - {None})
+        services = Service.objects.in_bulk({apt.service_id for apt in appointments} - {None})
+        customers = Customer.objects.in_bulk({apt.customer_id for apt in appointments} - {None})
+
+        errors = []
+        for apt in appointments:
+            try:
+                for name, loaded in (('employee', employees), ('service', services), ('customer', customers)):
+                    pk = getattr(apt, f'{name}_id')
+                    if pk is not None:
+                        if pk not in loaded:
+                            raise ValidationError(f'{name.capitalize()} not found')
+                        setattr(apt, name, loaded[pk])
+                if apt.employee_id is None:
+                    raise ValidationError('An employee has to be provided')
+                apt.clean()
+                errors.append({})
+            except ValidationError as e:
+                errors.append({NON_FIELD_ERRORS: e.messages})
+        return errors
 
-        SafeDeleteModel.save(self, **kwargs)
+    @staticmethod
+    def _bulk_check_availability(appointments, errors):
+        """
+        Checks the schedule of the employee and the appointments overlapping each valid appointment,
+        the appointments booked for the period of the batch are loaded with a single query
+        :param errors: the errors of each appointment, the errors found are added to it
+        """
+        valid = [apt for apt, error in zip(appointments, errors) if not error]
+        if not valid:
+            return
+
+        weeks = Schedule.objects.week_templates({apt.employee.schedule for apt in valid if apt.employee.schedule})
+        first, last = min(apt.start for apt in valid), max(apt.end for apt in valid)
+        employee_ids = {apt.employee_id for apt in valid}
+        booked = list(Appointment.objects.overlapping(first, last, employee_id__in=employee_ids)
+                      .values_list('employee_id', 'start', 'end'))
+        # the occurrences of the series being checked are the appointments themselves
+        series = AppointmentSeries.objects.filter(employee_id__in=employee_ids) \
+            .exclude(id__in={apt.series_id for apt in valid} - {None})
+        booked += [(apt.employee_id, apt.start, apt.end) for apt in series.occurrences(first, last)]
+
+        busy = {}
+        for employee_id, start, end in sorted(booked, key=lambda period: period[1]):
+            periods = busy.setdefault(employee_id, [])
+            if periods and periods[-1][1] >= start:
+                periods[-1] = (periods[-1][0], max(periods[-1][1], end))
+            else:
+                periods.append((start, end))
+
+        for apt, error in zip(appointments, errors):
+            if error:
+                continue
+            week = weeks.get(apt.employee.schedule_id)
+            periods = busy.setdefault(apt.employee_id, [])
+            if week is None or not frames_cover(week[apt.start.weekday()], apt.start, apt.end) or \
+                    overlaps_busy(periods, apt.start, apt.end):
+                error[NON_FIELD_ERRORS] = ['No time available for the date selected']
+            else:
+                # the following appointments of the batch can't overlap this one
+                bisect.insort(periods, (apt.start, apt.end))
 
     def delete(self, force_policy=None, **kwargs):
-        return SafeDeleteModel.delete(self, force_policy, ignore_availability=True)
+        request_id = self.request_id
+        deleted = SafeDeleteModel.delete(self, force_policy, ignore_availability=True)
+        # a soft deleted appointment is saved and already updated its request, a hard deleted one has no pk anymore
+        if self.pk is None:
+            Request.objects.update_aggregates(request_id)
+        return deleted
 
     def hard_delete(self):
         return self.delete(force_policy=HARD_DELETE)
@@ -290,6 +593,196 @@ class Appointment(SafeDeleteModel):
         return f"{self.start} {self.end} C: {self.customer} E: {self.employee}"
 
 
+class AppointmentSeries(models.Model):
+    """
+    Appointments repeated by a recurrence rule, e.g: a standing weekly appointment.
+    The occurrences aren't stored, they are expanded for the date range requested. An occurrence is only stored as an
+    appointment of the series once it is edited or cancelled, keyed by the start of the occurrence it replaces.
+    Changing the start or the rule of a series doesn't move the occurrences already stored.
+    """
+    FREQUENCIES = ('DAILY', 'WEEKLY', 'MONTHLY', 'YEARLY')
+
+    owner = models.ForeignKey('Company', on_delete=models.CASCADE)
+    employee = models.ForeignKey(Employee, on_delete=models.CASCADE, related_name='series')
+    customer = models.ForeignKey(Customer, on_delete=models.CASCADE, related_name='series', null=True, blank=True)
+    service = models.ForeignKey(Service, on_delete=models.CASCADE, null=True, blank=True)
+    # the start of the first occurrence
+    start = models.DateTimeField()
+    duration = models.DurationField()
+    # the RRULE of the series as in RFC 5545, e.g: FREQ=WEEKLY;BYDAY=TU;COUNT=10
+    rrule = models.CharField(max_length=255)
+    # the end of the last occurrence, null for series that never end
+    until = models.DateTimeField(null=True, blank=True, editable=False)
+    cost = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    status = models.CharField(max_length=1, choices=Appointment.STATUS_CHOICES, default=Appointment.PENDING)
+    internal_notes = models.TextField(max_length=255, null=True, blank=True)
+
+    objects = managers.AppointmentSeriesQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', 'start'], name='series_owner_start_idx'),
+            models.Index(fields=['employee', 'start'], name='series_employee_start_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # keeps the employee the series was loaded with, so a change of employee can be detected on save
+        instance.loaded_employee_id = instance.__dict__.get('employee_id')
+        return instance
+
+    @property
+    def rule_parts(self):
+        """Returns the parts of the rule as a dict, e.g: {'FREQ': 'WEEKLY', 'COUNT': '10'}"""
+        value = self.rrule.upper()
+        value = value[len('RRULE:'):] if value.startswith('RRULE:') else value
+        return dict(part.split('=', 1) for part in value.split(';') if '=' in part)
+
+    def get_rule(self):
+        """Returns the dateutil rrule of the series starting on the first occurrence"""
+        if '\n' in self.rrule or 'DTSTART' in self.rrule.upper():
+            raise ValidationError('Invalid recurrence rule')
+        try:
+            rule = rrule.rrulestr(self.rrule, dtstart=self.start)
+        except (ValueError, TypeError):
+            raise ValidationError('Invalid recurrence rule')
+        if self.rule_parts.get('FREQ') not in self.FREQUENCIES:
+            raise ValidationError('The recurrence rule must repeat daily, weekly, monthly or yearly')
+        return rule
+
+    def walk_rule(self, end):
+        """
+        Returns the rule of the series moved by whole cycles of the calendar so end falls in the last cycle dateutil can
+        represent, and the years it was moved. The rule moved has the same occurrences moved by those years, but a rule
+        with no occurrences after end is walked at most a cycle past it instead of up to the year 9999,
+        e.g: a rule on the 30th of february
+        """
+        rule = self.get_rule()
+        years = (MAXYEAR - max(end, self.start).year) // CALENDAR_CYCLE_YEARS * CALENDAR_CYCLE_YEARS
+        if years == 0:
+            return rule, 0
+        changes = {'dtstart': add_years(self.start, years)}
+        if rule._until is not None:
+            changes['until'] = add_years(rule._until, years) if rule._until.year + years <= MAXYEAR else datetime.max
+        return rule.replace(**changes), years
+
+    def occurrence_starts(self, start, end):
+        """Returns the starts of the occurrences that overlap the start / end date range"""
+        rule, years = self.walk_rule(end)
+        return [add_years(occurrence, -years)
+                for occurrence in rule.between(add_years(start - self.duration, years), add_years(end, years))]
+
+    def is_occurrence(self, start):
+        rule, years = self.walk_rule(start)
+        return add_years(start, years) in rule
+
+    def materialize(self, occurrence):
+        """Returns an unsaved appointment for the occurrence of the series starting on occurrence"""
+        return Appointment(owner_id=self.owner_id, employee=self.employee, customer=self.customer, service=self.service,
+                           start=occurrence, end=occurrence + self.duration, cost=self.cost, status=self.status,
+                           internal_notes=self.internal_notes, series=self, occurrence=occurrence)
+
+    def edit_occurrence(self, occurrence, ignore_availability=False, **changes):
+        """
+        Stores the occurrence of the series starting on occurrence as an appointment with the changes provided
+        :param changes: values of the appointment's fields, e.g: start, end, employee, status
+        """
+        appointment = self._occurrence_appointment(occurrence)
+        for attr, value in changes.items():
+            setattr(appointment, attr, value)
+        if 'end' not in changes:
+            appointment.end = appointment.start + self.duration
+        appointment.save(ignore_availability=ignore_availability)
+        return appointment
+
+    def cancel_occurrence(self, occurrence):
+        """Stores the occurrence of the series starting on occurrence as a deleted appointment"""
+        appointment = self._occurrence_appointment(occurrence)
+        appointment.delete()
+        return appointment
+
+    def _occurrence_appointment(self, occurrence):
+        if not self.is_occurrence(occurrence):
+            raise ValidationError('The series has no occurrence on the date provided')
+        if Appointment.objects.all_with_deleted().filter(series=self, occurrence=occurrence).exists():
+            raise ValidationError('The occurrence was already changed')
+        return self.materialize(occurrence)
+
+    def clean(self):
+        self.start = self.start.replace(second=0, microsecond=0)
+
+        if self.duration is None:
+            if self.service is None:
+                raise ValidationError('Either a service or a duration was not provided')
+            self.duration = self.service.duration
+
+        # the count and until date are the ones parsed by dateutil
+        rule = self.get_rule()
+        count, until = rule._count, rule._until
+        window_end = self.start + SERIES_MAX_LENGTH
+        if count is not None and count > SERIES_MAX_OCCURRENCES:
+            raise ValidationError(f'The recurrence rule can not repeat more than {SERIES_MAX_OCCURRENCES} times')
+        if until is not None and until > window_end:
+            raise ValidationError(f'The recurrence rule can not end more than {SERIES_MAX_LENGTH.days} days after its '
+                                  f'start')
+
+        # the rule must have its occurrences within its first days, a rule within both bounds can still repeat many
+        # times a day, e.g: with BYHOUR and BYMINUTE
+        if count is not None:
+            limit = count
+        elif until is not None:
+            limit = SERIES_MAX_OCCURRENCES + 1
+        else:
+            # a series that never ends only needs an occurrence
+            limit = 1
+        walk, years = self.walk_rule(window_end)
+        occurrences = [add_years(occurrence, -years) for occurrence in islice(walk, limit)]
+        occurrences = [occurrence for occurrence in occurrences if occurrence <= window_end]
+        if not occurrences:
+            raise ValidationError(f'The recurrence rule has no occurrences in the {SERIES_MAX_LENGTH.days} days after '
+                                  f'its start')
+        if len(occurrences) > SERIES_MAX_OCCURRENCES:
+            raise ValidationError(f'The recurrence rule can not repeat more than {SERIES_MAX_OCCURRENCES} times')
+        if count is not None and len(occurrences) < count:
+            raise ValidationError(f'The recurrence rule can not end more than {SERIES_MAX_LENGTH.days} days after its '
+                                  f'start')
+
+        # the end of a series with a count or an until date is kept so it can be filtered by date without expanding it
+        self.until = None if count is None and until is None else occurrences[-1] + self.duration
+
+        # the series follows the same rules of an appointment
+        first = self.materialize(self.start)
+        first.clean()
+        self.cost = first.cost
+
+    def save(self, ignore_availability=False, **kwargs):
+        self.clean()
+        with transaction.atomic():
+            if not ignore_availability:
+                Employee.objects.lock(self.employee_id)
+                self._check_availability()
+            models.Model.save(self, **kwargs)
+
+    def _check_availability(self):
+        """Checks the occurrences of the series within a year from now like a batch of appointments is checked"""
+        start = max(self.start, datetime.now())
+        stored = set() if self.id is None else set(
+            Appointment.objects.all_with_deleted().filter(series=self).values_list('occurrence', flat=True))
+        occurrences = [self.materialize(occurrence) for occurrence in
+                       self.occurrence_starts(start, start + SERIES_AVAILABILITY_HORIZON) if occurrence not in stored]
+        errors = [{} for _ in occurrences]
+        Appointment._bulk_check_availability(occurrences, errors)
+        conflicts = [apt.start for apt, error in zip(occurrences, errors) if error]
+        if conflicts:
+            dates = ', '.join(f'{conflict:%Y-%m-%d %H:%M}' for conflict in conflicts[:5])
+            raise ValidationError(f'No time available for the occurrences on {dates}' +
+                                  (' and others' if len(conflicts) > 5 else ''))
+
+    def __str__(self):
+        return f"{self.rrule} from {self.start} C: {self.customer} E: {self.employee}"
+
+
 class Request(CleanSaveMixin, models.Model):
     owner = models.ForeignKey('Company', on_delete=models.CASCADE)
     complete = models.BooleanField(default=False)
@@ -298,6 +791,13 @@ class Request(CleanSaveMixin, models.Model):
     user = models.ForeignKey('core.User', on_delete=models.CASCADE)
     customer_notes = models.TextField(max_length=255, null=True, blank=True)
     _status = models.CharField(max_length=1, choices=Appointment.STATUS_CHOICES, default=Appointment.PENDING)
+    # aggregates of the appointments of the request, kept up to date whenever one of them is saved or deleted
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=0, editable=False)
+    appointment_count = models.PositiveIntegerField(default=0, editable=False)
+    first_start = models.DateTimeField(null=True, blank=True, editable=False)
+    last_end = models.DateTimeField(null=True, blank=True, editable=False)
+
+    AGGREGATE_FIELDS = ('total', 'appointment_count', 'first_start', 'last_end')
 
     objects = managers.RequestManager()
 
@@ -307,11 +807,18 @@ class Request(CleanSaveMixin, models.Model):
 
     @status.setter
     def status(self, status):
-        for a in self.appointment_set.all():
-            a.status = status
-            a.save()
-        self._status = status
-        self.save()
+        self.set_status(status)
+
+    def set_status(self, status, user=None):
+        """
+        Changes the status of the request and of all its appointments in bulk,
+        the appointments don't change otherwise so the request isn't cleaned again
+        :param user: the user recorded in the history of the appointments
+        """
+        with transaction.atomic():
+            Appointment.bulk_set_status([*self.appointment_set.select_related('employee__schedule')], status, user)
+            self._status = status
+            models.Model.save(self, update_fields=['_status', 'last_updated'])
 
     def accept(self):
         self.status = Appointment.ACCEPTED
@@ -328,10 +835,6 @@ class Request(CleanSaveMixin, models.Model):
         message += f'{self.owner.config.appointment_rejected_message}'
         return message
 
-    @property
-    def total(self):
-        return sum(appointment.cost for appointment in self.appointment_set.all())
-
     @property
     def fee(self):
         return 1
@@ -352,26 +855,45 @@ class Request(CleanSaveMixin, models.Model):
 
         appointment = self.appointment_set.create(**kwargs)
         try:
-            self.save()
-            for apt in self.appointment_set.all():
-                if apt.service_id == appointment.service_id and apt.id != appointment.id:
+            # the appointments are loaded once for the validation of the request and to find the replaced ones
+            appointments = self.load_appointments()
+            self.clean_appointments(appointments)
+            kept = [apt for apt in appointments if apt.service_id != appointment.service_id or apt.id == appointment.id]
+            self.set_aggregates(kept)
+            models.Model.save(self)
+            for apt in appointments:
+                if apt not in kept:
                     apt.hard_delete()
             return appointment
         except ValidationError as e:
             appointment.hard_delete()
             raise e
 
+    def load_appointments(self):
+        return [*self.appointment_set.select_related('customer')]
+
+    def set_aggregates(self, appointments):
+        """Sets the aggregates from the appointments of the request already loaded"""
+        self.total = sum(apt.cost for apt in appointments)
+        self.appointment_count = len(appointments)
+        self.first_start = min((apt.start for apt in appointments), default=None)
+        self.last_end = max((apt.end for apt in appointments), default=None)
+
+    def refresh_aggregates(self):
+        """Reloads the aggregates after the appointments of the request changed elsewhere"""
+        self.refresh_from_db(fields=self.AGGREGATE_FIELDS)
+
     def clean(self):
         # if self.user.person_id is None:
         #     raise ValidationError(r'User must have a person')
+        self.clean_appointments(self.load_appointments())
 
-        appointments = [*self.appointment_set.all()]
-
+    def clean_appointments(self, appointments):
         if len(appointments) == 1:
             self.scheduled_date = appointments[0].start.date()
 
         for appointment in appointments:
-            if appointment.customer.user_id != self.user.id:
+            if appointment.customer.user_id != self.user_id:
                 raise exceptions.InvalidCustomer(r'Appointment customer is not the same as the user')
             if appointment.owner_id != self.owner_id:
                 raise exceptions.DifferentOwnerError('Appointment does not belong to the same owner as Request')
@@ -423,6 +945,8 @@ class Company(models.Model):
     objects = managers.CompanyManager()
 
     name = models.CharField(max_length=255, unique=True)
+    # the name used in the urls of the public pages, the names can't have underscores so the slug is unique too
+    slug = models.CharField(max_length=255, unique=True, editable=False)
     email = models.EmailField(null=True)
     address = models.CharField(max_length=255, null=True)
     instagram = models.CharField(max_length=255, null=True)
@@ -437,6 +961,9 @@ class Company(models.Model):
     it's defined as a flag rather than a property to be filtered via SQL
     """
     _is_viewable = models.BooleanField(default=False)
+    # the time in nanoseconds of the last change to the data shown in the public pages of the company,
+    # it's bumped by customers.signals with CompanyManager.bump_public_version
+    public_version = models.BigIntegerField(default=0, editable=False)
 
     @property
     def employees(self):
@@ -446,9 +973,16 @@ class Company(models.Model):
     def services(self):
         return self.service_set.filter(private=False)
 
-    @property
-    def slug(self):
-        return self.name.replace(' ', '_')
+    @staticmethod
+    def slugify(name):
+        return name.replace(' ', '_')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # keeps the slug the company was loaded with, so the cached id of a previous slug can be invalidated
+        instance.loaded_slug = instance.__dict__.get('slug')
+        return instance
 
     def update_is_viewable(self):
         """
@@ -461,6 +995,7 @@ class Company(models.Model):
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         if self.name.count('_') > 0:
             raise ValidationError({"name": "name should not contain spaces"})
+        self.slug = self.slugify(self.name)
 
         if self.id is None:
             models.Model.save(self, force_insert, force_update, using, update_fields)
@@ -1,7 +1,18 @@
+import datetime
+
 from rest_framework import serializers
-from scheduling import models
+from scheduling import models, exceptions
 from core.models import User
 
+MAX_BULK_APPOINTMENTS = 500
+# the longest range the appointments are listed for, the occurrences of the series in the range are expanded
+MAX_RANGE_DAYS = 366
+
+
+def can_ignore_availability(user, requested):
+    """Only the users allowed to overlap appointments can book them ignoring the availability"""
+    return all([requested, user is not None, user.has_perm('scheduling.overlap_appointment')])
+
 
 class ConfigSerializer(serializers.ModelSerializer):
     class Meta:
@@ -47,6 +58,8 @@ class ServiceSerializer(serializers.ModelSerializer):
         model = models.Service
         fields = ('id', 'owner', 'private', 'name', 'duration', 'color'
                   , 'description', 'cost', 'is_from', 'price', 'category')
+        # the columns read by the properties, for kalendario.common.compiled
+        compiled_properties = {'price': ('cost', 'is_from')}
 
 
 class EmployeeSerializer(serializers.ModelSerializer):
@@ -141,7 +154,43 @@ class AppointmentReadSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Appointment
         fields = ('id', 'owner', 'start', 'end', 'employee', 'lock_employee', 'service',
-                  'customer', 'status', 'internal_notes', 'request', 'deleted')
+                  'customer', 'status', 'internal_notes', 'request', 'deleted', 'series', 'occurrence')
+
+
+class CompactAppointmentsSerializer(serializers.BaseSerializer):
+    """
+    Renders a list of appointments as an array per field, the employees, customers and services are rendered
+    once each in their own lists and referenced from the appointments by id.
+    e.g: {'appointments': {'id': [1, 2], 'employee': [3, 3], ...}, 'employees': [{'id': 3, ...}], ...}
+    """
+    datetime_field = serializers.DateTimeField()
+    COLUMNS = (('id', 'id', None), ('start', 'start', datetime_field), ('end', 'end', datetime_field),
+               ('employee', 'employee_id', None), ('customer', 'customer_id', None),
+               ('service', 'service_id', None), ('status', 'status', None), ('lock_employee', 'lock_employee', None),
+               ('internal_notes', 'internal_notes', None), ('request', 'request_id', None),
+               ('deleted', 'deleted', datetime_field), ('series', 'series_id', None),
+               ('occurrence', 'occurrence', datetime_field))
+    RELATED = (('employees', 'employee', EmployeeSerializer), ('customers', 'customer', CustomerSerializer),
+               ('services', 'service', ServiceSerializer))
+
+    def to_representation(self, appointments):
+        appointments = list(appointments)
+        columns = {}
+        for name, attr, field in self.COLUMNS:
+            values = [getattr(apt, attr) for apt in appointments]
+            if field is not None:
+                values = [None if value is None else field.to_representation(value) for value in values]
+            columns[name] = values
+
+        data = {'appointments': columns}
+        for name, attr, serializer_class in self.RELATED:
+            related = {}
+            for apt in appointments:
+                pk = getattr(apt, f'{attr}_id')
+                if pk is not None and pk not in related:
+                    related[pk] = getattr(apt, attr)
+            data[name] = serializer_class(related.values(), many=True).data
+        return data
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -190,11 +239,7 @@ class BaseAppointmentWriteSerializer(serializers.ModelSerializer):
         return instance
 
     def _ignore_availability(self, validated_data):
-        user = self.context.get('user')
-        ignore_availability = all([validated_data.pop('ignore_availability', False),
-                                   user is not None,
-                                   user.has_perm('scheduling.overlap_appointment')])
-        return ignore_availability
+        return can_ignore_availability(self.context.get('user'), validated_data.pop('ignore_availability', False))
 
 
 class AppointmentWriteSerializer(BaseAppointmentWriteSerializer):
@@ -208,13 +253,97 @@ class SelfAppointmentWriteSerializer(BaseAppointmentWriteSerializer):
         pass
 
 
+class BulkAppointmentItemSerializer(serializers.Serializer):
+    """
+    An appointment of a bulk creation, the relations are plain ids
+    so they are loaded and validated for the whole batch by Appointment.bulk_book
+    """
+    start = serializers.DateTimeField()
+    end = serializers.DateTimeField(required=False, allow_null=True)
+    employee = serializers.IntegerField()
+    service = serializers.IntegerField(required=False, allow_null=True)
+    customer = serializers.IntegerField(required=False, allow_null=True)
+    status = serializers.ChoiceField(choices=models.Appointment.STATUS_CHOICES, default=models.Appointment.PENDING)
+    internal_notes = serializers.CharField(max_length=255, required=False, allow_null=True, allow_blank=True)
+
+
+class AppointmentBulkWriteSerializer(serializers.Serializer):
+    appointments = BulkAppointmentItemSerializer(many=True, allow_empty=False)
+    ignore_availability = serializers.BooleanField(required=False, default=False)
+
+    def validate_appointments(self, value):
+        if len(value) > MAX_BULK_APPOINTMENTS:
+            raise serializers.ValidationError(f'At most {MAX_BULK_APPOINTMENTS} appointments can be created at once')
+        return value
+
+    def create(self, validated_data):
+        user = self.context.get('user')
+        appointments = [models.Appointment(owner_id=validated_data['owner'], employee_id=item['employee'],
+                                           service_id=item.get('service'), customer_id=item.get('customer'),
+                                           start=item['start'], end=item.get('end'), status=item['status'],
+                                           internal_notes=item.get('internal_notes'))
+                        for item in validated_data['appointments']]
+        try:
+            return models.Appointment.bulk_book(
+                appointments, can_ignore_availability(user, validated_data['ignore_availability']), user=user)
+        except exceptions.BulkValidationError as e:
+            raise serializers.ValidationError({'appointments': e.errors})
+
+
+class AppointmentSeriesSerializer(serializers.ModelSerializer):
+    ignore_availability = serializers.BooleanField(required=False, write_only=True)
+    # defaults to the duration of the service
+    duration = serializers.DurationField(required=False)
+
+    class Meta:
+        model = models.AppointmentSeries
+        fields = ('id', 'owner', 'employee', 'customer', 'service', 'start', 'duration', 'rrule', 'until', 'cost',
+                  'status', 'internal_notes', 'ignore_availability')
+
+    def create(self, validated_data):
+        ignore_availability = self._ignore_availability(validated_data)
+        instance = models.AppointmentSeries(**validated_data)
+        instance.save(ignore_availability=ignore_availability)
+        return instance
+
+    def update(self, instance, validated_data):
+        ignore_availability = self._ignore_availability(validated_data)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(ignore_availability=ignore_availability)
+        return instance
+
+    def _ignore_availability(self, validated_data):
+        return can_ignore_availability(self.context.get('user'), validated_data.pop('ignore_availability', False))
+
+
+class SeriesOccurrenceSerializer(serializers.Serializer):
+    """An occurrence of a series, identified by its original start, and the changes made to it"""
+    occurrence = serializers.DateTimeField()
+    start = serializers.DateTimeField(required=False)
+    end = serializers.DateTimeField(required=False)
+    employee = serializers.PrimaryKeyRelatedField(queryset=models.Employee.objects.all(), required=False)
+    status = serializers.ChoiceField(choices=models.Appointment.STATUS_CHOICES, required=False)
+    internal_notes = serializers.CharField(max_length=255, required=False, allow_null=True, allow_blank=True)
+    ignore_availability = serializers.BooleanField(required=False, default=False)
+
+    def edit(self, series):
+        changes = dict(self.validated_data)
+        occurrence = changes.pop('occurrence')
+        ignore_availability = can_ignore_availability(self.context.get('user'), changes.pop('ignore_availability'))
+        return series.edit_occurrence(occurrence, ignore_availability, **changes)
+
+
 class RequestSerializer(serializers.ModelSerializer):
     appointments = AppointmentReadSerializer(many=True, read_only=True, source='appointment_set')
     user = UserSerializer()
+    # rendered as a number as it was when the total was computed by a property
+    total = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True, coerce_to_string=False)
 
     class Meta:
         model = models.Request
-        fields = ('id', 'owner', 'appointments', 'complete', 'user', 'status')
+        fields = ('id', 'owner', 'appointments', 'complete', 'user', 'status', 'total', 'appointment_count',
+                  'first_start', 'last_end')
 
 
 class AppointmentQuerySerlializer(serializers.Serializer):
@@ -227,6 +356,14 @@ class AppointmentQuerySerlializer(serializers.Serializer):
     services = serializers.ListField(required=False)
     show_all = serializers.BooleanField(required=False)
     deleted_only = serializers.BooleanField(required=False)
+    compact = serializers.BooleanField(required=False)
+
+    def validate(self, attrs):
+        from_date, to_date = attrs.get('from_date'), attrs.get('to_date')
+        if from_date is not None and to_date is not None and \
+                to_date - from_date > datetime.timedelta(days=MAX_RANGE_DAYS):
+            raise serializers.ValidationError(f'The date range can not be longer than {MAX_RANGE_DAYS} days')
+        return attrs
 
     def create(self, validated_data):
         pass
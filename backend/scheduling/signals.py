@@ -1,6 +1,6 @@
 from scheduling import models as m
 from django.core.exceptions import ValidationError
-from django.db.models.signals import m2m_changed
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
 
 
 def emp_service_mm_changed(instance, model, action, pk_set, **kwargs):
@@ -21,3 +21,27 @@ def emp_service_mm_changed(instance, model, action, pk_set, **kwargs):
 
 
 m2m_changed.connect(emp_service_mm_changed, sender=m.Employee.services.through)
+
+
+def schedule_changed(sender, instance, **kwargs):
+    """Any change to the schedule can change the shifts of the week, so its compiled week template is dropped"""
+    m.Schedule.objects.invalidate_week_templates([instance.id])
+
+
+def shift_changed(sender, instance, **kwargs):
+    """Drops the compiled week template of every schedule that uses the shift"""
+    schedules = m.Schedule.objects.using_shift(instance.id).values_list('id', flat=True)
+    m.Schedule.objects.invalidate_week_templates(schedules)
+
+
+def time_frame_changed(sender, instance, **kwargs):
+    """Drops the compiled week template of every schedule that uses the shift of the time frame"""
+    schedules = m.Schedule.objects.using_shift(instance.shift_id).values_list('id', flat=True)
+    m.Schedule.objects.invalidate_week_templates(schedules)
+
+
+post_save.connect(schedule_changed, sender=m.Schedule)
+post_delete.connect(schedule_changed, sender=m.Schedule)
+pre_delete.connect(shift_changed, sender=m.Shift)
+post_save.connect(time_frame_changed, sender=m.TimeFrame)
+post_delete.connect(time_frame_changed, sender=m.TimeFrame)
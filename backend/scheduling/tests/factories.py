@@ -26,3 +26,31 @@ class ServiceFactory(DjangoModelFactory):
 
     name = factory.Faker('name')
     duration = factory.Faker('time_delta')
+
+
+class CustomerFactory(DjangoModelFactory):
+    class Meta:
+        model = models.Customer
+
+    first_name = factory.Faker('first_name')
+    last_name = factory.Faker('last_name')
+    email = factory.Faker('email')
+
+
+class ShiftFactory(DjangoModelFactory):
+    class Meta:
+        model = models.Shift
+
+
+class TimeFrameFactory(DjangoModelFactory):
+    class Meta:
+        model = models.TimeFrame
+
+    shift = factory.SubFactory(ShiftFactory)
+
+
+class ScheduleFactory(DjangoModelFactory):
+    class Meta:
+        model = models.Schedule
+
+    name = factory.Sequence(lambda n: f'schedule {n}')
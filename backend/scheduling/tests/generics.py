@@ -1,8 +1,17 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
 
+from scheduling.models import Company
+
 FIXTURES = ['companies.json', 'config.json', 'timeframes.json', 'shifts.json', 'schedules.json',
             'people.json', 'services.json', 'employees.json', 'customers.json',
             'users.json', 'requests.json', 'appointments.json']
@@ -32,6 +41,29 @@ class ViewTestCase(APITestCase, TestCaseWF):
         ensure_no_access(self, self.list_url, detail_url, status.HTTP_403_FORBIDDEN)
 
 
+def run_on_commit():
+    """the test cases are never committed, runs the callbacks registered with transaction.on_commit"""
+    callbacks, connection.run_on_commit = connection.run_on_commit, []
+    for sids, callback in callbacks:
+        callback()
+
+
+class BenchmarkTestMixin:
+    """runs the benchmark commands, which build their data in synthetic companies named benchmark"""
+
+    def run_benchmark(self, command, *args):
+        """Returns the results the command writes to its output, one per line"""
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.jsonl')
+            call_command(command, *args, '--output', output, stdout=StringIO())
+            with open(output) as f:
+                results = [json.loads(line) for line in f]
+
+        # the synthetic companies are rolled back or deleted
+        self.assertFalse(Company.objects.filter(name__startswith='benchmark').exists())
+        return results
+
+
 def ensure_no_access(test_case, list_url, detail_url, response_status):
     response = test_case.client.get(list_url, format='json')
     test_case.assertEqual(response.status_code, response_status)
@@ -1,9 +1,15 @@
-from datetime import timedelta, datetime
+import threading
+from datetime import timedelta, datetime, MAXYEAR
+from unittest import mock
 
 from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction, connection
+from django.test import TransactionTestCase
 
-from scheduling.models import Employee, Customer, Service, Appointment
-from scheduling.tests.generics import TestCaseWF
+from core.models import User
+from scheduling.exceptions import BulkValidationError
+from scheduling.models import Employee, Customer, Service, Appointment, AppointmentSeries
+from scheduling.tests.generics import TestCaseWF, FIXTURES
 from util.test_util import next_tuesday, book_appointment, next_monday, reject_appointment
 
 
@@ -248,6 +254,15 @@ class AppointmentTest(TestCaseWF):
 
         self.assertRaises(ValidationError, book_appointment, **data)
 
+    def test_end_before_start_without_employee(self):
+        """The employee is only looked up once the range is known to be valid"""
+        data = self.data()
+        del data['employee']
+        appointment = Appointment(**data, start=next_tuesday().replace(hour=10, minute=0),
+                                  end=next_tuesday().replace(hour=9, minute=0))
+
+        self.assertRaises(ValidationError, appointment.save)
+
     def test_appointment_with_service_and_employees_on_different_owner(self):
         """
         An error should be raised when creating an appointment where the service and the employee have different owners
@@ -329,4 +344,370 @@ class AppointmentTest(TestCaseWF):
         a2 = book_appointment(**data, ignore_availability=True)
         self.assertIsInstance(a2, Appointment)
         # the bellow should not throw an error
-        a2.delete()
\ No newline at end of file
+        a2.delete()
+
+
+class BookingQueryCountTest(TestCaseWF):
+    """
+    Booking an appointment loads the service, the customer, the employee with its schedule and services,
+    the schedule's week (not cached in tests), takes the lock of the employee and checks the conflicting appointments
+    and series once before inserting it and its history record inside a savepoint
+    """
+
+    def book(self, **kwargs):
+        data = {'start': next_tuesday().replace(hour=9, minute=0), 'service_id': 1, 'customer_id': 1001,
+                'owner_id': 1, **kwargs}
+        return Appointment.objects.create(**data)
+
+    def test_with_employee(self):
+        with self.assertNumQueries(11):
+            appointment = self.book(employee_id=1)
+        self.assertEqual(appointment.employee_id, 1)
+
+    def test_with_employee_instance(self):
+        employee = Employee.objects.get(pk=1)
+        with self.assertNumQueries(11):
+            self.book(employee=employee)
+
+    def test_without_employee(self):
+        # the available employees are found and loaded with a single query once the series are expanded, the lock of
+        # the employee found is taken and its appointments and series are checked again
+        with self.assertNumQueries(11):
+            appointment = self.book()
+        self.assertIn(appointment.employee_id, [1, 2])
+
+    def test_same_errors(self):
+        with self.assertRaisesMessage(ValidationError, "Employee doesn't provide this service"):
+            self.book(employee_id=1, service_id=3)
+        with self.assertRaisesMessage(ValidationError, 'No time available for the date selected'):
+            self.book(employee_id=1, start=next_tuesday().replace(hour=8, minute=0))
+        self.book(employee_id=1)
+        with self.assertRaisesMessage(ValidationError, 'No time available for the date selected'):
+            self.book(employee_id=1)
+
+    def test_services_loaded_with_employee(self):
+        employee = Employee.objects.for_booking().get(pk=1)
+        self.assertEqual(sorted(employee.service_ids), [1, 2])
+        with self.assertNumQueries(0):
+            self.assertTrue(employee.provides_service(Service(pk=2)))
+            self.assertFalse(employee.provides_service(Service(pk=3)))
+        self.assertEqual(Employee.objects.for_booking().get(pk=5).service_ids, [4])
+
+
+class AppointmentOverlapConstraintTest(TestCaseWF):
+
+    def setUp(self):
+        self.employee = Employee.objects.get(pk=1)
+        self.customer = Customer.objects.get(pk=1001)
+        self.service = Service.objects.get(pk=1)
+        self.nine = next_tuesday().replace(hour=9, minute=0, second=0, microsecond=0)
+
+    def appointment(self, start, employee=None, **kwargs):
+        return Appointment(owner_id=1, employee=employee or self.employee, customer=self.customer,
+                           service=self.service, start=start, end=start + self.service.duration, **kwargs)
+
+    def test_database_rejects_overlaps(self):
+        Appointment.objects.bulk_create([self.appointment(self.nine)])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Appointment.objects.bulk_create([self.appointment(self.nine + timedelta(minutes=15))])
+        # touching appointments, other employees, rejected and allowed overlaps are fine
+        Appointment.objects.bulk_create([
+            self.appointment(self.nine + timedelta(minutes=30)),
+            self.appointment(self.nine, Employee.objects.get(pk=2)),
+            self.appointment(self.nine, status=Appointment.REJECTED),
+            self.appointment(self.nine, allow_overlap=True),
+        ])
+
+    def test_concurrent_booking(self):
+        """An appointment booked after the availability was checked makes the save fail with the same error"""
+        appointment = self.appointment(self.nine)
+        with mock.patch.object(Employee, 'is_available', return_value=True):
+            Appointment.objects.bulk_create([self.appointment(self.nine)])
+            with self.assertRaisesMessage(ValidationError, 'No time available for the date selected'):
+                appointment.save()
+        self.assertEqual(Appointment.objects.overlapping(self.nine, self.nine + timedelta(minutes=30)).count(), 1)
+
+    def test_ignore_availability(self):
+        book_appointment(self.employee, self.customer, self.nine, self.service)
+        appointment = book_appointment(self.employee, self.customer, self.nine, self.service, ignore_availability=True)
+        self.assertTrue(appointment.allow_overlap)
+        self.assertEqual(Appointment.objects.overlapping(self.nine, self.nine + timedelta(minutes=1)).count(), 2)
+
+    def test_overlapping(self):
+        book_appointment(self.employee, self.customer, self.nine, self.service)
+        cases = [((8, 30), (9, 0), 0), ((8, 30), (9, 1), 1), ((9, 10), (9, 20), 1), ((8, 0), (10, 0), 1),
+                 ((9, 29), (9, 45), 1), ((9, 30), (10, 0), 0)]
+        for start, end, expected in cases:
+            overlapping = Appointment.objects.overlapping(self.nine.replace(hour=start[0], minute=start[1]),
+                                                          self.nine.replace(hour=end[0], minute=end[1]),
+                                                          employee=self.employee)
+            self.assertEqual(overlapping.count(), expected, (start, end))
+
+
+class EmployeeLockTest(TransactionTestCase):
+    """Bookings run in threads, each with its own database connection, so they can wait for each other"""
+    fixtures = FIXTURES
+
+    def setUp(self):
+        self.nine = next_tuesday().replace(hour=9, minute=0, second=0, microsecond=0)
+
+    def book_in_thread(self, outcomes):
+        def book():
+            try:
+                book_appointment(Employee.objects.get(pk=1), Customer.objects.get(pk=1001), self.nine,
+                                 Service.objects.get(pk=1))
+                outcomes.append('booked')
+            except ValidationError as e:
+                outcomes.append(e.message)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=book)
+        thread.start()
+        return thread
+
+    def test_booking_waits_for_the_lock(self):
+        outcomes = []
+        with transaction.atomic():
+            Employee.objects.lock(1)
+            thread = self.book_in_thread(outcomes)
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+        thread.join()
+        self.assertEqual(outcomes, ['booked'])
+
+    def test_concurrent_bookings_of_the_same_time(self):
+        outcomes = []
+        threads = [self.book_in_thread(outcomes) for _ in range(4)]
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(outcomes), ['No time available for the date selected'] * 3 + ['booked'])
+
+
+    def test_found_employee_rechecked_under_the_lock(self):
+        """A series isn't covered by the exclusion constraint, the employee found for a booking is checked again"""
+        # employee 2 is busy so employee 1 is the only one available for the service
+        book_appointment(Employee.objects.get(pk=2), Customer.objects.get(pk=1001), self.nine,
+                         Service.objects.get(pk=1), ignore_availability=True)
+        outcomes = []
+
+        def book():
+            try:
+                Appointment.objects.create(owner_id=1, service_id=1, customer_id=1001, start=self.nine)
+                outcomes.append('booked')
+            except ValidationError as e:
+                outcomes.append(e.message)
+            finally:
+                connection.close()
+
+        with transaction.atomic():
+            Employee.objects.lock(1)
+            thread = threading.Thread(target=book)
+            thread.start()
+            thread.join(0.5)
+            self.assertTrue(thread.is_alive())
+            AppointmentSeries(owner_id=1, employee_id=1, customer_id=1001, service_id=1, start=self.nine,
+                              rrule='FREQ=WEEKLY;COUNT=2').save()
+        thread.join()
+        self.assertEqual(outcomes, ['No time available for the date selected'])
+
+class BulkBookTest(TestCaseWF):
+
+    def setUp(self):
+        self.nine = next_tuesday().replace(hour=9, minute=0, second=0, microsecond=0)
+
+    def appointment(self, start, employee_id=1, **kwargs):
+        data = {'owner_id': 1, 'employee_id': employee_id, 'service_id': 1, 'customer_id': 1001, **kwargs}
+        return Appointment(start=start, **data)
+
+    def batch(self, size, employee_id=1):
+        """size appointments of 30 minutes one after the other from 9am"""
+        return [self.appointment(self.nine + timedelta(minutes=30 * i), employee_id) for i in range(size)]
+
+    def errors(self, appointments, **kwargs):
+        with self.assertRaises(BulkValidationError) as context:
+            Appointment.bulk_book(appointments, **kwargs)
+        return [error.get('nonFieldErrors') for error in context.exception.errors]
+
+    def test_books_batch_with_history(self):
+        user = User.objects.get(pk=1)
+        booked = Appointment.bulk_book(self.batch(3) + self.batch(2, employee_id=2), user=user)
+        self.assertEqual(len(booked), 5)
+        self.assertTrue(all(apt.id for apt in booked))
+        self.assertEqual(booked[0].end, self.nine + timedelta(minutes=30))
+        self.assertEqual(booked[0].cost, Service.objects.get(pk=1).cost)
+        history = Appointment.history.filter(id__in=[apt.id for apt in booked])
+        self.assertEqual(history.count(), 5)
+        self.assertEqual({h.history_user_id for h in history}, {user.id})
+
+    def test_constant_queries(self):
+        """
+        The lock, the employees, services, customers, the week templates (not cached in tests), the booked appointments,
+        the series and the inserts of the appointments and their history inside a savepoint, whatever the size of the
+        batch
+        """
+        Appointment.bulk_book(self.batch(1))
+        with self.assertNumQueries(11):
+            Appointment.bulk_book([self.appointment(self.nine + timedelta(hours=1))])
+        with self.assertNumQueries(11):
+            Appointment.bulk_book(self.batch(8, employee_id=2))
+
+    def test_conflicts_within_batch(self):
+        appointments = self.batch(2) + [self.appointment(self.nine + timedelta(minutes=15))]
+        self.assertEqual(self.errors(appointments), [None, None, ['No time available for the date selected']])
+        self.assertFalse(Appointment.objects.filter(start__gte=self.nine).exists())
+
+    def test_conflicts_with_booked(self):
+        book_appointment(Employee.objects.get(pk=1), Customer.objects.get(pk=1001), self.nine + timedelta(minutes=30),
+                         Service.objects.get(pk=1))
+        self.assertEqual(self.errors(self.batch(3)), [None, ['No time available for the date selected'], None])
+
+    def test_outside_schedule(self):
+        appointments = [self.appointment(self.nine.replace(hour=8))]
+        self.assertEqual(self.errors(appointments), [['No time available for the date selected']])
+
+    def test_errors_of_each_appointment(self):
+        appointments = [self.appointment(self.nine), self.appointment(self.nine, employee_id=999),
+                        self.appointment(self.nine, service_id=3), self.appointment(self.nine, customer_id=None),
+                        self.appointment(self.nine, employee_id=None)]
+        self.assertEqual(self.errors(appointments), [None, ['Employee not found'],
+                                                     ["Employee doesn't provide this service"],
+                                                     ['Missing customer parameters'],
+                                                     ['An employee has to be provided']])
+
+    def test_ignore_availability(self):
+        Appointment.bulk_book(self.batch(2))
+        booked = Appointment.bulk_book(self.batch(2), ignore_availability=True)
+        self.assertTrue(all(apt.allow_overlap for apt in booked))
+        self.assertEqual(Appointment.objects.overlapping(self.nine, self.nine + timedelta(hours=1)).count(), 4)
+
+
+class AppointmentSeriesTest(TestCaseWF):
+
+    def setUp(self):
+        self.nine = next_tuesday().replace(hour=9, minute=0, second=0, microsecond=0)
+        self.employee = Employee.objects.get(pk=1)
+
+    def series(self, rule='FREQ=WEEKLY;COUNT=4', **kwargs):
+        data = {'owner_id': 1, 'employee': self.employee, 'customer_id': 1001, 'service_id': 1, 'start': self.nine,
+                **kwargs}
+        series = AppointmentSeries(rrule=rule, **data)
+        series.save()
+        return series
+
+    def test_occurrences_are_expanded(self):
+        series = self.series()
+        self.assertEqual(series.duration, Service.objects.get(pk=1).duration)
+        self.assertEqual(series.until, self.nine + timedelta(weeks=3, minutes=30))
+        self.assertEqual(series.cost, Service.objects.get(pk=1).cost)
+        occurrences = AppointmentSeries.objects.occurrences(self.nine, self.nine + timedelta(weeks=8))
+        self.assertEqual([o.start for o in occurrences], [self.nine + timedelta(weeks=i) for i in range(4)])
+        self.assertTrue(all(o.id is None and o.series_id == series.id for o in occurrences))
+        self.assertEqual(occurrences[0].end, self.nine + timedelta(minutes=30))
+        self.assertFalse(Appointment.objects.filter(series=series).exists())
+
+    def test_occurrence_overlapping_range_start(self):
+        self.series()
+        occurrences = AppointmentSeries.objects.occurrences(self.nine + timedelta(minutes=15),
+                                                            self.nine + timedelta(days=1))
+        self.assertEqual([o.start for o in occurrences], [self.nine])
+
+    def test_materialized_occurrences_not_expanded(self):
+        series = self.series()
+        series.cancel_occurrence(self.nine)
+        series.edit_occurrence(self.nine + timedelta(weeks=1), start=self.nine + timedelta(weeks=1, hours=1))
+        occurrences = AppointmentSeries.objects.occurrences(self.nine, self.nine + timedelta(weeks=8))
+        self.assertEqual([o.start for o in occurrences], [self.nine + timedelta(weeks=i) for i in (2, 3)])
+        edited = Appointment.objects.get(series=series)
+        self.assertEqual(edited.start, self.nine + timedelta(weeks=1, hours=1))
+        self.assertEqual(edited.end, self.nine + timedelta(weeks=1, hours=1, minutes=30))
+        self.assertTrue(Appointment.objects.all_with_deleted().get(series=series, occurrence=self.nine).deleted)
+
+    def test_occurrence_changed_once(self):
+        series = self.series()
+        series.cancel_occurrence(self.nine)
+        self.assertRaises(ValidationError, series.cancel_occurrence, self.nine)
+        self.assertRaises(ValidationError, series.edit_occurrence, self.nine, status=Appointment.ACCEPTED)
+        self.assertRaises(ValidationError, series.cancel_occurrence, self.nine + timedelta(days=1))
+
+    def test_invalid_rules(self):
+        self.assertRaises(ValidationError, self.series, 'FREQ=SOMETIMES')
+        self.assertRaises(ValidationError, self.series, 'FREQ=HOURLY;COUNT=3')
+        self.assertRaises(ValidationError, self.series, 'DTSTART:20200101T000000\nRRULE:FREQ=DAILY')
+        self.assertFalse(AppointmentSeries.objects.exists())
+
+    def test_rules_over_bounds(self):
+        for rule in ('FREQ=DAILY;UNTIL=99991231T000000', 'FREQ=DAILY;COUNT=2001',
+                     'FREQ=DAILY;BYHOUR=9,10,11,12;BYMINUTE=0,15,30,45;COUNT=100000',
+                     'FREQ=DAILY;BYHOUR=9,10,11,12;BYMINUTE=0,15,30,45;UNTIL={:%Y%m%d}'.format(
+                         self.nine + timedelta(days=365))):
+            self.assertRaises(ValidationError, self.series, rule)
+        self.assertFalse(AppointmentSeries.objects.exists())
+
+        series = self.series('FREQ=WEEKLY;UNTIL={:%Y%m%dT%H%M%S}'.format(self.nine + timedelta(weeks=2)))
+        self.assertEqual(series.until, self.nine + timedelta(weeks=2, minutes=30))
+
+    def test_rules_without_occurrences(self):
+        """The rules are only walked over their first days, the 30th of february never comes"""
+        for rule in ('FREQ=DAILY;BYMONTH=2;BYMONTHDAY=30', 'FREQ=DAILY;BYMONTH=2;BYMONTHDAY=30;COUNT=3',
+                     'FREQ=YEARLY;BYMONTH=2;BYMONTHDAY=29;COUNT=3;BYYEARDAY=1'):
+            self.assertRaises(ValidationError, self.series, rule)
+        # the third occurrence is more than 5 years after the start
+        self.assertRaises(ValidationError, self.series, 'FREQ=YEARLY;COUNT=7')
+        self.assertFalse(AppointmentSeries.objects.exists())
+
+    def test_rules_walked_up_to_a_cycle_past_the_range(self):
+        series = self.series('FREQ=WEEKLY')
+        end = self.nine + timedelta(weeks=8)
+        rule, years = series.walk_rule(end)
+        self.assertGreater(end.year + years, MAXYEAR - 400)
+        self.assertEqual(series.occurrence_starts(self.nine, end), [self.nine + timedelta(weeks=i) for i in range(8)])
+        self.assertTrue(series.is_occurrence(self.nine + timedelta(weeks=3)))
+
+        # a rule stored before it was validated
+        AppointmentSeries.objects.filter(pk=series.pk).update(rrule='FREQ=DAILY;BYMONTH=2;BYMONTHDAY=30')
+        series.refresh_from_db()
+        self.assertEqual(AppointmentSeries.objects.occurrences(self.nine, end), [])
+        self.assertFalse(series.is_occurrence(self.nine + timedelta(weeks=1)))
+
+    def test_repeated_within_the_day(self):
+        data = {'owner_id': 1, 'employee': self.employee, 'customer_id': 1001, 'service_id': 1, 'start': self.nine}
+        series = AppointmentSeries(rrule='FREQ=WEEKLY;BYHOUR=9,10,11,12;BYMINUTE=0,30;COUNT=2000', **data)
+        series.clean()
+        self.assertEqual(series.until, series.get_rule()[1999] + series.duration)
+        series = AppointmentSeries(rrule='FREQ=DAILY;BYHOUR=9,10,11,12;BYMINUTE=0,30', **data)
+        series.clean()
+        self.assertIsNone(series.until)
+
+    def test_unbounded_series(self):
+        series = self.series('FREQ=WEEKLY')
+        self.assertIsNone(series.until)
+        occurrences = AppointmentSeries.objects.occurrences(self.nine + timedelta(weeks=100),
+                                                            self.nine + timedelta(weeks=101))
+        self.assertEqual([o.start for o in occurrences], [self.nine + timedelta(weeks=100)])
+
+    def test_occurrence_conflicts_with_appointment(self):
+        book_appointment(self.employee, Customer.objects.get(pk=1001), self.nine + timedelta(weeks=2),
+                         Service.objects.get(pk=1))
+        with self.assertRaises(ValidationError):
+            self.series()
+        self.assertFalse(AppointmentSeries.objects.exists())
+
+    def test_booking_blocked_by_occurrence(self):
+        self.series()
+        with self.assertRaises(ValidationError):
+            book_appointment(self.employee, Customer.objects.get(pk=1001), self.nine + timedelta(weeks=1),
+                             Service.objects.get(pk=1))
+        book_appointment(self.employee, Customer.objects.get(pk=1001), self.nine + timedelta(weeks=4),
+                         Service.objects.get(pk=1))
+
+    def test_series_conflicts_with_series(self):
+        self.series()
+        self.assertRaises(ValidationError, self.series, 'FREQ=DAILY;COUNT=2', start=self.nine + timedelta(weeks=3))
+        self.series('FREQ=DAILY;COUNT=2', start=self.nine + timedelta(weeks=3, minutes=30))
+
+    def test_cancelled_occurrence_frees_time(self):
+        series = self.series()
+        series.cancel_occurrence(self.nine + timedelta(weeks=1))
+        book_appointment(self.employee, Customer.objects.get(pk=1001), self.nine + timedelta(weeks=1),
+                         Service.objects.get(pk=1))
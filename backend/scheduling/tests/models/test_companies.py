@@ -29,6 +29,15 @@ class CompanyTest(TestCase):
         self.assertRaises(ValidationError, factories.CompanyFactory.create, name='_starts with underscore')
         self.assertRaises(ValidationError, factories.CompanyFactory.create, name='ends with underscore_')
 
+    def test_slug(self):
+        """the slug is stored so the companies can be looked up by it"""
+        company = factories.CompanyFactory.create(name='company with spaces')
+        self.assertEqual(company.slug, 'company_with_spaces')
+        company.name = 'renamed company'
+        company.save()
+        company.refresh_from_db()
+        self.assertEqual(company.slug, 'renamed_company')
+
     def test_update_company_name_existing_name(self):
         """if the name of an already existing company is updated to a used name the company should fail on save"""
         name1 = 'company-1'
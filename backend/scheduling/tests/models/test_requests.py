@@ -1,4 +1,8 @@
+from datetime import timedelta
 from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
 
 from scheduling import exceptions
 from scheduling.models import Request, Appointment
@@ -155,6 +159,36 @@ class RequestTest(TestCaseWF):
         request.accept()
         self.assert_request_status(request, Appointment.ACCEPTED)
 
+    def request_with_appointments(self, hours=(9, 11)):
+        request = get_current()
+        params = {'customer_id': 2001, 'employee_id': 1, 'owner_id': 1}
+        for service_id, hour in enumerate(hours, start=1):
+            request.add_appointment(start=next_tuesday().replace(hour=hour, minute=0), service_id=service_id, **params)
+        return request
+
+    def test_accept_in_bulk(self):
+        """
+        The appointments with their employees, the update of the appointments and their history inside a savepoint
+        and the update of the request, all inside a savepoint, whatever the amount of appointments
+        """
+        request = self.request_with_appointments()
+        with self.assertNumQueries(8):
+            request.accept()
+        self.assert_request_status(request, Appointment.ACCEPTED)
+        history = Appointment.history.filter(request=request, history_type='~')
+        self.assertEqual(sorted(h.status for h in history), [Appointment.ACCEPTED] * 2)
+
+    def test_accept_rejected_taken_time(self):
+        request = self.request_with_appointments()
+        request.status = Appointment.REJECTED
+        self.assert_request_status(request, Appointment.REJECTED)
+        # the time of the rejected appointment at 11 is taken by another appointment
+        Appointment.objects.create(owner_id=1, employee_id=1, customer_id=2001, service_id=2,
+                                   start=next_tuesday().replace(hour=11, minute=0, second=0, microsecond=0))
+        self.assertRaises(exceptions.ValidationError, request.accept)
+        request.refresh_from_db()
+        self.assert_request_status(request, Appointment.REJECTED)
+
     def test_costs(self):
         params = {'start': next_tuesday().replace(hour=9, minute=0),
                   'service_id': 1,
@@ -169,6 +203,35 @@ class RequestTest(TestCaseWF):
         self.assertEqual(request.total, Decimal(23 + 15))  # service 1 + service 2 cost from fixtures
         self.assertEqual(request.fee, 1)  # service 1 + service 2 cost from fixtures
 
+    def assert_aggregates(self, request, total, count, first_start, last_end):
+        request = Request.objects.get(pk=request.id)
+        self.assertEqual((request.total, request.appointment_count, request.first_start, request.last_end),
+                         (total, count, first_start, last_end))
+
+    def test_aggregates(self):
+        nine, eleven = next_tuesday().replace(hour=9, minute=0, second=0, microsecond=0), next_tuesday().replace(
+            hour=11, minute=0, second=0, microsecond=0)
+        request = self.request_with_appointments()
+        self.assertEqual((request.total, request.appointment_count), (Decimal(15 + 23), 2))
+        self.assert_aggregates(request, Decimal(15 + 23), 2, nine, eleven + timedelta(minutes=45))
+
+        first, second = request.appointment_set.order_by('start')
+        second.cost = Decimal(30)
+        second.save(ignore_availability=True)
+        self.assert_aggregates(request, Decimal(15 + 30), 2, nine, eleven + timedelta(minutes=45))
+        second.delete()
+        self.assert_aggregates(request, Decimal(15), 1, nine, nine + timedelta(minutes=30))
+        first.hard_delete()
+        self.assert_aggregates(request, Decimal(0), 0, None, None)
+
+    def test_update_aggregates_command(self):
+        request = self.request_with_appointments()
+        Request.objects.filter(pk=request.id).update(total=0, appointment_count=0)
+        out = StringIO()
+        call_command('update_request_aggregates', owner=1, stdout=out)
+        self.assertEqual(Request.objects.get(pk=request.id).total, Decimal(15 + 23))
+        self.assertIn(f'{Request.objects.filter(owner_id=1).count()} requests updated', out.getvalue())
+
     def test_get_pending(self):
         objs = Request.objects.filter(_status='P')
         self.assertEqual(len(objs), 1)
@@ -178,3 +241,19 @@ class RequestTest(TestCaseWF):
 
         self.assertIn(request.owner.config.appointment_accepted_message, request.request_accepted_email_message)
         self.assertIn(request.owner.config.appointment_rejected_message, request.request_rejected_email_message)
+
+    def test_add_appointment_query_count(self):
+        """
+        Besides booking the appointment (9 queries) and updating the aggregates of its request, the appointments of
+        the request are loaded once with their customers to validate the request and find the replaced ones before
+        updating the request
+        """
+        r1 = get_current()
+        params = {'customer_id': 2001, 'employee_id': 1, 'owner_id': 1}
+        r1.add_appointment(start=next_tuesday().replace(hour=11, minute=0), service_id=2, **params)
+        with self.assertNumQueries(14):
+            r1.add_appointment(start=next_tuesday().replace(hour=9, minute=0), service_id=1, **params)
+        # replacing the appointment of the same service only adds its deletion, history record and aggregates update
+        with self.assertNumQueries(17):
+            r1.add_appointment(start=next_tuesday().replace(hour=14, minute=0), service_id=1, **params)
+        self.assertEqual(len(r1.appointment_set.all()), 2)
@@ -1,8 +1,14 @@
 from scheduling.models import *
 from datetime import datetime, time
 
+from django.core.cache import cache
+from django.test import override_settings
+
+from scheduling.serializers import ScheduleReadSerializer
 from scheduling.tests.generics import TestCaseWF
 
+LOCAL_MEMORY_CACHE = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
 
 class ScheduleTest(TestCaseWF):
 
@@ -46,3 +52,53 @@ class ScheduleTest(TestCaseWF):
     #     self.assertRaises(ValidationError, schedule.save)
 
 
+@override_settings(CACHES=LOCAL_MEMORY_CACHE)
+class ScheduleWeekTemplateTest(TestCaseWF):
+
+    def setUp(self):
+        cache.clear()
+        Schedule.objects.local_week_templates.clear()
+
+    def test_week_template(self):
+        template = Schedule.objects.get(pk=1).get_week_template()
+        self.assertEqual(template, ((), ((540, 780), (840, 1020)), ((540, 1050),), (), (), (), ()))
+
+    def test_week_template_is_cached(self):
+        schedule = Schedule.objects.get(pk=1)
+        schedule.get_week_template()
+        with self.assertNumQueries(0):
+            schedule.get_week_template()
+            schedule.get_availability(datetime(2019, 7, 2))
+
+        # the shared cache is used when the process does not have the template
+        Schedule.objects.local_week_templates.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(len(schedule.get_availability(datetime(2019, 7, 2))), 2)
+
+    def test_week_templates_compiled_in_one_query(self):
+        schedules = [*Schedule.objects.all()]
+        with self.assertNumQueries(1):
+            templates = Schedule.objects.week_templates(schedules)
+        self.assertEqual(templates[2][2], ((540, 1080),))
+        self.assertEqual(templates[3], ((), (), (), (), (), (), ()))
+
+    def test_time_frame_change_invalidates_template(self):
+        schedule = Schedule.objects.get(pk=1)
+        schedule.get_week_template()
+        frame = TimeFrame.objects.get(pk=3)
+        frame.end = time(18)
+        frame.save()
+        self.assertEqual(schedule.get_week_template()[1], ((540, 780), (840, 1080)))
+
+    def test_serializer_update_invalidates_template(self):
+        schedule = Schedule.objects.get(pk=1)
+        schedule.get_week_template()
+        day = {'frames': [{'start': '10:00', 'end': '12:00'}]}
+        empty = {'frames': []}
+        data = {'owner': 1, 'name': 'updated', 'mon': day, 'tue': empty, 'wed': empty, 'thu': empty, 'fri': empty,
+                'sat': empty, 'sun': empty}
+        serializer = ScheduleReadSerializer(schedule, data=data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        self.assertEqual(Schedule.objects.get(pk=1).get_week_template(), (((600, 720),), (), (), (), (), (), ()))
+
@@ -1,7 +1,9 @@
 from django.core.exceptions import ValidationError
+from django.test import override_settings
 
-from scheduling.models import Employee, Service
+from scheduling.models import Employee, Service, Customer, Appointment
 from scheduling.tests.generics import TestCaseWF
+from util.test_util import next_tuesday, book_appointment, reject_appointment
 
 
 class ServiceTest(TestCaseWF):
@@ -33,4 +35,73 @@ class ServiceTest(TestCaseWF):
         service = Service.objects.get(pk=3)
         employees = [Employee.objects.get(pk=2), Employee.objects.get(pk=5)]
 
-        self.assertRaises(ValidationError, service.employee_set.add, *employees)
\ No newline at end of file
+        self.assertRaises(ValidationError, service.employee_set.add, *employees)
+
+
+class FindAvailableEmployeeTest(TestCaseWF):
+    """Service 1 is provided by employees 1 and 2, both working 9:00 to 13:00 and 14:00 to 17:00 on tuesdays"""
+
+    def setUp(self):
+        self.service = Service.objects.get(pk=1)
+        self.customer = Customer.objects.get(pk=1001)
+        self.nine = next_tuesday().replace(hour=9, minute=0, second=0, microsecond=0)
+
+    def appointment(self, start):
+        return Appointment(owner_id=1, service=self.service, start=start, end=start + self.service.duration)
+
+    def find(self, start, policy=None):
+        employee = self.service.find_available_employee(self.appointment(start), policy)
+        return employee.id if employee is not None else None
+
+    def book(self, employee_id, start):
+        return book_appointment(Employee.objects.get(pk=employee_id), self.customer, start, self.service)
+
+    def test_same_as_checking_each_employee(self):
+        self.book(1, self.nine)
+        self.book(2, self.nine.replace(hour=10))
+        employees = Employee.objects.filter(services=self.service).order_by('id')
+        for hour, minute in [(8, 0), (9, 0), (9, 15), (10, 0), (12, 30), (12, 45), (13, 0), (16, 30), (17, 0)]:
+            appointment = self.appointment(self.nine.replace(hour=hour, minute=minute))
+            expected = next((e.id for e in employees if e.is_available(appointment)), None)
+            self.assertEqual(self.find(appointment.start), expected, appointment.start)
+
+    def test_single_query(self):
+        # the series of the company are looked up first, their occurrences are expanded when there are any
+        with self.assertNumQueries(2):
+            employee = self.find(self.nine)
+        self.assertEqual(employee, 1)
+
+    def test_rejected_and_excluded_appointments(self):
+        appointment = self.book(1, self.nine)
+        self.assertEqual(self.find(self.nine), 2)
+        # an appointment doesn't overlap with itself
+        self.assertEqual(self.service.find_available_employee(appointment).id, 1)
+        reject_appointment(appointment)
+        self.assertEqual(self.find(self.nine), 1)
+
+    def test_deleted_appointment(self):
+        self.book(1, self.nine).delete()
+        self.assertEqual(self.find(self.nine), 1)
+
+    def test_least_booked(self):
+        self.book(1, self.nine.replace(hour=11))
+        self.assertEqual(self.find(self.nine, 'first_fit'), 1)
+        self.assertEqual(self.find(self.nine, 'least_booked'), 2)
+        self.book(2, self.nine.replace(hour=14))
+        self.book(2, self.nine.replace(hour=15))
+        self.assertEqual(self.find(self.nine, 'least_booked'), 1)
+
+    def test_round_robin(self):
+        first = self.find(self.nine, 'round_robin')
+        second = 2 if first == 1 else 1
+        self.book(first, self.nine.replace(hour=11))
+        self.assertEqual(self.find(self.nine, 'round_robin'), second)
+        self.book(second, self.nine.replace(hour=12))
+        self.assertEqual(self.find(self.nine, 'round_robin'), first)
+
+    @override_settings(EMPLOYEE_SELECTION_POLICY='least_booked')
+    def test_policy_setting(self):
+        self.book(1, self.nine.replace(hour=11))
+        appointment = Appointment.objects.create(owner_id=1, service=self.service, customer=self.customer,
+                                                 start=self.nine)
+        self.assertEqual(appointment.employee_id, 2)
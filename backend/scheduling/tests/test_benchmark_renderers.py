@@ -0,0 +1,19 @@
+from django.test import TestCase
+
+from scheduling.tests.generics import BenchmarkTestMixin
+
+
+class BenchmarkRenderersTest(BenchmarkTestMixin, TestCase):
+
+    def test_results_written(self):
+        results = self.run_benchmark('benchmark_renderers', '--page-size', '5', '--employees', '1', '--repeat', '1')
+
+        # rendering and parsing the appointments and the customers with both implementations
+        self.assertEqual(len(results), 8)
+        self.assertEqual({(r['benchmark'], r['implementation'], r['operation']) for r in results},
+                         {(b, i, o) for b in ('appointments', 'customers') for i in ('package', 'kalendario')
+                          for o in ('render', 'parse')})
+        for result in results:
+            self.assertTrue(result['identical'])
+            self.assertGreater(result['bytes'], 0)
+            self.assertEqual(set(result['wall_time_ms']), {'min', 'median', 'max'})
@@ -0,0 +1,20 @@
+from django.test import TestCase
+
+from scheduling.tests.generics import BenchmarkTestMixin
+
+
+class BenchmarkSerializersTest(BenchmarkTestMixin, TestCase):
+
+    def test_results_written(self):
+        results = self.run_benchmark('benchmark_serializers', '--page-size', '5', '10', '--employees', '1',
+                                     '--repeat', '1')
+
+        # both serializers of the appointments and the customers for each page size
+        self.assertEqual(len(results), 8)
+        self.assertEqual({(r['benchmark'], r['serializer']) for r in results},
+                         {(b, s) for b in ('appointments', 'customers') for s in ('drf', 'compiled')})
+        for result in results:
+            self.assertTrue(result['identical'])
+            self.assertEqual(set(result['wall_time_ms']), {'min', 'median', 'max'})
+            self.assertGreater(result['queries'], 0)
+        self.assertEqual(results[-1]['page_size'], 10)
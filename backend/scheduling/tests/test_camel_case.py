@@ -0,0 +1,65 @@
+import datetime
+import decimal
+import io
+import uuid
+
+from django.test import SimpleTestCase
+from django.utils.translation import gettext_lazy
+from djangorestframework_camel_case.parser import CamelCaseJSONParser as PackageParser
+from djangorestframework_camel_case.render import CamelCaseJSONRenderer as PackageRenderer
+from rest_framework.exceptions import ParseError
+
+from kalendario.common.camel_case import CamelCaseJSONRenderer, CamelCaseJSONParser
+
+
+class CamelCaseJSONRendererTest(SimpleTestCase):
+    """The renderer renders the same bytes as the renderer of djangorestframework_camel_case"""
+
+    def assertSameRender(self, data, accepted_media_type=None):
+        expected = PackageRenderer().render(data, accepted_media_type)
+        self.assertEqual(CamelCaseJSONRenderer().render(data, accepted_media_type), expected)
+
+    def test_keys(self):
+        self.assertSameRender({'first_name': 'a', 'service_2_id': 1, '_private': 2, 'already': {'camelCase': 3},
+                               1: 'int key', gettext_lazy('lazy_key'): gettext_lazy('lazy value')})
+
+    def test_values(self):
+        self.assertSameRender([
+            'ação €', 'line \u2028 separator \u2029', True, None, 10 ** 20, 0.1, 1e-05, 1e16, 12.5,
+            decimal.Decimal('10.50'), datetime.datetime(2021, 5, 3, 9, 30, 0, 123456), datetime.date(2021, 5, 3),
+            datetime.time(9, 30), datetime.timedelta(minutes=30), uuid.UUID(int=1), ('tuple', {'in_tuple': 1}),
+        ])
+
+    def test_indent(self):
+        self.assertSameRender({'first_name': ['a', 'b']}, 'application/json; indent=4')
+
+    def test_not_serializable(self):
+        for renderer in (PackageRenderer(), CamelCaseJSONRenderer()):
+            with self.assertRaises(TypeError):
+                renderer.render({'value': object()})
+
+    def test_nan(self):
+        for renderer in (PackageRenderer(), CamelCaseJSONRenderer()):
+            with self.assertRaises(ValueError):
+                renderer.render({'value': float('nan')})
+
+    def test_none(self):
+        self.assertEqual(CamelCaseJSONRenderer().render(None), b'')
+
+
+class CamelCaseJSONParserTest(SimpleTestCase):
+    """The parser parses the same data as the parser of djangorestframework_camel_case"""
+
+    def assertSameParse(self, content):
+        expected = PackageParser().parse(io.BytesIO(content))
+        self.assertEqual(CamelCaseJSONParser().parse(io.BytesIO(content)), expected)
+
+    def test_keys(self):
+        self.assertSameParse(b'{"firstName": "a", "service2Id": 1, "HTTPResponse": [{"innerKey": 2}], "snake_key": 3}')
+
+    def test_values(self):
+        self.assertSameParse('["ação", 1.5, 100000000000000000000, NaN, null, true]'.encode())
+
+    def test_invalid(self):
+        with self.assertRaises(ParseError):
+            CamelCaseJSONParser().parse(io.BytesIO(b'{"firstName": '))
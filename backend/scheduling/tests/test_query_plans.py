@@ -0,0 +1,104 @@
+import datetime
+
+from django.db import connection
+from django.urls import reverse
+
+from core.models import User
+from scheduling import models
+from scheduling.tests import factories
+from scheduling.tests.generics import ViewTestCase
+from util import test_util as util
+
+COMPANIES = 20
+EMPLOYEES_PER_COMPANY = 3
+DAYS = 120
+APPOINTMENTS_PER_DAY = 4
+
+
+class SqlRecorder:
+    """Records the statements executed while installed with connection.execute_wrapper"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def generate_appointments(companies):
+    """
+    Books APPOINTMENTS_PER_DAY appointments a day for every employee of the companies around today,
+    the table is analyzed afterwards so the planner knows its real size
+    :return: the employees created
+    """
+    first_day = datetime.datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) - \
+        datetime.timedelta(days=DAYS // 2)
+    appointments, employees = [], []
+    for company in companies:
+        customer = factories.CustomerFactory.create(owner=company)
+        for _ in range(EMPLOYEES_PER_COMPANY):
+            employee = factories.EmployeeFactory.create(owner=company)
+            employees.append(employee)
+            for day in range(DAYS):
+                for hour in range(APPOINTMENTS_PER_DAY):
+                    start = first_day + datetime.timedelta(days=day, hours=9 + hour)
+                    appointments.append(models.Appointment(owner=company, employee=employee, customer=customer,
+                                                           start=start, end=start + datetime.timedelta(minutes=45),
+                                                           status=models.Appointment.ACCEPTED))
+    models.Appointment.objects.bulk_create(appointments, batch_size=5000)
+    with connection.cursor() as cursor:
+        cursor.execute('ANALYZE scheduling_appointment')
+    return employees
+
+
+class AppointmentQueryPlanTest(ViewTestCase):
+    """The calendar week view must be answered from the appointment indexes, not by reading the whole table"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.get(pk=1)
+        cls.user.groups.add(util.company_1_master_group())
+        companies = [models.Company.objects.get(pk=cls.user.owner_id)]
+        companies += [factories.CompanyFactory.create(name=f'query plans {i}') for i in range(COMPANIES - 1)]
+        cls.employees = [e.id for e in generate_appointments(companies) if e.owner_id == cls.user.owner_id]
+
+    def setUp(self):
+        self.list_url = reverse('appointment-list')
+        self.client.force_authenticate(user=self.user)
+
+    def week(self):
+        monday = datetime.date.today() + datetime.timedelta(days=7 - datetime.date.today().weekday())
+        return {'from_date': monday.strftime('%Y-%m-%dT00:00'),
+                'to_date': (monday + datetime.timedelta(days=6)).strftime('%Y-%m-%dT23:59')}
+
+    def appointment_plans(self, params):
+        """Calls the list endpoint and returns the query plan of every statement that read the appointments"""
+        recorder = SqlRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.client.get(self.list_url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'])
+
+        plans = []
+        with connection.cursor() as cursor:
+            for sql, sql_params in recorder.statements:
+                if 'FROM "scheduling_appointment"' in sql:
+                    cursor.execute('EXPLAIN ' + sql, sql_params)
+                    plans.append('\n'.join(row[0] for row in cursor.fetchall()))
+        self.assertTrue(plans)
+        return plans
+
+    def assertIndexScans(self, plans):
+        for plan in plans:
+            self.assertNotIn('Seq Scan on scheduling_appointment', plan)
+            self.assertRegex(plan, r'(Index Scan using|Bitmap Index Scan on) apt_')
+
+    def test_company_week_uses_index(self):
+        self.assertIndexScans(self.appointment_plans(self.week()))
+
+    def test_employee_week_uses_index(self):
+        self.assertIndexScans(self.appointment_plans({**self.week(), 'employee': self.employees[0]}))
+
+    def test_employees_week_uses_index(self):
+        self.assertIndexScans(self.appointment_plans({**self.week(), 'employees': self.employees[:2]}))
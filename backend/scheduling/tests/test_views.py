@@ -1,10 +1,17 @@
+import datetime
+import json
+from unittest import mock
+
 from django.contrib.auth.models import Permission
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from rest_framework import status
 
+from kalendario.common.compiled import compile_serializer
 from util import test_util as util
 from core.models import User
-from scheduling import models
+from scheduling import models, serializers
 from scheduling.tests.generics import ViewTestCase
 
 
@@ -273,6 +280,50 @@ class AppointmentViewSetTest(ViewTestCase):
         response = self.client.post(self.list_url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_admin_list_compact(self):
+        self._auth_as_admin()
+        day = util.next_wednesday().replace(hour=0, minute=0, second=0, microsecond=0)
+        params = {'from_date': str(day), 'to_date': str(day + datetime.timedelta(days=1))}
+        regular = self.client.get(self.list_url, params)
+        compact = self.client.get(self.list_url, {**params, 'compact': True})
+        self.assertEqual(compact.status_code, status.HTTP_200_OK)
+        self.assertLess(len(compact.content), len(regular.content))
+
+        appointments, columns = regular.data['results'], compact.data['results']['appointments']
+        self.assertTrue(appointments)
+        self.assertEqual(columns['id'], [apt['id'] for apt in appointments])
+        self.assertEqual(columns['start'], [apt['start'] for apt in appointments])
+        self.assertEqual(columns['status'], [apt['status'] for apt in appointments])
+        for name, field in (('employees', 'employee'), ('customers', 'customer'), ('services', 'service')):
+            related = {obj['id']: obj for obj in compact.data['results'][name]}
+            # each one is rendered once, the same way the regular output nests it
+            self.assertEqual(len(related), len(compact.data['results'][name]))
+            self.assertEqual(columns[field], [apt[field]['id'] for apt in appointments])
+            for apt in appointments:
+                self.assertEqual(related[apt[field]['id']], apt[field])
+
+    def test_admin_bulk_create(self):
+        emp, customer, service = emp_customer_service()
+        self._auth_as_admin()
+
+        start = util.next_tuesday().replace(hour=10, minute=0)
+        data = {'appointments': [create_apt_data(emp, customer, service, start + service.duration * i)
+                                 for i in range(3)]}
+        response = self.client.post(self.list_url + 'bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(response.data[0]['employee']['id'], emp.id)
+
+        # the second appointment overlaps the ones booked above, nothing is booked
+        data['appointments'][1] = create_apt_data(emp, customer, service, start + service.duration * 3)
+        response = self.client.post(self.list_url + 'bulk/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        errors = response.data['detail']['appointments']
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(errors[1], {})
+        self.assertEqual(str(errors[0]['nonFieldErrors'][0]), 'No time available for the date selected')
+        self.assertFalse(models.Appointment.objects.filter(start=data['appointments'][1]['start']).exists())
+
     def test_admin_create_overlapping(self):
         """
         When creating overlapping appointments
@@ -568,6 +619,187 @@ class AppointmentViewSetTest(ViewTestCase):
         self.assertEqual(len_before, len(after))
 
 
+class AppointmentSeriesViewSetTest(ViewTestCase):
+
+    def setUp(self):
+        self.list_url = reverse('appointment-series-list')
+        self.nine = util.next_tuesday().replace(hour=9, minute=0, second=0, microsecond=0)
+        user = User.objects.get(pk=1)
+        user.groups.add(util.company_1_master_group())
+        util.add_permissions(user, 'appointmentseries')
+        self.client.force_authenticate(user=user)
+
+    def create_series(self, rule='FREQ=WEEKLY;COUNT=4'):
+        emp, customer, service = emp_customer_service()
+        data = {**create_apt_data(emp, customer, service, self.nine), 'rrule': rule}
+        del data['end']
+        return self.client.post(self.list_url, data, format='json')
+
+    def occurrence_url(self, series_id, action):
+        return reverse(f'appointment-series-{action}', kwargs={'pk': series_id})
+
+    def test_admin_create(self):
+        response = self.create_series()
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['until'], (self.nine + datetime.timedelta(weeks=3, minutes=30)).isoformat())
+        self.assertFalse(models.Appointment.objects.filter(series=response.data['id']).exists())
+
+    def test_admin_create_invalid_rule(self):
+        response = self.create_series('FREQ=HOURLY;COUNT=2')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_customer_create_not_allowed(self):
+        self.client.force_authenticate(user=test_user())
+        self.assertEqual(self.create_series().status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_appointments_list_includes_occurrences(self):
+        series_id = self.create_series().data['id']
+        params = {'from_date': str(self.nine), 'to_date': str(self.nine + datetime.timedelta(weeks=2))}
+        response = self.client.get(reverse('appointment-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([(apt['series'], apt['id']) for apt in results], [(series_id, None)] * 2)
+        self.assertEqual(results[1]['occurrence'], (self.nine + datetime.timedelta(weeks=1)).isoformat())
+
+    def test_appointments_list_paginates_occurrences(self):
+        series_id = self.create_series().data['id']
+        emp, customer, service = emp_customer_service()
+        for week in range(4):
+            start = self.nine + datetime.timedelta(weeks=week, hours=1)
+            data = create_apt_data(emp, customer, service, start)
+            self.assertEqual(self.client.post(reverse('appointment-list'), data, format='json').status_code,
+                             status.HTTP_201_CREATED)
+        params = {'from_date': str(self.nine), 'to_date': str(self.nine + datetime.timedelta(weeks=4))}
+        pages = [self.client.get(reverse('appointment-list'), {**params, 'page_size': 3, 'page': page}).data
+                 for page in (1, 2, 3)]
+        self.assertEqual([page['count'] for page in pages], [8] * 3)
+        results = [apt for page in pages for apt in page['results']]
+        self.assertEqual([apt['series'] for apt in results], [series_id, None] * 4)
+        self.assertEqual([apt['start'] for apt in results], sorted(apt['start'] for apt in results))
+
+    def test_appointments_list_range_too_long(self):
+        params = {'from_date': str(self.nine), 'to_date': str(self.nine + datetime.timedelta(days=367))}
+        response = self.client.get(reverse('appointment-list'), params)
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_admin_edit_occurrence(self):
+        series_id = self.create_series().data['id']
+        occurrence = self.nine + datetime.timedelta(weeks=1)
+        data = {'occurrence': str(occurrence), 'start': str(occurrence + datetime.timedelta(hours=1))}
+        response = self.client.post(self.occurrence_url(series_id, 'occurrence'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['end'], (occurrence + datetime.timedelta(hours=1, minutes=30)).isoformat())
+        self.assertEqual(models.Appointment.objects.get(series=series_id).occurrence, occurrence)
+
+        response = self.client.post(self.occurrence_url(series_id, 'occurrence'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_admin_cancel_occurrence(self):
+        series_id = self.create_series().data['id']
+        data = {'occurrence': str(self.nine)}
+        response = self.client.post(self.occurrence_url(series_id, 'cancel'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNotNone(response.data['deleted'])
+
+        params = {'from_date': str(self.nine), 'to_date': str(self.nine + datetime.timedelta(days=1))}
+        response = self.client.get(reverse('appointment-list'), params)
+        self.assertEqual(response.data['results'], [])
+
+
+class ListQueryCountTest(ViewTestCase):
+    """The relations rendered by the read serializers are loaded along with the page, whatever its size"""
+
+    def setUp(self):
+        user = User.objects.get(pk=1)
+        user.groups.add(util.company_1_master_group())
+        util.add_permissions(user, 'schedule')
+        self.client.force_authenticate(user=user)
+        self.monday = util.next_monday().replace(hour=9, minute=0, second=0, microsecond=0)
+
+    def appointments(self, amount, day=0, **kwargs):
+        start = self.monday + datetime.timedelta(days=day)
+        return [models.Appointment(owner_id=1, employee_id=1 + i % 2, customer_id=1001, service_id=1 + i % 2,
+                                   start=start + datetime.timedelta(hours=i),
+                                   end=start + datetime.timedelta(hours=i, minutes=30), **kwargs)
+                for i in range(amount)]
+
+    def assertConstantQueries(self, url, params=None):
+        """Lists a page of 1 and a page of 10 objects, both cost the same amount of queries"""
+        # the permissions of the user are cached by the first request
+        self.client.get(url, params)
+        counts = []
+        for page_size in (1, 10):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, {**(params or {}), 'page_size': page_size})
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), page_size)
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_appointments(self):
+        models.Appointment.objects.bulk_create(self.appointments(10))
+        self.assertConstantQueries(reverse('appointment-list'))
+
+    def test_schedules(self):
+        # the frames of each day are prefetched once the page has a shift on that day, all these work every day
+        for i in range(10):
+            shifts = {}
+            for day in ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun'):
+                shifts[day] = models.Shift.objects.create()
+                models.TimeFrame.objects.create(shift=shifts[day], start=datetime.time(9), end=datetime.time(17))
+            # sorted before the schedules of the fixtures
+            models.Schedule.objects.create(owner_id=1, name=f'0{i} schedule', **shifts)
+        self.assertConstantQueries(reverse('schedule-list'))
+
+
+class CompiledListTest(ViewTestCase):
+    """The lists rendered by the compiled read serializers are the same the serializers render"""
+
+    def setUp(self):
+        user = User.objects.get(pk=1)
+        user.groups.add(util.company_1_master_group())
+        for model in ('customer', 'employee', 'service', 'schedule'):
+            util.add_permissions(user, model)
+        self.client.force_authenticate(user=user)
+
+    def assertSameContent(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['results'])
+        with mock.patch('kalendario.common.mixins.compile_serializer', return_value=None):
+            expected = self.client.get(url, params)
+        self.assertEqual(response.content, expected.content)
+
+    def test_compiled(self):
+        for serializer_class in (serializers.AppointmentReadSerializer, serializers.CustomerSerializer,
+                                 serializers.EmployeeSerializer, serializers.ScheduleReadSerializer):
+            self.assertIsNotNone(compile_serializer(serializer_class))
+        # the users render their permissions with a method
+        self.assertIsNone(compile_serializer(serializers.UserSerializer))
+
+    def test_appointments(self):
+        service = models.Service.objects.get(pk=1)
+        service.cost, service.is_from = 10, True
+        service.save()
+        models.Service.objects.filter(pk=2).update(cost=0)
+        models.Employee.objects.filter(pk=1).update(profile_img='image/upload/v1/profile.jpg')
+        models.Appointment.objects.filter(pk__in=[1, 2]).update(customer=None, service=None)
+        models.Appointment.objects.filter(pk=3).delete()
+        self.assertSameContent(reverse('appointment-list'))
+        self.assertSameContent(reverse('appointment-list'), {'show_all': True})
+
+    def test_appointments_range(self):
+        start = util.next_monday().replace(hour=9, minute=0, second=0, microsecond=0)
+        models.Appointment(owner_id=1, employee_id=1, customer_id=1001, service_id=1, start=start,
+                           end=start + datetime.timedelta(minutes=30)).save(ignore_availability=True)
+        params = {'from_date': start.strftime('%Y-%m-%dT00:00'), 'to_date': start.strftime('%Y-%m-%dT23:59')}
+        self.assertSameContent(reverse('appointment-list'), params)
+
+    def test_other_lists(self):
+        for name in ('customer-list', 'employee-list', 'service-list', 'schedule-list'):
+            self.assertSameContent(reverse(name))
+
+
 class CompanyViewSetTest(ViewTestCase):
 
     def setUp(self):
@@ -717,6 +949,16 @@ class RequestViewSetTest(ViewTestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data.get('status'), 'A')
 
+    def test_total_rendered_as_number(self):
+        user = User.objects.get(pk=1)
+        user.enable_company_editing(1)
+        self.client.force_authenticate(user=user)
+
+        response = self.client.get(self.list_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for request in json.loads(response.content)['results']:
+            self.assertIsInstance(request['total'], float)
+
 
 class CustomerViewSetTest(ViewTestCase):
 
@@ -10,6 +10,7 @@ router.register(r'serviceCategories', views.ServiceCategoryViewSet, 'service-cat
 router.register(r'schedules', views.ScheduleViewSet, 'schedule')
 router.register(r'customers', views.CustomerViewSet, 'customer')
 router.register(r'appointments', views.AppointmentViewSet, 'appointment')
+router.register(r'appointmentSeries', views.AppointmentSeriesViewSet, 'appointment-series')
 router.register(r'requests', views.RequestViewSet, 'request')
 router.register(r'companies', views.CompanyViewSet, 'company')
 router.register(r'panels', views.SchedulingPanelViewSet, 'panel')
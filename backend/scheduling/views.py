@@ -1,3 +1,5 @@
+from operator import attrgetter
+
 import cloudinary.uploader as cloudinary_uploader
 from cloudinary import CloudinaryResource
 
@@ -8,6 +10,8 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 
 from kalendario.common import viewsets, mixins, mail
+from kalendario.common.optimizer import optimize_queryset
+from kalendario.common.pagination import MergedList
 from scheduling import serializers, models
 import logging
 logger = logging.getLogger(__name__)
@@ -144,6 +148,25 @@ class AppointmentViewSet(mixins.WithPermissionsMixin,
         else:
             queryset = models.Appointment.objects.all()
 
+        queryset = self.filter_by_params(queryset, params)
+
+        from_date = params.get('from_date')
+        to_date = params.get('to_date')
+        if from_date is not None and to_date is None:
+            queryset = queryset.filter(start__gte=from_date)
+
+        if to_date is not None and from_date is None:
+            queryset = queryset.filter(start__lte=to_date)
+
+        if from_date is not None and to_date is not None:
+            # an appointment is in the range when it starts before the range ends and ends after it starts,
+            # written as a single AND so it can use the (owner, start) and (employee, start, end) indexes
+            queryset = queryset.filter(start__lt=to_date, end__gt=from_date)
+
+        return queryset.order_by('start')
+
+    def filter_by_params(self, queryset, params):
+        """Filters a queryset of appointments or of series of appointments by the employees, services and customer"""
         # if a request reaches here and the user has no permission to view appointments
         # it means the user is an employee and
         # should only view appointments related to the employee of the user
@@ -159,23 +182,32 @@ class AppointmentViewSet(mixins.WithPermissionsMixin,
         if params.get('services') is not None:
             queryset = queryset.filter(service_id__in=params.get('services'))
 
-        from_date = params.get('from_date')
-        to_date = params.get('to_date')
-        if from_date is not None and to_date is None:
-            queryset = queryset.filter(start__gte=from_date)
-
-        if to_date is not None and from_date is None:
-            queryset = queryset.filter(start__lte=to_date)
-
-        if from_date is not None and to_date is not None:
-            queryset = queryset.filter(Q(start__gte=from_date, start__lte=to_date) |
-                                       Q(end__gte=from_date, end__lte=to_date) |
-                                       Q(start__lte=from_date, end__gte=to_date))
-
         if params.get('customer') is not None:
             queryset = queryset.filter(customer=params.get('customer'))
 
-        return queryset.order_by('start')
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        params = self.get_queryset_params()
+        from_date, to_date = params.get('from_date'), params.get('to_date')
+        appointments = self.filter_queryset(self.get_queryset())
+        if from_date is not None and to_date is not None and not params.get('deleted_only'):
+            # the occurrences of the series in the range aren't stored, they are expanded and merged with the
+            # appointments, a page only reads its window of the appointments
+            series = models.AppointmentSeries.objects.prefetch_related('employee__services')
+            series = self.filter_by_params(self.filter_queryset(series), params)
+            occurrences = series.occurrences(from_date, to_date)
+            if occurrences:
+                appointments = MergedList(appointments, occurrences, key=attrgetter('start'))
+
+        if not params.get('compact'):
+            return self.list_response(appointments)
+
+        # the compact output renders a column per field and each employee, customer and service once
+        page = self.paginate_queryset(appointments)
+        if page is not None:
+            return self.get_paginated_response(serializers.CompactAppointmentsSerializer(page).data)
+        return Response(serializers.CompactAppointmentsSerializer(appointments).data)
 
     @action(detail=False, methods=['post'])
     def lock(self, request, *args, **kwargs):
@@ -185,10 +217,22 @@ class AppointmentViewSet(mixins.WithPermissionsMixin,
     def plock(self, request, *args, **kwargs):
         return self.partial_update(request, *args, **kwargs)
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request, *args, **kwargs):
+        """Creates a batch of appointments at once, either all of them are created or none"""
+        serializer = serializers.AppointmentBulkWriteSerializer(data=request.data,
+                                                                context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        booked = serializer.save(owner=request.user.owner_id)
+        queryset = optimize_queryset(models.Appointment.objects.filter(id__in=[apt.id for apt in booked]),
+                                     self.get_read_serializer_class()).order_by('start')
+        serializer = self.get_read_serializer(queryset, many=True)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['get'])
     def history(self, request, *args, **kwargs):
         instance = self.get_object()
-        queryset = instance.history.all()
+        queryset = optimize_queryset(instance.history.all(), serializers.AppointmentHistorySerializer)
         page = self.paginate_queryset(queryset)
         if page is not None:
             serializer = serializers.AppointmentHistorySerializer(page, many=True)
@@ -198,6 +242,32 @@ class AppointmentViewSet(mixins.WithPermissionsMixin,
         return Response(serializer.data)
 
 
+class AppointmentSeriesViewSet(mixins.WithPermissionsMixin,
+                               mixins.AuthOwnerFilterMixin,
+                               viewsets.ModelViewSet):
+    serializer_class = serializers.AppointmentSeriesSerializer
+    queryset = models.AppointmentSeries.objects.order_by('start')
+
+    def get_serializer_context(self):
+        return {'user': self.request.user}
+
+    @action(detail=True, methods=['post'])
+    def occurrence(self, request, *args, **kwargs):
+        """Stores an occurrence of the series as an appointment with the changes provided"""
+        serializer = serializers.SeriesOccurrenceSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        appointment = serializer.edit(self.get_object())
+        return Response(serializers.AppointmentReadSerializer(appointment).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, *args, **kwargs):
+        """Stores an occurrence of the series as a deleted appointment, so it isn't listed nor keeps the time busy"""
+        serializer = serializers.SeriesOccurrenceSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        appointment = self.get_object().cancel_occurrence(serializer.validated_data['occurrence'])
+        return Response(serializers.AppointmentReadSerializer(appointment).data, status=status.HTTP_201_CREATED)
+
+
 class CompanyViewSet(mixins.WithPermissionsMixin,
                      mixins.AuthOwnerFilterMixin,
                      viewsets.ModelViewSet):